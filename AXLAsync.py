@@ -0,0 +1,220 @@
+"""Asyncio AXL client for bulk operations
+
+A thread per in-flight AXL call stops scaling somewhere in the tens of workers. On a
+publisher with a few hundred ms of latency per call, logouts and builds go faster
+with hundreds of calls waiting at once, which is cheap with coroutines. AsyncAXL wraps
+zeep's AsyncClient with a semaphore capping the calls in flight, and the same schema
+cache (AXLConnection.py) and per cluster token bucket (AXLScheduler.py) as the
+threaded scripts.
+
+    async with AXLAsync.AsyncAXL(serverUrl, cucmusername, cucmpassword, verify=sessionCert) as axl:
+        results = await AXLAsync.log_out_phones(axl, phones)
+
+Requests go over aiohttp rather than zeep's own httpx AsyncTransport, whose
+connection pool gets CPU bound past a few dozen connections. AXLBenchmark.py
+compares this against the threaded path on a local stub server.
+"""
+import asyncio
+import logging
+import ssl
+import time
+
+import aiohttp
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from zeep import AsyncClient, Settings
+from zeep.exceptions import Fault, TransportError
+from zeep.proxy import AsyncServiceProxy
+from zeep.transports import Transport
+from zeep.wsdl.utils import etree_to_string
+
+import AXLConnection
+import AXLEnvelope
+import AXLMetrics
+import AXLScheduler
+import AXLTransport
+import BuildPlan
+import ExtensionMobility
+import Reconcile
+import WireLog
+
+# The WSDL is a local file in the working directory, see README
+WSDL_FILE = 'schema/AXLAPI.wsdl'
+BINDING = '{http://www.cisco.com/AXLAPIService/}AXLAPIBinding'
+
+# Most AXL calls in flight at once. The cluster's token bucket still decides how many are sent per second
+AXL_CONCURRENCY = 100
+
+
+class ThrottledAsyncTransport(Transport):
+    # AXLScheduler.ThrottledTransport for zeep's AsyncClient. The WSDL is still loaded
+    # synchronously from the local file, only operations go over self.client (an aiohttp session)
+
+    def __init__(self, serverUrl, bucket=None, retries=AXLScheduler.THROTTLE_RETRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket = bucket or AXLScheduler.get_bucket(serverUrl)
+        self.retries = retries
+        self.client = None
+
+    async def _post_once(self, address, message, headers):
+        # Read the whole body and hand zeep a requests.Response, like the sync transport does
+        connectTimeout, readTimeout = AXLTransport.operation_timeout(headers)
+        timeout = aiohttp.ClientTimeout(sock_connect=connectTimeout, sock_read=readTimeout)
+        async with self.client.post(address, data=message, headers=headers, timeout=timeout) as aioResponse:
+            response = Response()
+            response._content = await aioResponse.read()
+            response.status_code = aioResponse.status
+            response.headers = CaseInsensitiveDict(aioResponse.headers)
+            response.encoding = aioResponse.charset
+            return response
+
+    async def post(self, address, message, headers):
+        # Timed and counted per operation (AXLMetrics.py), and wire logged if that's on (WireLog.py)
+        start = time.monotonic()
+        response = None
+        try:
+            response = await self._post_throttled(address, message, headers)
+            return response
+        finally:
+            AXLMetrics.record(address, headers, time.monotonic() - start, len(message),
+                              len(response.content) if response is not None else 0,
+                              response is None or response.status_code >= 400)
+            WireLog.record(address, headers, message, response)
+
+    async def _post_throttled(self, address, message, headers):
+        attempt = 0
+        while True:
+            await self.bucket.acquire_async()
+            response = await self._post_once(address, message, headers)
+            if not AXLScheduler.is_throttled(response):
+                self.bucket.succeeded()
+                return response
+            AXLMetrics.throttled(address, headers)
+            pause = AXLScheduler._backoff(response, attempt)
+            rate = self.bucket.throttled(pause)
+            if attempt >= self.retries:
+                logging.error(f'AXL still throttled (HTTP {response.status_code}) after {attempt + 1} tries')
+                return response
+            logging.warning(f'AXL throttled (HTTP {response.status_code}), retrying in {pause:.1f}s '
+                            f'at {rate:.1f} calls/s')
+            attempt += 1
+
+    async def post_xml(self, address, envelope, headers):
+        return await self.post(address, etree_to_string(envelope), headers)
+
+
+class AsyncAXL:
+
+    def __init__(self, serverUrl, cucmusername, cucmpassword, verify=True, concurrency=AXL_CONCURRENCY,
+                 bucket=None, wsdlFile=WSDL_FILE, plugins=None):
+        if isinstance(verify, str):
+            # A certificate chain file, like session.verify = sessionCert
+            verify = ssl.create_default_context(cafile=verify)
+        self.verify = None if verify is True else verify
+        self.auth = aiohttp.BasicAuth(cucmusername, cucmpassword)
+        self.concurrency = concurrency
+        self.transport = ThrottledAsyncTransport(serverUrl, bucket=bucket)
+        settings = Settings(strict=False, xml_huge_tree=True)
+        self.client = AXLConnection.load_client(wsdlFile, clientClass=AsyncClient, settings=settings,
+                                                transport=self.transport, plugins=plugins or [])
+        # AsyncClient.create_service() returns a sync proxy, bind the async one directly
+        self.service = AsyncServiceProxy(self.client, self.client.wsdl.bindings[BINDING], address=serverUrl)
+        self.semaphore = None
+
+    def _open(self):
+        # The session and semaphore belong to the running event loop, so they're made on first use
+        if self.transport.client is None:
+            # One keep-alive connection per call that can be in flight. Timeouts are set per request
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ssl=self.verify)
+            self.transport.client = aiohttp.ClientSession(connector=connector, auth=self.auth,
+                                                          headers={'Accept-Encoding': 'gzip, deflate'})
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def call(self, operation, *args, **kwargs):
+        # Waits for a free slot, then sends the request. Faults are raised like the sync service's.
+        # Whitelisted writes use a precompiled envelope when that's on (AXLEnvelope.py)
+        self._open()
+        async with self.semaphore:
+            if AXLEnvelope.is_fast(operation, args, kwargs):
+                response = await self.transport.post(*AXLEnvelope.prepare(self.service, operation, kwargs))
+                return AXLEnvelope.process_reply(self.service, operation, response)
+            return await getattr(self.service, operation)(*args, **kwargs)
+
+    async def aclose(self):
+        if self.transport.client is not None:
+            await self.transport.client.close()
+            self.transport.client = None
+
+    async def __aenter__(self):
+        self._open()
+        return self
+
+    async def __aexit__(self, *excInfo):
+        await self.aclose()
+
+
+async def log_out_phone(axl, phone, retries=ExtensionMobility.LOGOUT_RETRIES, backoff=ExtensionMobility.RETRY_BACKOFF):
+    # ExtensionMobility.log_out_phone() on the asyncio client, with the same retry and skip rules
+    for attempt in range(retries + 1):
+        try:
+            await axl.call('doDeviceLogout', deviceName=phone)
+            return 'logged out', ''
+        except Fault as err:
+            if any(text in str(err) for text in ExtensionMobility.SKIP_FAULTS):
+                return 'skipped', str(err)
+            if not any(text in str(err) for text in ExtensionMobility.TRANSIENT_FAULTS) or attempt == retries:
+                return 'failed', str(err)
+        except (TransportError, aiohttp.ClientError, asyncio.TimeoutError) as err:
+            if attempt == retries:
+                return 'failed', str(err) or type(err).__name__
+        await asyncio.sleep(backoff * 2 ** attempt)
+
+
+async def log_out_phones(axl, phones, progress=None, cluster=None, **kwargs):
+    # {phone: (status, error)} for every phone, all started at once and limited by the semaphore.
+    # progress is called after each phone, e.g. spinner.next
+    async def _log_out(phone):
+        start = time.monotonic()
+        outcome = await log_out_phone(axl, phone, **kwargs)
+        ExtensionMobility.audit_logout(phone, *outcome, time.monotonic() - start, cluster)
+        if progress is not None:
+            progress()
+        return phone, outcome
+
+    return dict(await asyncio.gather(*(_log_out(phone) for phone in phones)))
+
+
+async def get_line_devices(axl, build):
+    # Raises Fault if the extension doesn't exist
+    lineResp = await axl.call('getLine', pattern=build['phoneExt'], routePartitionName=build['routePartitionName'])
+    return lineResp['return'].line.associatedDevices
+
+
+async def run_plan(axl, build, steps, journal=None):
+    # BuildPlan.run_plan() on the asyncio client, other builds run while this one waits on CUCM
+    for step in BuildPlan.pending_steps(steps, build, journal):
+        start = time.monotonic()
+        args, kwargs = BuildPlan.step_args(build, step)
+        try:
+            resp = await axl.call(step['operation'], *args, **kwargs)
+            BuildPlan.apply_result(build, step, resp)
+        except Exception as err:
+            BuildPlan.audit_step(build, step, time.monotonic() - start, err)
+            raise
+        BuildPlan.record_step(build, step, journal)
+        BuildPlan.audit_step(build, step, time.monotonic() - start)
+    if journal is not None:
+        journal.finish(BuildPlan.build_id(build))
+
+
+async def fetch_current(axl, build, steps):
+    # Reconcile.fetch_current() on the asyncio client, the reads are sent together
+    async def _read(objectKey, operation, kwargs):
+        try:
+            return objectKey, Reconcile.current_object(await axl.call(operation, **kwargs))
+        except Fault as err:
+            if 'not found' not in str(err):
+                raise
+            return objectKey, None
+
+    return dict(await asyncio.gather(*(_read(*read) for read in Reconcile.current_reads(build, steps))))
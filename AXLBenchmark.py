@@ -0,0 +1,341 @@
+"""End to end provisioning and logout benchmarks against the fake AXL server
+
+Starts FakeAXLServer.py on 127.0.0.1, seeds it with users, free extensions and
+logged in phones, then runs the real flows against it:
+    logout  ExMoBulkLogout.py: SQL discovery, then doDeviceLogout per phone, threaded
+            (AXLTransport on a worker pool) and with AXLAsync.AsyncAXL
+    build   StandardPhoneSetup.py: user lookup, line check and the compiled build plan,
+            one build at a time and BulkPhoneSetup.py style on a worker pool
+    list    listPhone pages parsed by zeep and by AXLFastList.py's iterparse: CPU and
+            peak memory per page, then the whole listPhone ExMo discovery both ways
+    envelope  CPU to serialize one doDeviceLogout request with zeep
+            and from AXLEnvelope.py's precompiled template (the logout suite also
+            runs with the templates on)
+Each run reports the rate (logouts/s, builds/s) and the p50/p99 time of one logout or
+build. Nothing is sent to CUCM, but the local schema files are needed.
+
+Usage:
+    python AXLBenchmark.py --calls 2000 --latency 0.1 --workers 8 --concurrency 200
+    python AXLBenchmark.py --suite build --builds 200 --latency 0.05 --fault-rate 0.01
+    python AXLBenchmark.py --suite list --calls 20000 --page-size 1000 --latency 0
+    python AXLBenchmark.py --suite envelope --calls 20000
+"""
+import argparse
+import asyncio
+import math
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.exceptions import RequestException
+from zeep import Settings
+from zeep.exceptions import Fault, TransportError
+from zeep.wsdl.utils import etree_to_string
+
+import AXLAsync
+import AXLConnection
+import AXLEnvelope
+import AXLFastList
+import AXLScheduler
+import AXLTransport
+import BuildPlan
+import ExtensionMobility
+import FakeAXLServer
+import PhoneBuild
+import Sites
+
+# Unpaced, so the benchmark measures the clients and not the token bucket
+BENCHMARK_RATE = 1000000.0
+
+BENCHMARK_SITE = ('US', 'LOCATION1')
+BENCHMARK_MODEL = '8845'
+
+# Times each listPhone page is parsed by each parser in the list suite
+PARSE_REPEATS = 5
+
+
+def percentile(values, percent):
+    # Nearest rank, so p99 of 100 values is the 99th fastest
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def report(label, count, unit, elapsed, durations, failed):
+    print(f'{label:>36}: {count} {unit}s in {elapsed:6.1f}s  {count / elapsed:8.1f} {unit}s/s  '
+          f'p50 {percentile(durations, 50) * 1000:6.0f}ms  p99 {percentile(durations, 99) * 1000:6.0f}ms'
+          + (f'  {failed} failed' if failed else ''))
+
+
+def _bucket():
+    return AXLScheduler.TokenBucket(rate=BENCHMARK_RATE, maxRate=BENCHMARK_RATE)
+
+
+def _service(serverUrl, workers):
+    session = AXLTransport.new_session(poolSize=workers)
+    session.auth = ('benchmark', 'benchmark')
+    transport = AXLTransport.AXLTransport(serverUrl, bucket=_bucket(), session=session)
+    client = AXLConnection.load_client(AXLAsync.WSDL_FILE, settings=Settings(strict=False, xml_huge_tree=True),
+                                       transport=transport)
+    return client.create_service(AXLAsync.BINDING, serverUrl)
+
+
+def _timed(function):
+    # function(*args) -> (duration, result)
+    def _run(*args):
+        start = time.monotonic()
+        result = function(*args)
+        return time.monotonic() - start, result
+    return _run
+
+
+def _log_in_all(server):
+    with server.store.lock:
+        server.store.loggedIn = set(server.store.phones)
+
+
+def run_logout_threaded(server, workers):
+    # (elapsed, per logout durations, failed)
+    _log_in_all(server)
+    service = _service(server.url, workers)
+    start = time.monotonic()
+    phones = ExtensionMobility.logged_in_phones_sql(service)
+    logOut = _timed(lambda phone: ExtensionMobility.log_out_phone(service, phone, backoff=0.01))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(logOut, phones))
+    elapsed = time.monotonic() - start
+    return elapsed, [duration for duration, outcome in results], sum(outcome[0] == 'failed' for _, outcome in results)
+
+
+async def _run_logout_async(server, concurrency):
+    _log_in_all(server)
+    async with AXLAsync.AsyncAXL(server.url, 'benchmark', 'benchmark', concurrency=concurrency, bucket=_bucket()) as axl:
+        async def _log_out(phone):
+            started = time.monotonic()
+            outcome = await AXLAsync.log_out_phone(axl, phone, backoff=0.01)
+            return time.monotonic() - started, outcome
+
+        start = time.monotonic()
+        resp = await axl.call('executeSQLQuery', sql=ExtensionMobility.EM_LOGGED_IN_SQL)
+        phones = [row[0].text for row in resp['return'].row] if resp['return'] is not None else []
+        results = await asyncio.gather(*(_log_out(phone) for phone in phones))
+        elapsed = time.monotonic() - start
+    return elapsed, [duration for duration, outcome in results], sum(outcome[0] == 'failed' for _, outcome in results)
+
+
+def benchmark_builds(count):
+    # A desk phone & Jabber build per seeded user, each on its own extension
+    site = Sites.get_site(*BENCHMARK_SITE)
+    return [PhoneBuild.new_build(f'user{number:05d}', str(10000 + number), 'both', site,
+                                 userEnteredPhoneModel=BENCHMARK_MODEL, phoneMac=f'{0xA0000000 + number:012X}')
+            for number in range(count)]
+
+
+def _reset_builds(server, builds):
+    # Forget the devices an earlier run created, so every run adds them again
+    with server.store.lock:
+        for build in builds:
+            for deviceName in PhoneBuild.build_devices(build):
+                server.store.phones.pop(deviceName, None)
+            server.store.users[build['phoneUsername']].pop('associatedDevices', None)
+
+
+def standard_build(service, build):
+    # The StandardPhoneSetup.py flow without the menus. True if the build went through
+    try:
+        userDetails = PhoneBuild.find_user(service, build['phoneUsername'])
+        if PhoneBuild.user_names(userDetails) is None:
+            return False
+        PhoneBuild.set_user(build, userDetails)
+        PhoneBuild.get_line_devices(service, build)
+        BuildPlan.run_plan(service, build, BuildPlan.compile_plan(BuildPlan.plan_build(build), build))
+    except (Fault, TransportError, RequestException):
+        return False
+    return True
+
+
+def run_builds_threaded(server, builds, workers):
+    _reset_builds(server, builds)
+    service = _service(server.url, workers)
+    build = _timed(lambda build: standard_build(service, build))
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(build, [dict(build) for build in builds]))
+    elapsed = time.monotonic() - start
+    return elapsed, [duration for duration, ok in results], sum(not ok for _, ok in results)
+
+
+async def _run_builds_async(server, builds, concurrency):
+    _reset_builds(server, builds)
+    async with AXLAsync.AsyncAXL(server.url, 'benchmark', 'benchmark', concurrency=concurrency, bucket=_bucket()) as axl:
+        async def _build(build):
+            started = time.monotonic()
+            try:
+                resp = await axl.call('getUser', userid=build['phoneUsername'], returnedTags=PhoneBuild.USER_TAGS)
+                PhoneBuild.set_user(build, resp['return'].user)
+                await AXLAsync.get_line_devices(axl, build)
+                await AXLAsync.run_plan(axl, build, BuildPlan.compile_plan(BuildPlan.plan_build(build), build))
+                ok = True
+            except (Fault, TransportError, RequestException):
+                ok = False
+            return time.monotonic() - started, ok
+
+        start = time.monotonic()
+        results = await asyncio.gather(*(_build(dict(build)) for build in builds))
+        elapsed = time.monotonic() - start
+    return elapsed, [duration for duration, ok in results], sum(not ok for _, ok in results)
+
+
+def _calls(server):
+    return sum(count for operation, count in server.calls.items() if not operation.endswith(' fault'))
+
+
+def _parse_zeep(service, response):
+    # What service.listPhone() does with the response, as the scripts used it
+    binding = service._binding
+    result = binding.process_reply(service._client, binding.get('listPhone'), response)
+    return [(phone.name, phone.currentProfileName.uuid if phone.currentProfileName is not None else None)
+            for phone in result['return'].phone]
+
+
+def _parse_fast(service, response):
+    return AXLFastList.parse_items(response.content, 'phone', ('name', 'currentProfileName@uuid'))
+
+
+def measure_parse(parse, service, response, repeats=PARSE_REPEATS):
+    # (CPU seconds per page, peak bytes allocated while parsing one page)
+    start = time.process_time()
+    for _ in range(repeats):
+        parse(service, response)
+    cpu = (time.process_time() - start) / repeats
+    tracemalloc.start()
+    parse(service, response)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return cpu, peak
+
+
+def zeep_logged_in_phones(service, pageSize):
+    # The listPhone discovery as it was before AXLFastList.py
+    return [phone.name for phone in ExtensionMobility.iter_phones(service, {'name': '%'},
+                                                                  {'name': '', 'currentProfileName': ''}, pageSize)
+            if phone.currentProfileName is not None and phone.currentProfileName.uuid is not None]
+
+
+def _with_envelopes(run):
+    # Runs with AXLEnvelope.py's precompiled envelopes on
+    def _run():
+        AXLEnvelope.enable()
+        try:
+            return run()
+        finally:
+            AXLEnvelope.enable(False)
+    return _run
+
+
+def logout_suite(server, args):
+    print(f'\nExMoBulkLogout: {args.calls} logged in phones')
+    threaded = lambda: run_logout_threaded(server, args.workers)
+    asyncRun = lambda: asyncio.run(_run_logout_async(server, args.concurrency))
+    for label, run in ((f'threaded, {args.workers} workers', threaded),
+                       (f'asyncio, {args.concurrency} in flight', asyncRun),
+                       ('threaded, fast envelopes', _with_envelopes(threaded)),
+                       ('asyncio, fast envelopes', _with_envelopes(asyncRun))):
+        elapsed, durations, failed = run()
+        report(label, len(durations), 'logout', elapsed, durations, failed)
+
+
+def build_suite(server, args):
+    builds = benchmark_builds(args.builds)
+    print(f'\nStandardPhoneSetup: {args.builds} desk phone & Jabber builds')
+    for label, run in (('one at a time', lambda: run_builds_threaded(server, builds, 1)),
+                       (f'threaded, {args.workers} workers', lambda: run_builds_threaded(server, builds, args.workers)),
+                       (f'asyncio, {args.concurrency} in flight',
+                        lambda: asyncio.run(_run_builds_async(server, builds, args.concurrency)))):
+        callsBefore = _calls(server)
+        elapsed, durations, failed = run()
+        report(label, len(durations), 'build', elapsed, durations, failed)
+        print(f"{'':>36}  {(_calls(server) - callsBefore) / len(durations):.1f} AXL calls per build")
+
+
+def list_suite(server, args):
+    _log_in_all(server)
+    # The build suite leaves its phones behind, so this is more than args.calls after it
+    phoneCount = len(server.store.phones)
+    service = _service(server.url, 1)
+    response = AXLFastList.post(service, 'listPhone', searchCriteria={'name': '%'},
+                                returnedTags={'name': '', 'currentProfileName': ''}, skip=0, first=args.page_size)
+    if _parse_zeep(service, response) != _parse_fast(service, response):
+        raise SystemExit('zeep and iterparse disagree on the listPhone page')
+    print(f'\nlistPhone page: {args.page_size} phones, {len(response.content) / 1024:.0f}KB of XML')
+    for label, parse in (('zeep', _parse_zeep), ('iterparse', _parse_fast)):
+        cpu, peak = measure_parse(parse, service, response)
+        print(f'{label:>36}: {cpu * 1000:8.1f}ms CPU per page  {args.page_size / cpu:10.0f} phones/s  '
+              f'peak {peak / 1024 / 1024:6.1f}MB')
+    print(f'\nExMo listPhone discovery: {phoneCount} phones, {args.page_size} per page')
+    for label, discover in (('zeep', lambda: zeep_logged_in_phones(service, args.page_size)),
+                            ('iterparse', lambda: ExtensionMobility.logged_in_phones_list(service, pageSize=args.page_size))):
+        start, cpuStart = time.monotonic(), time.process_time()
+        phones = discover()
+        elapsed, cpu = time.monotonic() - start, time.process_time() - cpuStart
+        print(f'{label:>36}: {len(phones)} logged in found in {elapsed:6.1f}s  {cpu:6.1f}s CPU')
+
+
+ENVELOPE_CALLS = (('doDeviceLogout', {'deviceName': 'SEP00000000A0B1'}),)
+
+
+def envelope_suite(server, args):
+    service = _service(server.url, 1)
+    binding = service._binding
+    print(f'\nRequest serialization: {args.calls} calls each')
+    for operation, kwargs in ENVELOPE_CALLS:
+        start = time.process_time()
+        for _ in range(args.calls):
+            envelope, headers = binding._create(operation, (), kwargs, client=service._client,
+                                                options=service._binding_options)
+            zeepMessage = etree_to_string(envelope)
+        zeepCpu = (time.process_time() - start) / args.calls
+        template = AXLEnvelope.template(service, operation)
+        start = time.process_time()
+        for _ in range(args.calls):
+            fastMessage = template.render(kwargs)
+        fastCpu = (time.process_time() - start) / args.calls
+        if fastMessage != zeepMessage:
+            raise SystemExit('The precompiled ' + operation + ' envelope differs from zeep\'s')
+        print(f'{operation:>36}: zeep {zeepCpu * 1e6:7.1f}us  template {fastCpu * 1e6:5.1f}us per call  '
+              f'({zeepCpu / fastCpu:.0f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark builds and Extension Mobility logouts on a fake AXL server.')
+    parser.add_argument('--suite', choices=('logout', 'build', 'list', 'envelope', 'all'), default='all')
+    parser.add_argument('--calls', type=int, default=1000, help='Logged in phones to log out per run (default 1000)')
+    parser.add_argument('--page-size', type=int, default=AXLFastList.PAGE_SIZE,
+                        help=f'Phones per listPhone page for the list suite (default {AXLFastList.PAGE_SIZE})')
+    parser.add_argument('--builds', type=int, default=100, help='Builds per run (default 100)')
+    parser.add_argument('--latency', type=float, default=0.1, help='Server seconds per request (default 0.1)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many extra random seconds per request')
+    parser.add_argument('--fault-rate', type=float, default=0.0, help='Fraction of requests that fault (default 0)')
+    parser.add_argument('--workers', type=int, default=8, help='Threads for the threaded runs (default 8)')
+    parser.add_argument('--concurrency', type=int, default=AXLAsync.AXL_CONCURRENCY,
+                        help=f'Calls in flight for the asyncio runs (default {AXLAsync.AXL_CONCURRENCY})')
+    args = parser.parse_args()
+
+    server = FakeAXLServer.start(latency=args.latency, jitter=args.jitter, faultRate=args.fault_rate)
+    FakeAXLServer.seed(server.store, users=args.builds, phones=args.calls)
+    print(f'Fake AXL server on {server.url}, {args.latency * 1000:.0f}ms latency'
+          + (f', {args.fault_rate:.1%} faults' if args.fault_rate else ''))
+    if args.suite in ('logout', 'all'):
+        logout_suite(server, args)
+    if args.suite in ('build', 'all'):
+        build_suite(server, args)
+    if args.suite in ('list', 'all'):
+        list_suite(server, args)
+    if args.suite in ('envelope', 'all'):
+        envelope_suite(server, args)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
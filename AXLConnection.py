@@ -0,0 +1,147 @@
+"""Fast AXL client startup with an on-disk schema cache
+
+Loading the full AXLAPI.wsdl/AXLSoap.xsd makes zeep build and resolve every one of
+the ~2000 AXL types before the first request is sent, although these scripts only
+use a handful of operations. The first start writes a copy of the schema pruned to
+AXL_OPERATIONS (and the types they reach) to schema/cache/<hash>/, keyed by the hash
+of the schema files and the operation list. Warm starts load the small copy.
+
+    client = AXLConnection.load_client(WSDL_FILE, settings=settings, transport=transport, plugins=plugin)
+    print(AXLConnection.startup_report())
+"""
+import hashlib
+import os
+import threading
+import time
+
+from lxml import etree
+from zeep import Client
+
+# Every AXL operation used by the scripts in this project. Add to this list when calling a new one
+AXL_OPERATIONS = (
+    'addLine', 'addPhone', 'doDeviceLogout', 'doLdapSync', 'executeSQLQuery', 'getLdapSyncStatus', 'getLine', 'getPhone',
+    'getUser',
+    'listCommonDeviceConfig', 'listCommonPhoneConfig', 'listCss', 'listDevicePool', 'listLocation',
+    'listPhone', 'listPhoneButtonTemplate', 'listPhoneSecurityProfile', 'listRoutePartition', 'listSoftKeyTemplate',
+    'listUser', 'removePhone', 'updateLine', 'updatePhone', 'updateUser',
+)
+
+SCHEMA_FILES = ('AXLAPI.wsdl', 'AXLSoap.xsd', 'AXLEnums.xsd')
+CACHE_DIR = 'cache'
+
+WSDL_NS = 'http://schemas.xmlsoap.org/wsdl/'
+XSD_NS = 'http://www.w3.org/2001/XMLSchema'
+
+# Attributes that point at other schema types
+TYPE_REFERENCES = ('type', 'base', 'itemType', 'memberTypes', 'ref')
+
+# Seconds spent in each startup step, see startup_report()
+timings = {}
+
+# Clients loaded on several threads at once (Clusters.py) build the schema cache one at a time
+_cacheLock = threading.Lock()
+
+
+def schema_hash(schemaDir, operations):
+    # Changes whenever a schema file is replaced (e.g. after a CUCM upgrade) or the operation list changes
+    digest = hashlib.sha256()
+    for name in SCHEMA_FILES:
+        path = os.path.join(schemaDir, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as schemaFile:
+                digest.update(schemaFile.read())
+    digest.update(' '.join(sorted(operations)).encode())
+    return digest.hexdigest()[:16]
+
+
+def _prune_wsdl(wsdl, operations):
+    # Keep the messages, portType and binding operations for the wanted operations only
+    messages = {'AXLError'}
+    for operation in operations:
+        messages.update((operation + 'In', operation + 'Out'))
+    for message in wsdl.findall('{%s}message' % WSDL_NS):
+        if message.get('name') not in messages:
+            wsdl.remove(message)
+    for parent in wsdl.findall('{%s}portType' % WSDL_NS) + wsdl.findall('{%s}binding' % WSDL_NS):
+        for operation in parent.findall('{%s}operation' % WSDL_NS):
+            if operation.get('name') not in operations:
+                parent.remove(operation)
+    # The request and response elements the remaining messages need
+    elements = set()
+    for part in wsdl.iter('{%s}part' % WSDL_NS):
+        elements.add(part.get('element').split(':')[-1])
+    return elements
+
+
+def _prune_xsd(xsd, elements):
+    # Walk from the wanted top level elements to every type they reference and drop the rest
+    targetNamespace = xsd.get('targetNamespace')
+    definitions = {}
+    for node in xsd:
+        if isinstance(node.tag, str) and node.get('name'):
+            definitions.setdefault(node.get('name'), []).append(node)
+    keep = set()
+    pending = [node for name in elements for node in definitions.get(name, [])]
+    while pending:
+        node = pending.pop()
+        if node in keep:
+            continue
+        keep.add(node)
+        for child in node.iter():
+            for attribute in TYPE_REFERENCES:
+                for value in (child.get(attribute) or '').split():
+                    prefix, _, name = value.rpartition(':')
+                    if child.nsmap.get(prefix or None) == targetNamespace:
+                        pending.extend(definitions.get(name, []))
+    for node in list(xsd):
+        if isinstance(node.tag, str) and node.get('name') and node not in keep:
+            xsd.remove(node)
+
+
+def build_cache(wsdlFile, operations=AXL_OPERATIONS):
+    # Returns the path of the pruned WSDL, writing it first if this schema/operation list isn't cached yet
+    schemaDir = os.path.dirname(wsdlFile)
+    cacheDir = os.path.join(schemaDir, CACHE_DIR, schema_hash(schemaDir, operations))
+    cachedWsdl = os.path.join(cacheDir, os.path.basename(wsdlFile))
+    if os.path.exists(cachedWsdl):
+        timings['schema cache'] = 'hit'
+        return cachedWsdl
+    timings['schema cache'] = 'miss'
+    parser = etree.XMLParser(huge_tree=True, remove_blank_text=True)
+    wsdl = etree.parse(wsdlFile, parser)
+    elements = _prune_wsdl(wsdl.getroot(), set(operations))
+    imports = wsdl.getroot().findall('{%s}import' % WSDL_NS)
+    os.makedirs(cacheDir, exist_ok=True)
+    for schemaImport in imports:
+        xsd = etree.parse(os.path.join(schemaDir, schemaImport.get('location')), parser)
+        _prune_xsd(xsd.getroot(), elements)
+        xsd.write(os.path.join(cacheDir, schemaImport.get('location')), xml_declaration=True, encoding='UTF-8')
+    # Written last so an interrupted run never leaves a WSDL without its XSD
+    wsdl.write(cachedWsdl + '.tmp', xml_declaration=True, encoding='UTF-8')
+    os.replace(cachedWsdl + '.tmp', cachedWsdl)
+    return cachedWsdl
+
+
+def load_client(wsdlFile, operations=AXL_OPERATIONS, clientClass=Client, **kwargs):
+    # Drop-in replacement for zeep.Client(wsdlFile, ...). Pass operations=None to load the full schema,
+    # clientClass=zeep.AsyncClient for an asyncio client
+    start = time.perf_counter()
+    if operations:
+        try:
+            with _cacheLock:
+                wsdlFile = build_cache(wsdlFile, operations)
+        except (OSError, etree.XMLSyntaxError) as err:
+            # A read only folder or odd schema shouldn't stop the script, just load the full WSDL
+            timings['schema cache'] = 'unavailable: ' + str(err)
+    timings['schema cache seconds'] = time.perf_counter() - start
+    start = time.perf_counter()
+    client = clientClass(wsdlFile, **kwargs)
+    timings['schema load seconds'] = time.perf_counter() - start
+    return client
+
+
+def startup_report():
+    # One line summary of the last load_client, e.g. for logging
+    return ('AXL startup: schema cache ' + str(timings.get('schema cache', 'off'))
+            + f", cache {timings.get('schema cache seconds', 0.0):.2f}s"
+            + f", schema load {timings.get('schema load seconds', 0.0):.2f}s")
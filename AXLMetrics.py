@@ -0,0 +1,207 @@
+"""Per operation AXL metrics, exported in the Prometheus text format
+
+The transports (AXLScheduler.ThrottledTransport and AXLAsync.ThrottledAsyncTransport)
+record every AXL call here: its operation (from the SOAPAction header), how long it
+took including throttle retries, whether it failed, how often it was throttled and the
+request/response sizes. They are kept per cluster and operation in the process wide
+registry, so every script that talks to CUCM is measured without changes.
+
+    AXLMetrics.write_file('bulk.prom')    # e.g. for node_exporter's textfile collector
+    AXLMetrics.serve(9464)                # or scrape http://127.0.0.1:9464/metrics
+    print('\\n'.join(AXLMetrics.summary()))
+
+Sizes are of the uncompressed XML, responses usually travel gzipped (AXLTransport.py).
+"""
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Histogram bucket upper bounds in seconds, from a quick getUser to a big listPhone page
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Seconds between rewrites of the metrics file, see write_periodically()
+WRITE_INTERVAL = 15
+
+# name: (type, help)
+METRICS = {
+    'axl_calls_total': ('counter', 'AXL calls made'),
+    'axl_errors_total': ('counter', 'AXL calls that returned a Fault or HTTP error or failed to connect'),
+    'axl_throttled_total': ('counter', 'Throttled AXL responses (HTTP 503 or AXL memory throttling), each retried'),
+    'axl_request_bytes_total': ('counter', 'Bytes of AXL request XML sent'),
+    'axl_response_bytes_total': ('counter', 'Bytes of AXL response XML received'),
+    'axl_call_duration_seconds': ('histogram', 'Seconds per AXL call, throttle waits and retries included'),
+}
+
+
+def operation_name(headers):
+    # SOAPAction is "CUCM:DB ver=11.5 listPhone", the operation is the last word
+    return headers.get('SOAPAction', '').strip('"').split(' ')[-1] or 'unknown'
+
+
+def cluster_name(address):
+    return urlparse(address).hostname or address
+
+
+class _Operation:
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self.requestBytes = 0
+        self.responseBytes = 0
+        self.seconds = 0.0
+        # One count per LATENCY_BUCKETS bound, not cumulative until rendered
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # {(cluster, operation): _Operation}
+        self.operations = {}
+
+    def _operation(self, address, headers):
+        key = (cluster_name(address), operation_name(headers))
+        if key not in self.operations:
+            self.operations[key] = _Operation()
+        return self.operations[key]
+
+    def record(self, address, headers, seconds, requestBytes, responseBytes, error):
+        with self.lock:
+            operation = self._operation(address, headers)
+            operation.calls += 1
+            operation.errors += bool(error)
+            operation.requestBytes += requestBytes
+            operation.responseBytes += responseBytes
+            operation.seconds += seconds
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    operation.buckets[index] += 1
+                    break
+
+    def throttled(self, address, headers):
+        with self.lock:
+            self._operation(address, headers).throttled += 1
+
+    def reset(self):
+        with self.lock:
+            self.operations.clear()
+
+    def render(self):
+        # Prometheus text exposition format, version 0.0.4
+        with self.lock:
+            operations = sorted(self.operations.items())
+            lines = []
+            for name, (metricType, helpText) in METRICS.items():
+                lines.append(f'# HELP {name} {helpText}')
+                lines.append(f'# TYPE {name} {metricType}')
+                for (cluster, operationName), operation in operations:
+                    labels = f'cluster="{_escape(cluster)}",operation="{_escape(operationName)}"'
+                    if metricType == 'histogram':
+                        lines.extend(_histogram(name, labels, operation))
+                    else:
+                        lines.append(f'{name}{{{labels}}} {_counter(name, operation)}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        # One line per operation, the most total time first
+        # e.g. 'cucm1 getUser: 120 calls, 0 errors, 0 throttled, 35.2s (0.293s each)'
+        with self.lock:
+            operations = sorted(self.operations.items(), key=lambda item: -item[1].seconds)
+            return [f'{cluster} {operationName}: {operation.calls} calls, {operation.errors} errors, '
+                    f'{operation.throttled} throttled, {operation.seconds:.1f}s '
+                    f'({operation.seconds / operation.calls if operation.calls else 0:.3f}s each)'
+                    for (cluster, operationName), operation in operations]
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _counter(name, operation):
+    return {
+        'axl_calls_total': operation.calls,
+        'axl_errors_total': operation.errors,
+        'axl_throttled_total': operation.throttled,
+        'axl_request_bytes_total': operation.requestBytes,
+        'axl_response_bytes_total': operation.responseBytes,
+    }[name]
+
+
+def _histogram(name, labels, operation):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, operation.buckets):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {operation.calls}')
+    lines.append(f'{name}_sum{{{labels}}} {operation.seconds:.6f}')
+    lines.append(f'{name}_count{{{labels}}} {operation.calls}')
+    return lines
+
+
+# Every transport in the process records into this one
+registry = Registry()
+
+
+def record(address, headers, seconds, requestBytes, responseBytes, error):
+    registry.record(address, headers, seconds, requestBytes, responseBytes, error)
+
+
+def throttled(address, headers):
+    registry.throttled(address, headers)
+
+
+def render():
+    return registry.render()
+
+
+def summary():
+    return registry.summary()
+
+
+def write_file(path):
+    # Written to a temporary file and renamed, so a collector never reads half a file
+    with open(path + '.tmp', 'w') as metricsFile:
+        metricsFile.write(render())
+    os.replace(path + '.tmp', path)
+
+
+def write_periodically(path, interval=WRITE_INTERVAL):
+    # Rewrites the file every interval seconds from a background thread, so a long bulk run can be
+    # watched while it runs. Call write_file() once more at the end for the final numbers
+    def _write():
+        while True:
+            time.sleep(interval)
+            write_file(path)
+
+    threading.Thread(target=_write, daemon=True).start()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port, host='127.0.0.1'):
+    # Serves /metrics from a background thread for as long as the script runs
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
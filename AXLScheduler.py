@@ -0,0 +1,171 @@
+"""AXL throttle-aware transport with backoff and a shared token bucket per cluster
+
+CUCM protects AXL with rate limits and memory throttling. Under load it answers with
+HTTP 503, or a 500 Fault saying "Maximum AXL Memory Allocation Consumed". Neither
+request was processed, so both are safe to send again.
+
+ThrottledTransport is a drop-in zeep Transport. Every call first takes a token from
+the cluster's bucket. Throttle responses are retried after a backoff, and the
+bucket's rate is halved. Each successful call raises the rate a little again, up to
+AXL_MAX_RATE, so bulk jobs settle at the highest rate the publisher will accept.
+
+    transport = AXLScheduler.ThrottledTransport(serverUrl, session=session, timeout=10)
+
+AXLAsync.py's transport takes tokens from the same buckets with acquire_async().
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from zeep.transports import Transport
+
+import AXLMetrics
+import WireLog
+
+# Calls per second each cluster starts at, and the range it adapts within
+AXL_RATE = 10.0
+AXL_MIN_RATE = 0.5
+AXL_MAX_RATE = 40.0
+
+# Calls per second added back after every successful call
+RATE_INCREASE = 0.2
+
+# Throttled calls are retried this many times, backing off from THROTTLE_BACKOFF seconds
+# (doubling, up to THROTTLE_BACKOFF_MAX) unless CUCM sends a Retry-After header
+THROTTLE_RETRIES = 5
+THROTTLE_BACKOFF = 2.0
+THROTTLE_BACKOFF_MAX = 60.0
+
+THROTTLE_STATUS = (429, 503)
+THROTTLE_FAULTS = (b'Maximum AXL Memory Allocation Consumed',)
+
+
+class TokenBucket:
+    # Paces calls from every thread to one cluster, with an adaptive rate
+
+    def __init__(self, rate=AXL_RATE, minRate=AXL_MIN_RATE, maxRate=AXL_MAX_RATE, burst=1):
+        self.rate = min(rate, maxRate)
+        self.minRate = minRate
+        self.maxRate = maxRate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.pausedUntil = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # Takes a token and returns 0, or returns the seconds to wait before asking again
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = self.pausedUntil - now
+            if wait <= 0:
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return 0.0
+                wait = (1 - self.tokens) / self.rate
+            return wait
+
+    def acquire(self):
+        # Blocks until a call may be sent
+        wait = self.reserve()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.reserve()
+
+    async def acquire_async(self):
+        # Same as acquire() without blocking the event loop
+        wait = self.reserve()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.reserve()
+
+    def throttled(self, pause):
+        # Halve the rate and hold every caller back while the publisher recovers. Workers that were
+        # already in flight get throttled too, that's the same event so the rate is only halved once
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.pausedUntil:
+                self.rate = max(self.minRate, self.rate / 2)
+            self.tokens = 0.0
+            self.pausedUntil = max(self.pausedUntil, now + pause)
+            return self.rate
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.maxRate, self.rate + RATE_INCREASE)
+
+
+# One bucket per cluster URL, shared by every transport/thread talking to it
+_buckets = {}
+_bucketsLock = threading.Lock()
+
+
+def get_bucket(serverUrl, **kwargs):
+    # kwargs (rate, minRate, maxRate, burst) only apply when the cluster's bucket is first created
+    with _bucketsLock:
+        if serverUrl not in _buckets:
+            _buckets[serverUrl] = TokenBucket(**kwargs)
+        return _buckets[serverUrl]
+
+
+def is_throttled(response):
+    if response.status_code in THROTTLE_STATUS:
+        return True
+    return response.status_code == 500 and any(fault in response.content for fault in THROTTLE_FAULTS)
+
+
+def _backoff(response, attempt):
+    retryAfter = response.headers.get('Retry-After', '')
+    if retryAfter.isdigit():
+        return min(float(retryAfter), THROTTLE_BACKOFF_MAX)
+    delay = min(THROTTLE_BACKOFF * 2 ** attempt, THROTTLE_BACKOFF_MAX)
+    # Jitter so a pool of workers doesn't come back in lockstep
+    return delay * random.uniform(0.75, 1.25)
+
+
+class ThrottledTransport(Transport):
+
+    def __init__(self, serverUrl, bucket=None, retries=THROTTLE_RETRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket = bucket or get_bucket(serverUrl)
+        self.retries = retries
+
+    def _send(self, address, message, headers):
+        # One HTTP POST, see AXLTransport.py for per operation timeouts
+        return super().post(address, message, headers)
+
+    def post(self, address, message, headers):
+        # Timed and counted per operation (AXLMetrics.py), and wire logged if that's on (WireLog.py)
+        start = time.monotonic()
+        response = None
+        try:
+            response = self._post_throttled(address, message, headers)
+            return response
+        finally:
+            AXLMetrics.record(address, headers, time.monotonic() - start, len(message),
+                              len(response.content) if response is not None else 0,
+                              response is None or response.status_code >= 400)
+            WireLog.record(address, headers, message, response)
+
+    def _post_throttled(self, address, message, headers):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            response = self._send(address, message, headers)
+            if not is_throttled(response):
+                self.bucket.succeeded()
+                return response
+            AXLMetrics.throttled(address, headers)
+            pause = _backoff(response, attempt)
+            rate = self.bucket.throttled(pause)
+            if attempt >= self.retries:
+                # Give up and let zeep raise the Fault/TransportError as usual
+                logging.error(f'AXL still throttled (HTTP {response.status_code}) after {attempt + 1} tries')
+                return response
+            logging.warning(f'AXL throttled (HTTP {response.status_code}), retrying in {pause:.1f}s '
+                            f'at {rate:.1f} calls/s')
+            attempt += 1
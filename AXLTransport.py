@@ -0,0 +1,90 @@
+"""Pooled AXL HTTP sessions, one per cluster, with per operation timeouts
+
+Every AXL call in a process goes over its cluster's shared requests Session:
+- a connection pool sized for the workers, whose keep-alive connections are reused
+  instead of paying a TLS handshake per call
+- workers wait for a pooled connection rather than opening throwaway ones
+- connection failures (nothing was sent) are retried, nothing else is
+- gzip responses, which shrinks the large list/SQL responses several times over
+- (connect, read) timeouts picked by the operation in the SOAPAction header, so a
+  big listPhone page gets minutes while a stuck write fails in seconds
+
+Changing credentials updates the session in place and keeps its connections.
+
+    transport = AXLTransport.get_transport(serverUrl, sessionCert, cucmusername, cucmpassword, poolSize=8)
+"""
+import threading
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+
+import AXLMetrics
+import AXLScheduler
+
+# Connections kept open per cluster, raise to the number of workers sharing the session
+POOL_SIZE = 10
+
+# Seconds to open a connection, and to wait for a response
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 10
+
+# Operations that can take longer than READ_TIMEOUT to answer
+OPERATION_READ_TIMEOUTS = {
+    'listPhone': 120,
+    'listUser': 120,
+    'executeSQLQuery': 120,
+    'doLdapSync': 60,
+}
+
+# Connection attempts retried before giving up (with 0.5s, 1s, 2s... between them)
+CONNECT_RETRIES = 3
+
+# One session per cluster URL, shared by every transport/thread talking to it
+_sessions = {}
+_sessionsLock = threading.Lock()
+
+
+def new_session(verify=True, poolSize=POOL_SIZE):
+    session = Session()
+    session.verify = verify
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    retry = Retry(total=CONNECT_RETRIES, connect=CONNECT_RETRIES, read=0, redirect=0, status=0,
+                  backoff_factor=0.5, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize, pool_block=True, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(serverUrl, verify=True, poolSize=POOL_SIZE):
+    # verify and poolSize only apply when the cluster's session is first created
+    with _sessionsLock:
+        if serverUrl not in _sessions:
+            _sessions[serverUrl] = new_session(verify, poolSize)
+        return _sessions[serverUrl]
+
+
+def set_credentials(serverUrl, cucmusername, cucmpassword):
+    # Every request carries the Authorization header, so pooled connections can stay open
+    get_session(serverUrl).auth = HTTPBasicAuth(cucmusername, cucmpassword)
+
+
+def operation_timeout(headers):
+    operation = AXLMetrics.operation_name(headers)
+    return CONNECT_TIMEOUT, OPERATION_READ_TIMEOUTS.get(operation, READ_TIMEOUT)
+
+
+class AXLTransport(AXLScheduler.ThrottledTransport):
+    # ThrottledTransport with a (connect, read) timeout per operation instead of one flat timeout
+
+    def _send(self, address, message, headers):
+        return self.session.post(address, data=message, headers=headers, timeout=operation_timeout(headers))
+
+
+def get_transport(serverUrl, verify, cucmusername, cucmpassword, poolSize=POOL_SIZE, bucket=None):
+    # A zeep transport on the cluster's shared session, paced by its token bucket
+    session = get_session(serverUrl, verify, poolSize)
+    set_credentials(serverUrl, cucmusername, cucmpassword)
+    return AXLTransport(serverUrl, bucket=bucket, session=session, timeout=READ_TIMEOUT)
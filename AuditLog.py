@@ -0,0 +1,97 @@
+"""Audit log as JSON lines, written by one background thread
+
+Replaces logging.basicConfig in the scripts. Every log record, from the scripts and
+from the shared modules, goes onto a queue. A single QueueListener thread then writes
+it to the log file as one JSON object per line. Worker threads never wait on the disk,
+and lines from different workers can't interleave.
+
+    AuditLog.setup('bulk.log', operator=cucmusername, cluster='US')
+    AuditLog.event('created phone', operation='addPhone', device='SEP001122334455',
+                   user='jsmith', duration=0.41)
+
+Every line has time, level, message and the FIELDS. A field not given to event() comes
+from setup()/set_context(), or is null. Plain logging calls are kept too, with just the
+context fields filled in.
+"""
+import atexit
+import json
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# Fields every line has, null when they don't apply
+FIELDS = ('operator', 'operation', 'device', 'user', 'cluster', 'duration')
+
+# Fields the whole process shares, e.g. the operator, see set_context()
+_context = {}
+_contextLock = threading.Lock()
+_listener = None
+
+
+class _ContextFilter(logging.Filter):
+    # Takes the context when the record is logged, not when the writer gets to it
+
+    def filter(self, record):
+        with _contextLock:
+            record.auditContext = dict(_context)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'), 'level': record.levelname,
+                 'message': record.getMessage()}
+        fields = getattr(record, 'audit', {})
+        context = getattr(record, 'auditContext', {})
+        for field in FIELDS:
+            # None means not known here, the context may know it
+            entry[field] = fields[field] if fields.get(field) is not None else context.get(field)
+        # Anything else given to event(), e.g. status or row
+        entry.update({field: value for field, value in fields.items() if field not in FIELDS})
+        if entry['duration'] is not None:
+            entry['duration'] = round(entry['duration'], 3)
+        return json.dumps(entry, default=str)
+
+
+def setup(path, **context):
+    # Sends every log record of the process through the queue to path. Call once at start up
+    global _listener
+    stop()
+    fileHandler = logging.FileHandler(path, encoding='utf-8')
+    fileHandler.setFormatter(JsonFormatter())
+    # Unbounded, a put never waits
+    records = queue.Queue()
+    root = logging.getLogger()
+    queueHandler = QueueHandler(records)
+    queueHandler.addFilter(_ContextFilter())
+    root.handlers = [queueHandler]
+    root.setLevel(logging.INFO)
+    _listener = QueueListener(records, fileHandler, respect_handler_level=True)
+    _listener.start()
+    set_context(**context)
+
+
+def set_context(**fields):
+    # e.g. set_context(operator=cucmusername) once the credentials are known
+    with _contextLock:
+        _context.update(fields)
+
+
+def stop():
+    # Writes out what's queued and closes the file, also run at exit
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop)
+
+
+def event(message, level=logging.INFO, **fields):
+    # One audit line, the fields override the context
+    logging.getLogger('audit').log(level, message, extra={'audit': fields})
@@ -0,0 +1,77 @@
+"""Append-only journal of completed build steps, so a failed run can be resumed
+
+Every AXL write that succeeds is appended to the journal as one JSON line, keyed by
+the build (BuildPlan.build_id) and the step (BuildPlan.step_id). When the same build
+is run again the steps already in the journal are skipped, so a re-run picks up at
+the step that failed instead of failing on the devices it already created.
+
+    journal = BuildJournal.BuildJournal('onboarding.csv.journal')
+    BuildPlan.run_plan(service, build, steps, journal)
+
+Lines are only ever appended. restart() adds a marker that makes the next load
+forget what came before it for that build, finish() one that marks it complete.
+"""
+import json
+import os
+import threading
+import time
+
+COMPLETE = 'complete'
+RESTART = 'restart'
+
+
+class BuildJournal:
+
+    def __init__(self, path, operator=''):
+        self.path = path
+        self.operator = operator
+        self.lock = threading.Lock()
+        # {buildId: set of step ids done}, replayed from the file
+        self.steps = {}
+        if os.path.exists(path):
+            with open(path) as journalFile:
+                for line in journalFile:
+                    if line.strip():
+                        self._replay(json.loads(line))
+        self.journalFile = open(path, 'a')
+
+    def _replay(self, entry):
+        if entry['step'] == RESTART:
+            self.steps.pop(entry['build'], None)
+        else:
+            self.steps.setdefault(entry['build'], set()).add(entry['step'])
+
+    def _append(self, buildId, stepId, **fields):
+        entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'operator': self.operator, 'build': buildId, 'step': stepId}
+        entry.update(fields)
+        with self.lock:
+            self._replay(entry)
+            # Flushed and synced line by line, a crash right after a write still finds it on the next run
+            self.journalFile.write(json.dumps(entry) + '\n')
+            self.journalFile.flush()
+            os.fsync(self.journalFile.fileno())
+
+    def done(self, buildId, stepId):
+        with self.lock:
+            return stepId in self.steps.get(buildId, ())
+
+    def build_ids(self):
+        # Every build with steps in the journal
+        with self.lock:
+            return list(self.steps)
+
+    def completed(self, buildId):
+        return self.done(buildId, COMPLETE)
+
+    def record(self, buildId, stepId, **fields):
+        self._append(buildId, stepId, **fields)
+
+    def finish(self, buildId):
+        self._append(buildId, COMPLETE)
+
+    def restart(self, buildId):
+        # The build runs again from the start, e.g. the same phone set up again after it was deleted
+        self._append(buildId, RESTART)
+
+    def close(self):
+        self.journalFile.close()
@@ -0,0 +1,226 @@
+"""Phone builds as an explicit plan of AXL calls, compiled to as few round trips as possible
+
+plan_build() lists the calls a build makes when every menu step runs on its own:
+getUser for the names, addPhone + updateLine per device, getUser again for the
+associated devices, two updateUser passes and an updatePhone owner update per device.
+That's 10 calls for a desk phone & Jabber build, plus an addLine first when the build
+creates its extension (build['newLine']). compile_plan() then
+- merges the getUser reads into one, and drops reads the caller has already made
+- drops writes that repeat an earlier identical write (the second updateLine)
+- folds each updatePhone owner update into the addPhone of that device
+which leaves 6 calls. Both updateUser passes stay, CUCM needs the devices associated
+before the primary extension can be set. The line fields can't go into addPhone, its
+dirn only references the existing line.
+
+    steps = BuildPlan.compile_plan(BuildPlan.plan_build(build), build)
+    print(BuildPlan.describe(steps, BuildPlan.plan_build(build)))
+    BuildPlan.run_plan(service, build, steps)
+
+A step is a dict: operation, key (what it reads/writes, used to merge steps), label
+(for logs), kwargs (a function of the build, as names and devices are only known once
+earlier reads ran), fields (the user fields a getUser returns) and extra (the kwargs of
+updatePhone steps folded into an addPhone).
+"""
+import logging
+import time
+
+import AuditLog
+import PhoneBuild
+
+
+def _step(operation, key, label, kwargs, fields=None):
+    # extra holds the kwargs functions of updatePhone steps folded into an addPhone
+    return {'operation': operation, 'key': key, 'label': label, 'kwargs': kwargs, 'fields': fields, 'extra': []}
+
+
+def _read_user(build, fields):
+    return _step('getUser', ('user', build['phoneUsername']), 'read end user ' + build['phoneUsername'],
+                 lambda build, fields=fields: {'userid': build['phoneUsername'],
+                                               'returnedTags': {field: '' for field in fields}},
+                 fields=tuple(fields))
+
+
+def _add_phone(build, deviceName, payload):
+    return _step('addPhone', ('phone', deviceName), 'created ' + deviceName, lambda build: {'phone': payload(build)})
+
+
+def _add_line(build):
+    return _step('addLine', ('line', build['phoneExt'], build['routePartitionName']),
+                 'created line ' + build['phoneExt'], PhoneBuild.line_add)
+
+
+def _update_line(build):
+    return _step('updateLine', ('line', build['phoneExt'], build['routePartitionName']),
+                 'updated line ' + build['phoneExt'], PhoneBuild.line_update)
+
+
+def _first_user_update(build):
+    devices = PhoneBuild.updated_associated_devices(build, build['currentAssociatedDevices'])
+    return PhoneBuild.user_update_first_pass(build, devices)
+
+
+def plan_build(build):
+    # Every call, in the order the menu driven script has always made them
+    steps = [_read_user(build, ('firstName', 'lastName'))]
+    if build['newLine']:
+        # A new extension (ExtensionAllocator.py), created before any phone references it
+        steps.append(_add_line(build))
+    if build['buildType'] != 'jabber':
+        steps.append(_add_phone(build, build['deskPhoneDeviceName'], PhoneBuild.desk_phone_payload))
+        steps.append(_update_line(build))
+    if build['buildType'] != 'desk':
+        steps.append(_add_phone(build, build['jabberDeviceName'], PhoneBuild.jabber_payload))
+        steps.append(_update_line(build))
+    steps.append(_read_user(build, ('associatedDevices',)))
+    steps.append(_step('updateUser', ('user', build['phoneUsername'], 1), 'first pass updated end user '
+                       + build['phoneUsername'], _first_user_update))
+    steps.append(_step('updateUser', ('user', build['phoneUsername'], 2), 'second pass updated end user '
+                       + build['phoneUsername'], PhoneBuild.user_update_second_pass))
+    for deviceName in PhoneBuild.build_devices(build):
+        steps.append(_step('updatePhone', ('phone', deviceName), 'updated ' + deviceName + ' owner to '
+                           + build['phoneUsername'],
+                           lambda build, deviceName=deviceName: {'name': deviceName,
+                                                                 'ownerUserName': build['phoneUsername']}))
+    return steps
+
+
+def known_user_fields(build):
+    # User fields a lookup before the plan already put in the build
+    known = set()
+    if 'phoneFname' in build:
+        known.update(('firstName', 'lastName'))
+    if 'currentAssociatedDevices' in build:
+        known.add('associatedDevices')
+    return known
+
+
+def compile_plan(steps, build=None):
+    # Returns new steps, the plan passed in is left as it is. Pass the build to drop reads it already answers
+    known = known_user_fields(build) if build is not None else set()
+    compiled = []
+    reads = {}
+    writes = set()
+    added = {}
+    for step in steps:
+        step = dict(step, extra=list(step['extra']))
+        if step['operation'] == 'getUser':
+            fields = [field for field in step['fields'] if field not in known]
+            if not fields:
+                continue
+            if step['key'] in reads:
+                # One read returns the fields of every getUser for this user
+                merged = reads[step['key']]
+                merged.update(_read_user({'phoneUsername': step['key'][1]},
+                                         merged['fields'] + tuple(f for f in fields if f not in merged['fields'])))
+                continue
+            step = _read_user({'phoneUsername': step['key'][1]}, fields)
+            reads[step['key']] = step
+        elif step['operation'] == 'updatePhone' and step['key'] in added:
+            # The owner (or any other field) is set when the phone is added instead
+            added[step['key']]['extra'].append(step['kwargs'])
+            continue
+        elif (step['operation'], step['key']) in writes:
+            # Same write to the same object again, e.g. updateLine once per device
+            continue
+        else:
+            writes.add((step['operation'], step['key']))
+            if step['operation'] == 'addPhone':
+                added[step['key']] = step
+        compiled.append(step)
+    return compiled
+
+
+def step_args(build, step):
+    # (args, kwargs) for the call
+    kwargs = step['kwargs'](build)
+    for extra in step['extra']:
+        # Folded updatePhone fields, without the name that identifies the phone
+        fields = {field: value for field, value in extra(build).items() if field != 'name'}
+        kwargs = dict(kwargs, phone=dict(kwargs['phone'], **fields))
+    if step['operation'] == 'addPhone':
+        # Passed positionally like it always has been, zeep then skips payload keys the
+        # schema doesn't have (model isn't in the 11.5 XPhone) instead of raising
+        return (kwargs['phone'],), {}
+    return (), kwargs
+
+
+def apply_result(build, step, resp):
+    # Store what a read returned in the build, for the steps after it
+    if step['operation'] != 'getUser':
+        return
+    user = resp['return'].user
+    if 'firstName' in step['fields'] and 'phoneFname' not in build:
+        if not user.firstName or not user.lastName:
+            raise ValueError('No first/last name for ' + build['phoneUsername'])
+        PhoneBuild.set_user_names(build, user.firstName, user.lastName)
+    if 'associatedDevices' in step['fields']:
+        build['currentAssociatedDevices'] = user.associatedDevices
+
+
+def step_id(step):
+    # e.g. 'addPhone phone SEP001122334455', the journal key of the step (BuildJournal.py)
+    return ' '.join((step['operation'],) + tuple(str(part) for part in step['key']))
+
+
+def build_id(build):
+    # The journal key of a build: the user, extension and devices it sets up
+    return ' '.join([build['phoneUsername'], build['phoneExt']] + PhoneBuild.build_devices(build))
+
+
+def pending_steps(steps, build, journal=None):
+    # The steps an earlier run didn't finish. Reads are never journaled, later steps need what they return
+    if journal is None:
+        return list(steps)
+    buildId = build_id(build)
+    return [step for step in steps if step['operation'] == 'getUser' or not journal.done(buildId, step_id(step))]
+
+
+def record_step(build, step, journal=None):
+    if journal is not None and step['operation'] != 'getUser':
+        journal.record(build_id(build), step_id(step), label=step['label'])
+
+
+def step_device(step):
+    # The phone a step writes, None for line and user steps
+    return step['key'][1] if step['key'][0] == 'phone' else None
+
+
+def audit_step(build, step, duration, error=None):
+    # One audit log line per AXL call of the build (AuditLog.py)
+    if error is None:
+        AuditLog.event(step['label'], operation=step['operation'], device=step_device(step),
+                       user=build['phoneUsername'], duration=duration)
+    else:
+        AuditLog.event(step['label'] + ' failed: ' + str(error), level=logging.ERROR, operation=step['operation'],
+                       device=step_device(step), user=build['phoneUsername'], duration=duration)
+
+
+def run_step(service, build, step, journal=None):
+    # Any Fault is raised to the caller, before the step is journaled
+    start = time.monotonic()
+    args, kwargs = step_args(build, step)
+    try:
+        resp = getattr(service, step['operation'])(*args, **kwargs)
+        apply_result(build, step, resp)
+    except Exception as err:
+        audit_step(build, step, time.monotonic() - start, err)
+        raise
+    record_step(build, step, journal)
+    audit_step(build, step, time.monotonic() - start)
+    return resp
+
+
+def run_plan(service, build, steps, journal=None):
+    # With a journal, steps done by an earlier run are skipped and the build is marked complete at the end
+    for step in pending_steps(steps, build, journal):
+        run_step(service, build, step, journal)
+    if journal is not None:
+        journal.finish(build_id(build))
+
+
+def describe(steps, uncompiled=None):
+    # e.g. '6 AXL calls (10 before compiling): getUser, addPhone, addPhone, updateLine, updateUser, updateUser'
+    summary = str(len(steps)) + (' AXL call' if len(steps) == 1 else ' AXL calls')
+    if uncompiled is not None:
+        summary += ' (' + str(len(uncompiled)) + ' before compiling)'
+    return summary + ': ' + ', '.join(step['operation'] for step in steps)
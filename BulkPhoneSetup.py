@@ -0,0 +1,516 @@
+"""Headless bulk phone builds from a CSV/JSONL manifest
+
+Runs the same desk phone / Jabber / end user / owner steps as StandardPhoneSetup.py
+for every row of a manifest, on a bounded pool of AXL workers.
+
+Manifest columns (CSV header or JSONL keys):
+    username, extension, build (desk, jabber or both), model, mac, site
+
+An extension of "auto" gets the next free extension of the site's extensionRange
+(ExtensionAllocator.py), all of them allocated at once from one load of the dial
+plan, and the build creates the line. A re-run gives the row the extension it was
+allocated before, found by its user and devices in the journal.
+
+Usage:
+    python BulkPhoneSetup.py --region US --workers 8 onboarding.csv
+    python BulkPhoneSetup.py --region US --async --workers 200 onboarding.csv
+
+With --async the builds run as asyncio coroutines (AXLAsync.py) and --workers is the
+number of AXL calls in flight rather than threads.
+
+Completed steps are journaled to <manifest>.journal (BuildJournal.py). Running the same
+manifest again after a failure skips the rows already built and the steps already done
+for the others, delete the journal to build everything again.
+
+Before any write, every row's extension and devices are checked in a few batched SQL
+queries (Preflight.py): missing extensions, devices that already exist and rows of
+the manifest that clash with each other fail their row up front. --check-only prints
+that report and stops. With --mirror the checks are answered from the local inventory
+mirror (InventoryMirror.py) when it was synced less than InventoryMirror.MAX_AGE
+seconds ago, and from CUCM otherwise.
+
+With --reconcile the rows' existing phones, lines and users are read first and only the
+fields that differ from the build are sent (Reconcile.py), for re-applying the site
+standards to devices that are already set up. Phones that don't exist yet are added.
+
+Credentials are read from the local credential manager, see StandardPhoneSetup.py.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import aiohttp
+from requests.exceptions import RequestException
+from zeep.exceptions import Error
+
+import AuditLog
+import AXLAsync
+import AXLConnection
+import AXLMetrics
+import BuildJournal
+import BuildPlan
+import Clusters
+import ExtensionAllocator
+import InventoryMirror
+import PhoneBuild
+import Preflight
+import Reconcile
+import ReferenceCache
+import Sites
+import WireLog
+
+MANIFEST_COLUMNS = ('username', 'extension', 'build', 'model', 'mac', 'site')
+
+# Log file, JSON lines written by a background thread (AuditLog.py)
+log = "bulk.log"
+
+
+def _setup_connection(region, cucmusername, cucmpassword, workers):
+    # One client on the cluster's shared session, with a connection pool big enough for all workers.
+    # Paced by the cluster's shared token bucket, throttle responses are retried with backoff
+    service = Clusters.connect(region, cucmusername, cucmpassword, workers)
+    print(AXLConnection.startup_report())
+    return service
+
+
+def read_manifest(path):
+    # CSV with a header row, or one JSON object per line for .jsonl/.json files
+    rows = []
+    with open(path, newline='') as manifest:
+        if path.endswith('.jsonl') or path.endswith('.json'):
+            for line in manifest:
+                if line.strip():
+                    rows.append(json.loads(line))
+        else:
+            rows.extend(csv.DictReader(manifest))
+    for row in rows:
+        for column in MANIFEST_COLUMNS:
+            value = row.get(column)
+            row[column] = str(value).strip() if value is not None else ''
+    return rows
+
+
+def _find_user_names(service, phoneUsername):
+    # Lookup errors are treated like a missing user, the row fails later with the reason
+    try:
+        return PhoneBuild.find_user_names(service, phoneUsername)
+    except (Error, RequestException):
+        return None
+
+
+def resolve_users(service, usernames, workers):
+    # {username: (firstName, lastName) or None if not (yet) in CUCM with a name}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(usernames, pool.map(lambda phoneUsername: _find_user_names(service, phoneUsername), usernames)))
+
+
+def prepare_rows(region, rows, references=None):
+    # Turn manifest rows into builds and check them locally, so bad rows fail before any write
+    jobs = []
+    for rowNumber, row in enumerate(rows, 1):
+        job = {'row': rowNumber, 'username': row['username'], 'extension': row['extension'], 'build': None, 'error': ''}
+        try:
+            site = Sites.get_site(region, row['site'])
+            build = PhoneBuild.new_build(row['username'], row['extension'], row['build'].lower(), site,
+                                         userEnteredPhoneModel=row['model'], phoneMac=row['mac'])
+            if references is not None:
+                problems = references.validate_build(build)
+                if problems:
+                    raise ValueError('; '.join(problems))
+            job['build'] = build
+        except (Error, RequestException, ValueError) as err:
+            job['error'] = str(err)
+        jobs.append(job)
+    return jobs
+
+
+def sync_missing_users(service, jobs, workers, operator=''):
+    # Only LDAP sync if some users are missing, and then only once for all of them
+    usernames = sorted({job['username'] for job in jobs if job['build'] is not None})
+    userNames = resolve_users(service, usernames, workers)
+    missing = [phoneUsername for phoneUsername, names in userNames.items() if names is None]
+    if not missing:
+        print('All users found, skipping LDAP Sync...')
+        return userNames
+    print(f'{len(missing)} users not found, LDAP Syncing once for all of them. This may take 1-2 minutes... ')
+    for phoneUsername in missing:
+        AuditLog.event('not found, LDAP syncing', operation='doLdapSync', operator=operator or None, user=phoneUsername)
+    PhoneBuild.ldap_sync(service)
+    userNames.update(resolve_users(service, missing, workers))
+    return userNames
+
+
+def _journaled_extension(journal, build):
+    # The extension an earlier run allocated for the same user and devices, None if there was none
+    extension = None
+    for buildId in journal.build_ids():
+        phoneUsername, phoneExt, *devices = buildId.split(' ')
+        if phoneUsername == build['phoneUsername'] and devices == PhoneBuild.build_devices(build):
+            extension = phoneExt
+    return extension
+
+
+def _set_extension(job, extension):
+    job['build']['phoneExt'] = extension
+    job['extension'] = extension
+
+
+def _fail_row(job, error):
+    job['build'] = None
+    job['error'] = error
+    print(f"Row {job['row']}: {job['username']} {error}")
+
+
+def assign_extensions(service, jobs, journal=None):
+    # Gives the auto extension rows their extension, allocating all of a partition's rows from one load of its dial
+    # plan. Returns the number of rows allocated a new extension
+    groups = defaultdict(list)
+    for job in jobs:
+        build = job['build']
+        if build is None or build['phoneExt'] != PhoneBuild.AUTO_EXTENSION:
+            continue
+        if journal is None:
+            _fail_row(job, 'auto extensions are only allocated for new builds, not with --reconcile')
+            continue
+        extension = _journaled_extension(journal, build)
+        if extension is not None:
+            _set_extension(job, extension)
+        else:
+            groups[(build['routePartitionName'], build['extensionRange'])].append(job)
+    allocators = {}
+    allocated = 0
+    for (partition, extensionRange), group in groups.items():
+        if partition not in allocators:
+            allocators[partition] = ExtensionAllocator.ExtensionAllocator(service, partition)
+        try:
+            extensions = allocators[partition].allocate(extensionRange, len(group))
+        except (Error, RequestException, ValueError) as err:
+            for job in group:
+                _fail_row(job, 'no extension allocated: ' + str(err))
+            continue
+        for job, extension in zip(group, extensions):
+            _set_extension(job, extension)
+            print(f"Row {job['row']}: {job['username']} allocated extension {extension}")
+        allocated += len(group)
+    return allocated
+
+
+def _named_build(userNames, job):
+    # The row's build with the user's names filled in, raises ValueError if it can't be built
+    build = job['build']
+    if build is None:
+        raise ValueError(job['error'])
+    names = userNames.get(job['username'])
+    if names is None:
+        raise ValueError('No first/last name for ' + job['username'] + ' after LDAP sync')
+    PhoneBuild.set_user_names(build, *names)
+    return build
+
+
+def _plan_row(userNames, job, journal=None):
+    # The row's build and the steps of its compiled plan an earlier run didn't do. The names are
+    # already known, so the plan only reads the user's associated devices
+    build = _named_build(userNames, job)
+    return build, BuildPlan.pending_steps(BuildPlan.compile_plan(BuildPlan.plan_build(build), build), build, journal)
+
+
+def _completed(build, journal):
+    return journal is not None and journal.completed(BuildPlan.build_id(build))
+
+
+def preflight(service, jobs, userNames, journal=None, reconcile=False, mirror=None):
+    # Checks the rows left to build in a few executeSQLQuery calls. Rows with a conflict fail before any write,
+    # the others skip the getLine check. Returns the number of rows failed
+    builds = {}
+    newDevices = {}
+    newLines = set()
+    for job in jobs:
+        try:
+            build, steps = _plan_row(userNames, job, journal)
+        except ValueError:
+            continue
+        if _completed(build, journal):
+            continue
+        builds[job['row']] = build
+        # Reconcile updates the devices that exist, otherwise only the pending addPhones must be new
+        newDevices[job['row']] = [] if reconcile else [step['key'][1] for step in steps
+                                                       if step['operation'] == 'addPhone']
+        if any(step['operation'] == 'addLine' for step in steps):
+            newLines.add(job['row'])
+    conflicts, warnings = Preflight.check(service, builds, newDevices, newLines, mirror=mirror)
+    for job in jobs:
+        if job['row'] in conflicts:
+            _fail_row(job, 'pre-flight: ' + '; '.join(conflicts[job['row']]))
+        elif job['row'] in builds:
+            job['lineChecked'] = True
+        if job['row'] in warnings:
+            AuditLog.event('pre-flight: ' + '; '.join(warnings[job['row']]), level=logging.WARNING,
+                           user=job['username'], row=job['row'])
+            print(f"Row {job['row']}: {job['username']} note, {'; '.join(warnings[job['row']])}")
+    return len(conflicts)
+
+
+def count_calls(jobs, userNames, journal=None):
+    # (compiled, uncompiled) AXL calls the rows left to build will make, not counting the getLine checks
+    calls = uncompiled = 0
+    for job in jobs:
+        try:
+            build, steps = _plan_row(userNames, job, journal)
+        except ValueError:
+            continue
+        if _completed(build, journal):
+            continue
+        calls += len(steps)
+        uncompiled += len(BuildPlan.plan_build(build))
+    return calls, uncompiled
+
+
+def _new_result(job):
+    return {'row': job['row'], 'username': job['username'], 'extension': job['extension'], 'status': 'ok', 'error': ''}
+
+
+def _reconcile_row(build, steps, current, result):
+    # Only the fields that differ from CUCM are sent, the journal isn't used
+    steps = Reconcile.reconcile_plan(build, steps, current)[0]
+    if not steps:
+        result['status'] = 'in sync'
+    return steps
+
+
+def _skip_result(result, build, journal):
+    result['status'] = 'skipped'
+    result['error'] = 'already built, see ' + journal.path
+    result['devices'] = ' '.join(PhoneBuild.build_devices(build))
+    return result
+
+
+def _build_row(service, userNames, job, journal=None, reconcile=False):
+    # Returns a result dict, errors are reported per row instead of stopping the batch
+    start = time.monotonic()
+    result = _new_result(job)
+    try:
+        build, steps = _plan_row(userNames, job, journal)
+        if _completed(build, journal):
+            return _skip_result(result, build, journal)
+        if reconcile:
+            # Reads the line too, a missing extension fails the row
+            steps = _reconcile_row(build, steps, Reconcile.fetch_current(service, build, steps), result)
+        elif not job.get('lineChecked') and not build['newLine']:
+            # Fails with a Fault if the extension doesn't exist, existing devices are kept like menu option 1
+            PhoneBuild.get_line_devices(service, build)
+        result['calls'] = len(steps)
+        BuildPlan.run_plan(service, build, steps, journal)
+        result['devices'] = ' '.join(PhoneBuild.build_devices(build))
+    except (Error, RequestException, ValueError) as err:
+        result['status'] = 'failed'
+        result['error'] = str(err)
+    result['seconds'] = round(time.monotonic() - start, 3)
+    return result
+
+
+async def _build_row_async(axl, userNames, job, journal=None, reconcile=False):
+    # Same as _build_row on the asyncio client
+    start = time.monotonic()
+    result = _new_result(job)
+    try:
+        build, steps = _plan_row(userNames, job, journal)
+        if _completed(build, journal):
+            return _skip_result(result, build, journal)
+        if reconcile:
+            steps = _reconcile_row(build, steps, await AXLAsync.fetch_current(axl, build, steps), result)
+        elif not job.get('lineChecked') and not build['newLine']:
+            await AXLAsync.get_line_devices(axl, build)
+        result['calls'] = len(steps)
+        await AXLAsync.run_plan(axl, build, steps, journal)
+        result['devices'] = ' '.join(PhoneBuild.build_devices(build))
+    except (Error, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+        result['status'] = 'failed'
+        result['error'] = str(err) or type(err).__name__
+    result['seconds'] = round(time.monotonic() - start, 3)
+    return result
+
+
+def _audit_result(result, operator, message, level=logging.INFO):
+    AuditLog.event(message, level=level, operator=operator or None, user=result['username'],
+                   device=result.get('devices') or None, duration=result['seconds'], row=result['row'],
+                   extension=result['extension'], status=result['status'])
+
+
+def _report_result(result, operator):
+    if result['status'] == 'ok':
+        _audit_result(result, operator, 'built')
+        print(f"Row {result['row']}: {result['username']} built ({result['seconds']}s)")
+    elif result['status'] == 'in sync':
+        _audit_result(result, operator, 'in sync')
+        print(f"Row {result['row']}: {result['username']} already in sync ({result['seconds']}s)")
+    elif result['status'] == 'skipped':
+        print(f"Row {result['row']}: {result['username']} skipped, {result['error']}")
+    else:
+        _audit_result(result, operator, 'failed: ' + result['error'], logging.ERROR)
+        print(f"Row {result['row']}: {result['username']} FAILED: {result['error']}")
+
+
+def run_batch(service, jobs, workers, userNames, operator='', journal=None, reconcile=False):
+    results = []
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_build_row, service, userNames, job, journal, reconcile) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            _report_result(result, operator)
+    elapsed = time.monotonic() - start
+    results.sort(key=lambda result: result['row'])
+    return results, elapsed
+
+
+async def run_batch_async(axl, jobs, userNames, operator='', journal=None, reconcile=False):
+    # Every row is started at once, the client's semaphore limits the AXL calls in flight
+    results = []
+    start = time.monotonic()
+    async with axl:
+        for finished in asyncio.as_completed([_build_row_async(axl, userNames, job, journal, reconcile) for job in jobs]):
+            result = await finished
+            results.append(result)
+            _report_result(result, operator)
+    elapsed = time.monotonic() - start
+    results.sort(key=lambda result: result['row'])
+    return results, elapsed
+
+
+def write_report(path, results):
+    with open(path, 'w', newline='') as report:
+        writer = csv.DictWriter(report, fieldnames=['row', 'username', 'extension', 'status', 'seconds', 'calls', 'devices', 'error'])
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build phones for every row of a CSV/JSONL manifest.')
+    parser.add_argument('manifest', help='CSV or JSONL manifest of builds')
+    parser.add_argument('--region', required=True, choices=sorted(Sites.REGIONS), help='Regional CUCM to build on')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent AXL workers (default 8)')
+    parser.add_argument('--async', dest='useAsync', action='store_true',
+                        help='Build with asyncio coroutines, --workers AXL calls in flight')
+    parser.add_argument('--report', help='Per-row results CSV (default <manifest>.results.csv)')
+    parser.add_argument('--journal', help='Journal of completed steps to resume from (default <manifest>.journal)')
+    parser.add_argument('--check-only', action='store_true',
+                        help='Only run the pre-flight checks and print the conflicts, no phone, line or user is changed')
+    parser.add_argument('--mirror', action='store_true',
+                        help='Answer the pre-flight checks from the inventory mirror if it is fresh (see InventoryMirror.py)')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='Compare with the existing phones, lines and users and only send what differs')
+    parser.add_argument('--metrics', help='Write per operation AXL metrics (Prometheus text format) to this file')
+    parser.add_argument('--metrics-port', type=int, help='Serve the AXL metrics on http://127.0.0.1:<port>/metrics')
+    parser.add_argument('--wire-log', help='Log AXL requests/responses to this rotating file (see WireLog.py)')
+    parser.add_argument('--wire-sample', type=float, default=1.0, help='Fraction of the calls wire logged (default 1)')
+    parser.add_argument('--wire-operations', nargs='+', help='Only wire log these operations, e.g. addPhone updateUser')
+    args = parser.parse_args()
+    if args.wire_log:
+        WireLog.configure(args.wire_log, sampleRate=args.wire_sample, operations=args.wire_operations)
+    if args.metrics:
+        AXLMetrics.write_periodically(args.metrics)
+    if args.metrics_port:
+        AXLMetrics.serve(args.metrics_port)
+
+    rows = read_manifest(args.manifest)
+    if not rows:
+        print('Manifest is empty. Goodbye.')
+        sys.exit(1)
+    cucmusername, cucmpassword = Clusters.get_credentials()
+    AuditLog.setup(log, operator=cucmusername, cluster=args.region)
+    logging.info('started a bulk build of ' + str(len(rows)) + ' rows from ' + args.manifest)
+    service = _setup_connection(args.region, cucmusername, cucmpassword, args.workers)
+
+    # Check every row against the cluster's device pools, CSSs, templates etc. before any write
+    references = ReferenceCache.ReferenceCache(service, Sites.REGIONS[args.region]['serverUrl'])
+    try:
+        references.get('devicePool')
+    except (Error, RequestException) as err:
+        references = None
+        logging.warning('reference data not available, rows not validated ' + str(err))
+        print(f'Zeep error: reference data: { err }, continuing without validating rows')
+    jobs = prepare_rows(args.region, rows, references)
+
+    try:
+        userNames = sync_missing_users(service, jobs, args.workers, cucmusername)
+    except (Error, TimeoutError) as err:
+        logging.error(str(err))
+        print(f'Zeep error: doLdapSync: { err }')
+        sys.exit(1)
+
+    if args.reconcile:
+        # Re-applying is compared with CUCM every time, not skipped by a journal
+        journal = None
+        print('Reconcile mode: reading each row\'s phones, line and user, only the differences are sent')
+        logging.info('reconciling ' + str(len(jobs)) + ' rows')
+    else:
+        journal = BuildJournal.BuildJournal(args.journal or args.manifest + '.journal', cucmusername)
+
+    if any(job['build'] is not None and job['build']['newLine'] for job in jobs):
+        allocated = assign_extensions(service, jobs, journal)
+        print(f'Allocated {allocated} new extensions')
+        logging.info('allocated ' + str(allocated) + ' new extensions')
+
+    mirror = None
+    if args.mirror:
+        mirror = InventoryMirror.InventoryMirror(Sites.REGIONS[args.region]['serverUrl'])
+        print('Inventory mirror ' + mirror.describe()
+              + (', pre-flight checks answered from it' if mirror.fresh() else ', too old, asking CUCM'))
+        logging.info('inventory mirror ' + mirror.describe())
+        if not mirror.fresh():
+            mirror = None
+
+    try:
+        conflicts = preflight(service, jobs, userNames, journal, args.reconcile, mirror)
+        print(f'Pre-flight: {conflicts} rows with conflicts')
+        logging.info('pre-flight: ' + str(conflicts) + ' rows with conflicts')
+    except (Error, RequestException) as err:
+        logging.warning('pre-flight checks not available, checking each row as it is built ' + str(err))
+        print(f'Zeep error: pre-flight: { err }, checking each row as it is built')
+    if args.check_only:
+        sys.exit(1 if any(job['build'] is None for job in jobs) else 0)
+
+    if journal is not None:
+        calls, uncompiled = count_calls(jobs, userNames, journal)
+        unchecked = sum(1 for job in jobs if job['build'] is not None and not job.get('lineChecked')
+                        and not job['build']['newLine'] and not _completed(job['build'], journal))
+        print(f'The builds will make {calls} AXL calls ({uncompiled} before compiling)'
+              + (f', plus a getLine check for {unchecked} rows' if unchecked else ''))
+        logging.info('build plan: ' + str(calls) + ' AXL calls, ' + str(uncompiled) + ' before compiling')
+
+    if args.useAsync:
+        axl = AXLAsync.AsyncAXL(Sites.REGIONS[args.region]['serverUrl'], cucmusername, cucmpassword,
+                                verify=Sites.REGIONS[args.region]['sessionCert'], concurrency=args.workers)
+        results, elapsed = asyncio.run(run_batch_async(axl, jobs, userNames, cucmusername, journal, args.reconcile))
+    else:
+        results, elapsed = run_batch(service, jobs, args.workers, userNames, cucmusername, journal, args.reconcile)
+    if journal is not None:
+        journal.close()
+    report = args.report or args.manifest + '.results.csv'
+    write_report(report, results)
+
+    built = sum(1 for result in results if result['status'] == 'ok')
+    skipped = sum(1 for result in results if result['status'] in ('skipped', 'in sync'))
+    failed = sum(1 for result in results if result['status'] == 'failed')
+    buildsPerMinute = built / (elapsed / 60) if elapsed else 0.0
+    summary = (f'{built} built, {skipped} already built or in sync, {failed} failed in {elapsed:.1f}s '
+               f'({buildsPerMinute:.1f} builds/minute with {args.workers} workers)')
+    logging.info('finished bulk build: ' + summary)
+    for line in AXLMetrics.summary():
+        logging.info('AXL ' + line)
+    if args.metrics:
+        AXLMetrics.write_file(args.metrics)
+    print(f'\n{summary}\nPer-row results written to {report}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
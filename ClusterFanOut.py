@@ -0,0 +1,141 @@
+"""Run a job against every regional CUCM cluster at once, with one merged report
+
+Jobs:
+    emlogout   log every phone out of Extension Mobility (what ExMoBulkLogout.py does for one cluster)
+    inventory  list every phone with its model, description, device pool and owner
+
+Usage:
+    python ClusterFanOut.py emlogout --report emlogout.csv
+    python ClusterFanOut.py inventory --clusters US APAC --report inventory.csv
+
+Each cluster has its own session and AXL rate (Sites.py), so the clusters don't slow
+each other down. Credentials are read from the local credential manager, see
+StandardPhoneSetup.py.
+"""
+import argparse
+import logging
+import sys
+import time
+
+from zeep.exceptions import Fault
+
+import AuditLog
+import AXLEnvelope
+import AXLFastList
+import AXLMetrics
+import Clusters
+import ExtensionMobility
+import WireLog
+
+INVENTORY_COLUMNS = ('name', 'description', 'model', 'devicePoolName', 'ownerUserName')
+EM_LOGOUT_COLUMNS = ('device', 'status', 'error')
+
+# Log file, JSON lines written by a background thread (AuditLog.py)
+log = "fanout.log"
+
+
+def inventory_job(cluster, service):
+    return [{column: value or '' for column, value in zip(INVENTORY_COLUMNS, phone)}
+            for page in AXLFastList.iter_pages(service, 'listPhone', 'phone', INVENTORY_COLUMNS, {'name': '%'})
+            for phone in page]
+
+
+def em_discovery_job(cluster, service):
+    try:
+        phones = ExtensionMobility.logged_in_phones_sql(service)
+    except Fault as err:
+        AuditLog.event('SQL discovery failed, falling back to listPhone ' + str(err), level=logging.WARNING,
+                       operation='executeSQLQuery', cluster=cluster)
+        phones = ExtensionMobility.logged_in_phones_list(service)
+    return [{'device': phone} for phone in phones]
+
+
+def em_logout_job(phonesByCluster, workers):
+    def _job(cluster, service):
+        outcomes = ExtensionMobility.log_out_phones(service, phonesByCluster.get(cluster, []), workers, cluster=cluster)
+        return [{'device': phone, 'status': status, 'error': error}
+                for phone, (status, error) in sorted(outcomes.items())]
+    return _job
+
+
+def run_em_logout(clusters, cucmusername, cucmpassword, workers, confirm=True):
+    rows, summaries = Clusters.fan_out(em_discovery_job, clusters, cucmusername, cucmpassword, workers)
+    phonesByCluster = {}
+    for row in rows:
+        phonesByCluster.setdefault(row['cluster'], []).append(row['device'])
+    for cluster in clusters:
+        if summaries[cluster]['status'] == 'ok':
+            print(f'{cluster}: {len(phonesByCluster.get(cluster, []))} phones logged into Extension Mobility')
+        else:
+            print(f"{cluster}: discovery FAILED: {summaries[cluster]['error']}")
+    total = sum(len(phones) for phones in phonesByCluster.values())
+    if total == 0:
+        print('\nNo phones logged into Extension Mobility.')
+        return [], summaries
+    if confirm:
+        input('\nThere are ' + str(total) + ' phones to be logged out, do you want to continue? Press Enter to continue.')
+    for cluster, phones in phonesByCluster.items():
+        # Every phone's outcome is logged as it's logged out
+        AuditLog.event('executing log out on ' + str(len(phones)) + ' phones', cluster=cluster)
+    # Clusters with nothing to log out (or that failed discovery) are left alone, but still reported
+    logoutRows, logoutSummaries = Clusters.fan_out(em_logout_job(phonesByCluster, workers), sorted(phonesByCluster),
+                                                   cucmusername, cucmpassword, workers)
+    for cluster, summary in summaries.items():
+        logoutSummaries.setdefault(cluster, summary)
+    return logoutRows, logoutSummaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a job against several CUCM clusters at once.')
+    parser.add_argument('job', choices=('emlogout', 'inventory'))
+    parser.add_argument('--clusters', nargs='+', choices=Clusters.cluster_names(), default=Clusters.cluster_names(),
+                        help='Clusters to run on (default all)')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent AXL workers per cluster (default 8)')
+    parser.add_argument('--report', help='Merged results CSV (default <job>.csv)')
+    parser.add_argument('--yes', action='store_true', help="Don't ask before logging phones out")
+    parser.add_argument('--metrics', help='Write per operation AXL metrics (Prometheus text format) to this file')
+    parser.add_argument('--metrics-port', type=int, help='Serve the AXL metrics on http://127.0.0.1:<port>/metrics')
+    parser.add_argument('--wire-log', help='Log AXL requests/responses to this rotating file (see WireLog.py)')
+    parser.add_argument('--wire-sample', type=float, default=1.0, help='Fraction of the calls wire logged (default 1)')
+    parser.add_argument('--wire-operations', nargs='+', help='Only wire log these operations, e.g. addPhone updateUser')
+    parser.add_argument('--fast-envelopes', action='store_true',
+                        help='Send doDeviceLogout from precompiled envelopes (see AXLEnvelope.py)')
+    args = parser.parse_args()
+    if args.wire_log:
+        WireLog.configure(args.wire_log, sampleRate=args.wire_sample, operations=args.wire_operations)
+    if args.fast_envelopes:
+        AXLEnvelope.enable()
+    if args.metrics:
+        AXLMetrics.write_periodically(args.metrics)
+    if args.metrics_port:
+        AXLMetrics.serve(args.metrics_port)
+
+    cucmusername, cucmpassword = Clusters.get_credentials()
+    AuditLog.setup(log, operator=cucmusername)
+    logging.info('started ' + args.job + ' on ' + ', '.join(args.clusters))
+    start = time.monotonic()
+    if args.job == 'inventory':
+        rows, summaries = Clusters.fan_out(inventory_job, args.clusters, cucmusername, cucmpassword, args.workers)
+        columns = INVENTORY_COLUMNS
+    else:
+        rows, summaries = run_em_logout(args.clusters, cucmusername, cucmpassword, args.workers, not args.yes)
+        columns = EM_LOGOUT_COLUMNS
+    elapsed = time.monotonic() - start
+
+    report = args.report or args.job + '.csv'
+    Clusters.write_report(report, rows, columns)
+    print()
+    Clusters.print_summary(summaries, elapsed)
+    failed = [summary['cluster'] for summary in summaries.values() if summary['status'] != 'ok']
+    failed.extend(row['device'] for row in rows if row.get('status') == 'failed')
+    logging.info('finished ' + args.job + ': ' + str(len(rows)) + ' rows, ' + str(len(failed)) + ' failures')
+    for line in AXLMetrics.summary():
+        logging.info('AXL ' + line)
+    if args.metrics:
+        AXLMetrics.write_file(args.metrics)
+    print(f'Merged results written to {report}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Cluster registry and concurrent fan-out across the regional CUCM clusters
+
+Every region in Sites.REGIONS is a CUCM cluster with its own serverUrl, sessionCert
+and starting AXL rate. connect() returns a service on the cluster's pooled session
+(AXLTransport.py) and token bucket (AXLScheduler.py). fan_out() runs a job against
+several clusters at once, so a global job takes as long as the slowest cluster
+rather than the sum of all of them.
+
+    rows, summaries = Clusters.fan_out(job, Clusters.cluster_names(), cucmusername, cucmpassword)
+"""
+import csv
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from getpass import getpass
+
+import keyring
+from requests.exceptions import RequestException
+from zeep import Settings
+from zeep.exceptions import Error
+
+import AuditLog
+import AXLConnection
+import AXLScheduler
+import AXLTransport
+import Sites
+
+# The WSDL is a local file in the working directory, see README
+WSDL_FILE = 'schema/AXLAPI.wsdl'
+BINDING = '{http://www.cisco.com/AXLAPIService/}AXLAPIBinding'
+
+# One service per cluster, shared by every job and worker in the process
+_services = {}
+_servicesLock = threading.Lock()
+# {cluster: lock held while the cluster's service loads}, so clusters load side by side
+_connectLocks = {}
+
+
+def cluster_names():
+    return list(Sites.REGIONS)
+
+
+def get_credentials():
+    # Same credential manager entries as StandardPhoneSetup.py, only prompt if they're missing
+    cucmusername = keyring.get_password("username", "username")
+    if not cucmusername:
+        cucmusername = getpass(prompt="Please enter your CUCM username: Note: you will not see what's being typed: ")
+    cucmpassword = keyring.get_password("cucmpassword", "cucmpassword")
+    if not cucmpassword:
+        cucmpassword = getpass(prompt="Please enter your CUCM password: ")
+    if not cucmusername or not cucmpassword:
+        print("No username/password entered. Goodbye.")
+        sys.exit(1)
+    return cucmusername, cucmpassword
+
+
+def connect(cluster, cucmusername, cucmpassword, workers=AXLTransport.POOL_SIZE):
+    # workers sizes the cluster's connection pool, it only applies to the first connect
+    with _servicesLock:
+        if cluster in _services:
+            return _services[cluster]
+        connectLock = _connectLocks.setdefault(cluster, threading.Lock())
+    # Only this cluster waits for its load, AXLConnection writes the schema cache one thread at a time
+    with connectLock:
+        if cluster not in _services:
+            region = Sites.REGIONS[cluster]
+            # A cluster's rate never climbs past its configured axlRate
+            bucket = AXLScheduler.get_bucket(region['serverUrl'], rate=region.get('axlRate', AXLScheduler.AXL_RATE),
+                                             maxRate=region.get('axlRate', AXLScheduler.AXL_MAX_RATE))
+            transport = AXLTransport.get_transport(region['serverUrl'], region['sessionCert'], cucmusername,
+                                                   cucmpassword, poolSize=workers, bucket=bucket)
+            settings = Settings(strict=False, xml_huge_tree=True)
+            client = AXLConnection.load_client(WSDL_FILE, settings=settings, transport=transport)
+            AuditLog.event(AXLConnection.startup_report(), operator=cucmusername, cluster=cluster)
+            service = client.create_service(BINDING, region['serverUrl'])
+            with _servicesLock:
+                _services[cluster] = service
+        return _services[cluster]
+
+
+def fan_out(job, clusters, cucmusername, cucmpassword, workers=AXLTransport.POOL_SIZE):
+    # Runs job(cluster, service), which returns a list of row dicts, on every cluster at once.
+    # A cluster that fails is reported in its summary and doesn't stop the others.
+    # Returns every cluster's rows (with a 'cluster' key added) and {cluster: summary}
+    def _run(cluster):
+        start = time.monotonic()
+        summary = {'cluster': cluster, 'status': 'ok', 'rows': 0, 'error': ''}
+        rows = []
+        try:
+            service = connect(cluster, cucmusername, cucmpassword, workers)
+            rows = [dict(row, cluster=cluster) for row in job(cluster, service)]
+        except (Error, RequestException, TimeoutError) as err:
+            AuditLog.event('failed: ' + str(err), level=logging.ERROR, operator=cucmusername, cluster=cluster,
+                           duration=time.monotonic() - start)
+            summary['status'] = 'failed'
+            summary['error'] = str(err)
+        summary['rows'] = len(rows)
+        summary['seconds'] = time.monotonic() - start
+        return rows, summary
+
+    with ThreadPoolExecutor(max_workers=len(clusters)) as pool:
+        results = list(pool.map(_run, clusters))
+    rows = [row for clusterRows, summary in results for row in clusterRows]
+    return rows, {summary['cluster']: summary for clusterRows, summary in results}
+
+
+def write_report(path, rows, fieldnames):
+    # One merged CSV for all clusters, cluster first
+    with open(path, 'w', newline='') as report:
+        writer = csv.DictWriter(report, fieldnames=['cluster'] + list(fieldnames), extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def print_summary(summaries, elapsed):
+    for summary in summaries.values():
+        if summary['status'] == 'ok':
+            print(f"{summary['cluster']}: {summary['rows']} rows in {summary['seconds']:.1f}s")
+        else:
+            print(f"{summary['cluster']}: FAILED after {summary['seconds']:.1f}s: {summary['error']}")
+    sequential = sum(summary['seconds'] for summary in summaries.values())
+    print(f'{len(summaries)} clusters in {elapsed:.1f}s ({sequential:.1f}s one after another)')
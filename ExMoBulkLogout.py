@@ -18,18 +18,26 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-from lxml import etree
-from requests import Session
-from requests.auth import HTTPBasicAuth
 from getpass import getpass
 
-import zeep
-
-from zeep import Client, Settings, Plugin, xsd
-from zeep.transports import Transport
+from zeep import Settings
 from zeep.exceptions import Fault
 from progress.spinner import Spinner
+import asyncio
 import logging
+import sys
+import time
+
+import AuditLog
+import AXLAsync
+import AXLConnection
+import AXLEnvelope
+import AXLMetrics
+import AXLScheduler
+import AXLTransport
+import ExtensionMobility
+import InventoryMirror
+import WireLog
 
 # This script looks up all phones logged into Extension Mobility then prompts
 # before logging them all out of Extension Mobility.
@@ -44,95 +52,149 @@ amcucmpw = getpass(prompt='Please enter your CUCM password: ')
 sessionCert = 'certs/[servercert].pem'
 serverUrl = 'https://[hostname/ip]:8443/axl/'
 
-# Change to true to enable output of request/response headers and XML
+# Change to true to log AXL requests/responses to WIRE_LOG_FILE (see WireLog.py). Cheap enough to
+# leave on: only WIRE_LOG_SAMPLE of the calls to WIRE_LOG_OPERATIONS (None for all) are logged, each
+# message is cut at WIRE_LOG_MAX_BYTES, and the file is written by a background thread and rotated
 DEBUG = False
+WIRE_LOG_FILE = 'ExMoBulkLogout.wire.log'
+WIRE_LOG_SAMPLE = 1.0
+WIRE_LOG_OPERATIONS = None
+WIRE_LOG_MAX_BYTES = 16384
 
 # The WSDL is a local file in the working directory, see README
 WSDL_FILE = 'schema/AXLAPI.wsdl'
 
-# This class lets you view the incoming and outgoing http headers and XML
-
-class MyLoggingPlugin( Plugin ):
+# Find logged in phones with one executeSQLQuery against the Extension Mobility dynamic table,
+# so only logged in devices come back. Set to False (or if the query faults) to page listPhone instead
+USE_SQL_DISCOVERY = True
 
-    def egress( self, envelope, http_headers, operation, binding_options ):
+# Take the logged in phones from the local inventory mirror (see InventoryMirror.py) when it was synced
+# less than MIRROR_MAX_AGE seconds ago, without asking CUCM. Phones logged in since the sync are missed,
+# phones logged out since are skipped. Run python InventoryMirror.py sync first
+USE_MIRROR = False
+MIRROR_MAX_AGE = 300
 
-        # Format the request body as pretty printed XML
-        xml = etree.tostring( envelope, pretty_print = True, encoding = 'unicode')
+# Concurrent doDeviceLogout requests, and the most logouts per second sent to the publisher.
+# The rate drops automatically while CUCM is throttling AXL, see AXLScheduler.py
+LOGOUT_WORKERS = 8
+LOGOUT_RATE = 20
 
-        print( f'\nRequest\n-------\nHeaders:\n{http_headers}\n\nBody:\n{xml}' )
+# Log out with asyncio coroutines instead of worker threads (see AXLAsync.py). Worth it when
+# LOGOUT_RATE is raised well past what LOGOUT_WORKERS threads can keep busy on a slow publisher
+USE_ASYNC = False
+ASYNC_CONCURRENCY = 100
 
-    def ingress( self, envelope, http_headers, operation ):
+# Send doDeviceLogout from a precompiled envelope instead of having zeep build each one (see
+# AXLEnvelope.py). Saves most of the client CPU per logout, responses and faults are handled as usual
+FAST_ENVELOPES = False
 
-        # Format the response body as pretty printed XML
-        xml = etree.tostring( envelope, pretty_print = True, encoding = 'unicode')
+# Per operation AXL call counts, errors and latencies in the Prometheus text format (see AXLMetrics.py),
+# e.g. 'ExMoBulkLogout.prom' to write them to a file when the run finishes
+METRICS_FILE = None
 
-        print( f'\nResponse\n-------\nHeaders:\n{http_headers}\n\nBody:\n{xml}' )
+# Discovery paging, logout retries and skipped faults are set in ExtensionMobility.py
 
-# The first step is to create a SOAP client session
-session = Session()
+# The first step is to create a SOAP client session, shared by every logout worker
 
 # We avoid certificate verification by default
-session.verify = False
+sessionVerify = False
 
 # To enable SSL cert checking (recommended for production)
 # place the CUCM Tomcat cert .pem file in the certs subfolder of the project 
 # and uncomment the line below, comment out the line above
 
-# session.verify = sessionCert
+# sessionVerify = sessionCert
 
-# Add Basic Auth credentials
-session.auth = HTTPBasicAuth(cucmusername, amcucmpw)
-
-# Create a Zeep transport and set a reasonable timeout value
-transport = Transport( session = session, timeout = 10 )
+# Create a throttle-aware Zeep transport on the cluster's pooled session (a connection per
+# logout worker, Basic Auth credentials and per operation timeouts)
+bucket = AXLScheduler.get_bucket( serverUrl, rate = LOGOUT_RATE, maxRate = LOGOUT_RATE )
+transport = AXLTransport.get_transport( serverUrl, sessionVerify, cucmusername, amcucmpw,
+        poolSize = LOGOUT_WORKERS, bucket = bucket )
 
 # strict=False is not always necessary, but it allows zeep to parse imperfect XML
 settings = Settings( strict = False, xml_huge_tree = True)
 
-# If debug output is requested, add the MyLoggingPlugin callback
-plugin = [ MyLoggingPlugin() ] if DEBUG else [ ]
+# If debug output is requested, start the wire log
+if DEBUG:
+    WireLog.configure( WIRE_LOG_FILE, sampleRate = WIRE_LOG_SAMPLE, maxBytes = WIRE_LOG_MAX_BYTES,
+            operations = WIRE_LOG_OPERATIONS )
+
+if FAST_ENVELOPES:
+    AXLEnvelope.enable()
 
-# Create the Zeep client with the specified settings
-client = Client( WSDL_FILE, settings = settings, transport = transport,
-        plugins = plugin )
+# Create the Zeep client with the specified settings, from the cached schema when possible
+client = AXLConnection.load_client( WSDL_FILE, settings = settings, transport = transport )
+print( AXLConnection.startup_report() )
 
 # Create the Zeep service binding to AXL at the specified CUCM
 service = client.create_service( '{http://www.cisco.com/AXLAPIService/}AXLAPIBinding', serverUrl)
 
 
-# Set up logging
+# Set up logging, JSON lines written by a background thread (AuditLog.py)
 log = "ExMoBulkLogout.log"
-logging.basicConfig(filename='ExMoBulkLogout.log', level=logging.INFO, format='%(asctime)s %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+AuditLog.setup('ExMoBulkLogout.log', operator=cucmusername, cluster=AXLMetrics.cluster_name(serverUrl))
 
 
 def _get_logged_In_Phone_List():
-    loggedInPhoneList = []
+    if USE_MIRROR:
+        mirror = InventoryMirror.InventoryMirror(serverUrl)
+        if mirror.fresh(MIRROR_MAX_AGE):
+            print('Logged in phones from the inventory mirror, ' + mirror.describe())
+            logging.info('logged in phones from the inventory mirror, ' + mirror.describe())
+            return mirror.logged_in_phones()
+        print('Inventory mirror ' + mirror.describe() + ', too old, asking CUCM')
+    if USE_SQL_DISCOVERY:
+        try:
+            return ExtensionMobility.logged_in_phones_sql(service)
+        except Fault as err:
+            AuditLog.event('SQL discovery failed, falling back to listPhone ' + str(err), level=logging.WARNING,
+                           operation='executeSQLQuery')
+            print(f'Zeep error: executeSQLQuery: { err }, falling back to listPhone')
     spinner = Spinner('Getting data... ')
     try:
-        listPhoneResponse = service.listPhone(searchCriteria={'name': '%'},
-                                               returnedTags={'name': '', 'currentProfileName': '', 'description': ''})
-        listPhoneDict = listPhoneResponse['return']
-        phoneList = listPhoneDict.phone
-        for phone in phoneList:
-            spinner.next()
-            # Parse through list of phones and append to new list with only phones that have an ExMo profile logged in
-            if phone.currentProfileName.uuid is not None:
-                loggedInPhoneList.append(phone.name)
-        return loggedInPhoneList
+        return ExtensionMobility.logged_in_phones_list(service, progress=spinner.next)
     except Fault as err:
-        logging.error(cucmusername + ' ' + str(err))
-        print(f'Zeep error: updatePhone: { err }')
+        AuditLog.event(str(err), level=logging.ERROR, operation='listPhone')
+        print(f'Zeep error: listPhone: { err }')
+        input('\nPress Enter to quit.')
+        sys.exit(1)
+
+
+async def _log_out_phones_async(phonesLoggedIn, spinner):
+    # Same rate limit bucket and retries as the threaded path, ASYNC_CONCURRENCY calls in flight
+    axl = AXLAsync.AsyncAXL(serverUrl, cucmusername, amcucmpw, verify=sessionVerify, concurrency=ASYNC_CONCURRENCY,
+                            bucket=bucket)
+    async with axl:
+        return await AXLAsync.log_out_phones(axl, phonesLoggedIn, progress=spinner.next)
 
 
 def _log_out_phones(phonesLoggedIn):
     input('\nThere are ' + str(len(phonesLoggedIn)) + ' phones to be logged out, do you want to continue? Press Enter to continue.')
-    try:
-        logging.info(cucmusername + ' executed log out on the following phones' + phonesLoggedIn)
-        for phone in phonesLoggedIn:
-            service.doDeviceLogout(phone)
-    except Fault as err:
-        logging.error(cucmusername + ' ' + str(err))
-        print(f'Zeep error: updatePhone: { err }')
+    # Every phone's outcome is logged as it's logged out
+    logging.info('executing log out on ' + str(len(phonesLoggedIn)) + ' phones')
+    counts = dict.fromkeys(ExtensionMobility.LOGOUT_STATUSES, 0)
+    failures = {}
+    spinner = Spinner('Logging out... ')
+    start = time.monotonic()
+    if USE_ASYNC:
+        outcomes = asyncio.run(_log_out_phones_async(phonesLoggedIn, spinner))
+    else:
+        outcomes = ExtensionMobility.log_out_phones(service, phonesLoggedIn, LOGOUT_WORKERS, progress=spinner.next)
+    elapsed = time.monotonic() - start
+    for phone, (status, error) in outcomes.items():
+        counts[status] += 1
+        if status == 'failed':
+            failures[phone] = error
+    for phone, error in sorted(failures.items()):
+        print(f'\nZeep error: doDeviceLogout: {phone}: { error }')
+    summary = (f"{counts['logged out']} logged out, {counts['failed']} failed, "
+               f"{counts['skipped']} skipped in {elapsed:.1f}s")
+    logging.info('log out finished: ' + summary)
+    for line in AXLMetrics.summary():
+        logging.info('AXL ' + line)
+    if METRICS_FILE:
+        AXLMetrics.write_file(METRICS_FILE)
+    print('\n' + summary)
 
 
 phonesLoggedIn = _get_logged_In_Phone_List()
@@ -0,0 +1,215 @@
+"""Free extensions from an in-memory bitmap of a partition's dial plan
+
+Every pattern of the route partition is loaded with one paged executeSQLQuery (SQL_PAGE
+rows a page) into a sparse bitmap: one bit per number, in blocks of BLOCK_BITS numbers
+that are only allocated once a pattern falls in them, kept apart per number of digits
+so 1000 and 01000 are different extensions. "The next 20 free extensions in
+10000-19999" is then answered from memory, skipping full bytes 8 numbers at a time,
+instead of probing getLine number by number.
+
+    allocator = ExtensionAllocator.ExtensionAllocator(service, 'ALL_IPPhones')
+    extensions = allocator.allocate('10000-19999', 20)     # reserved for this batch
+    allocator.release(extensions[15:])                     # not needed after all
+
+Nothing is written to CUCM here, a build with newLine set creates its line with an
+addLine step (BuildPlan.py). allocate() re-reads only the range it allocates from
+first (refresh_range()), so numbers taken since the load aren't handed out, and the
+whole partition is reloaded after REFRESH_SECONDS. Allocated extensions are reserved
+in the process until released. Two operators allocating at the same moment can still
+pick the same number, the second addLine then fails with a duplicate and the row can
+be run again.
+"""
+import threading
+import time
+
+import AuditLog
+import Preflight
+
+# Numbers per bitmap block, and the bytes a block takes
+BLOCK_BITS = 65536
+BLOCK_BYTES = BLOCK_BITS // 8
+
+# Rows per executeSQLQuery page, for InventoryMirror.py's sync too. Keeps each response well under the AXL
+# response size limit
+SQL_PAGE = 10000
+
+# Seconds the whole partition is trusted before it's loaded again, allocate() refreshes its range anyway
+REFRESH_SECONDS = 900
+
+PATTERNS_SQL = ('select skip {skip} first {first} n.dnorpattern from numplan n '
+                'inner join routepartition rp on n.fkroutepartition = rp.pkid '
+                'where rp.name = {partition}{where} order by n.dnorpattern')
+
+RANGE_SQL = " and n.dnorpattern between {low} and {high}"
+
+
+def parse_range(extensionRange):
+    # '10000-19999' -> ('10000', '19999'). Both ends have the same number of digits
+    low, separator, high = str(extensionRange).partition('-')
+    low, high = low.strip(), high.strip()
+    if not separator or not low.isdigit() or not high.isdigit() or len(low) != len(high) or low > high:
+        raise ValueError('Extension range ' + str(extensionRange) + ' should be like 10000-19999')
+    return low, high
+
+
+class Bitmap:
+    # One bit per number of a given length, set for the numbers in use
+
+    def __init__(self):
+        # {(digits, block number): bytearray}
+        self.blocks = {}
+
+    def _locate(self, pattern):
+        number = int(pattern)
+        return (len(pattern), number // BLOCK_BITS), number % BLOCK_BITS
+
+    def add(self, pattern):
+        key, bit = self._locate(pattern)
+        block = self.blocks.get(key)
+        if block is None:
+            block = self.blocks[key] = bytearray(BLOCK_BYTES)
+        block[bit >> 3] |= 1 << (bit & 7)
+
+    def discard(self, pattern):
+        key, bit = self._locate(pattern)
+        block = self.blocks.get(key)
+        if block is not None:
+            block[bit >> 3] &= ~(1 << (bit & 7)) & 0xFF
+
+    def __contains__(self, pattern):
+        key, bit = self._locate(pattern)
+        block = self.blocks.get(key)
+        return block is not None and bool(block[bit >> 3] & (1 << (bit & 7)))
+
+    def clear_range(self, low, high):
+        # Whole bytes at a time, bit by bit only at the ends of the range
+        digits = len(low)
+        number, last = int(low), int(high)
+        while number <= last:
+            key, bit = (digits, number // BLOCK_BITS), number % BLOCK_BITS
+            block = self.blocks.get(key)
+            blockEnd = min(last, number - bit + BLOCK_BITS - 1)
+            if block is None:
+                number = blockEnd + 1
+            elif bit & 7 == 0 and number + 7 <= blockEnd:
+                end = (blockEnd - number + 1) // 8
+                block[bit >> 3:(bit >> 3) + end] = bytes(end)
+                number += end * 8
+            else:
+                block[bit >> 3] &= ~(1 << (bit & 7)) & 0xFF
+                number += 1
+
+    def free(self, low, high, count):
+        # Up to count numbers between low and high (same length strings) whose bit isn't set, lowest first
+        digits = len(low)
+        found = []
+        number, last = int(low), int(high)
+        while number <= last and len(found) < count:
+            block = self.blocks.get((digits, number // BLOCK_BITS))
+            bit = number % BLOCK_BITS
+            if block is None:
+                # Nothing in use in this block at all
+                blockEnd = min(last, number - bit + BLOCK_BITS - 1)
+                take = min(count - len(found), blockEnd - number + 1)
+                found.extend(str(free).zfill(digits) for free in range(number, number + take))
+                number = blockEnd + 1
+            elif bit & 7 == 0 and block[bit >> 3] == 0xFF and number + 7 <= last:
+                # 8 numbers in use, skip the byte
+                number += 8
+            else:
+                if not block[bit >> 3] & (1 << (bit & 7)):
+                    found.append(str(number).zfill(digits))
+                number += 1
+        return found
+
+    def __len__(self):
+        return sum(bin(byte).count('1') for block in self.blocks.values() for byte in block if byte)
+
+
+class ExtensionAllocator:
+
+    def __init__(self, service, routePartitionName, pageSize=SQL_PAGE):
+        self.service = service
+        self.routePartitionName = routePartitionName
+        self.pageSize = pageSize
+        self.lock = threading.Lock()
+        self.used = Bitmap()
+        # Handed out by allocate() and not released, never handed out again
+        self.reserved = set()
+        self.loadedAt = None
+
+    def _patterns(self, where=''):
+        # Every pattern of the partition (matching where), page by page
+        skip = 0
+        while True:
+            sql = PATTERNS_SQL.format(skip=skip, first=self.pageSize,
+                                      partition=Preflight.sql_string(self.routePartitionName), where=where)
+            rows = Preflight.query(self.service, sql)
+            for row in rows:
+                yield row.get('dnorpattern')
+            if len(rows) < self.pageSize:
+                break
+            skip += self.pageSize
+
+    def load(self):
+        # The whole partition. Patterns that aren't plain numbers (route patterns, +E.164) can't be allocated
+        used = Bitmap()
+        count = 0
+        start = time.monotonic()
+        for pattern in self._patterns():
+            if pattern and pattern.isdigit():
+                used.add(pattern)
+                count += 1
+        with self.lock:
+            self.used = used
+            self.loadedAt = time.monotonic()
+        AuditLog.event(f'loaded {count} extensions of {self.routePartitionName}', operation='executeSQLQuery',
+                       duration=time.monotonic() - start)
+
+    def refresh_range(self, low, high):
+        # Re-reads only the patterns between low and high, far less than the whole partition
+        patterns = [pattern for pattern in self._patterns(RANGE_SQL.format(low=Preflight.sql_string(low),
+                                                                          high=Preflight.sql_string(high)))
+                    if pattern and pattern.isdigit() and len(pattern) == len(low)]
+        with self.lock:
+            self.used.clear_range(low, high)
+            for pattern in patterns:
+                self.used.add(pattern)
+
+    def _fresh(self):
+        return self.loadedAt is not None and time.monotonic() - self.loadedAt < REFRESH_SECONDS
+
+    def _free(self, low, high, count):
+        # Called with the lock held. At most len(reserved) of the candidates are reserved, so there are still
+        # count left after them
+        candidates = self.used.free(low, high, count + len(self.reserved))
+        return [extension for extension in candidates if extension not in self.reserved][:count]
+
+    def free(self, extensionRange, count=1):
+        # The first count free extensions of the range, without reserving them
+        low, high = parse_range(extensionRange)
+        if not self._fresh():
+            self.load()
+        with self.lock:
+            return self._free(low, high, count)
+
+    def allocate(self, extensionRange, count=1):
+        # Reserves and returns the first count free extensions of the range. Raises ValueError if there aren't enough
+        low, high = parse_range(extensionRange)
+        if self._fresh():
+            self.refresh_range(low, high)
+        else:
+            self.load()
+        # Picked and reserved under one lock, so threads allocating at once never get the same extension
+        with self.lock:
+            extensions = self._free(low, high, count)
+            if len(extensions) < count:
+                raise ValueError(f'Only {len(extensions)} free extensions left in {extensionRange} of '
+                                 f'{self.routePartitionName}, {count} needed')
+            self.reserved.update(extensions)
+        return extensions
+
+    def release(self, extensions):
+        # Allocated extensions that weren't used after all
+        with self.lock:
+            self.reserved.difference_update(extensions)
\ No newline at end of file
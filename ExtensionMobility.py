@@ -0,0 +1,115 @@
+"""Extension Mobility discovery and logout steps shared by ExMoBulkLogout.py and ClusterFanOut.py
+
+Functions take the zeep service to work on, so the same steps can run against one
+cluster from the interactive script or against every cluster at once.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from requests.exceptions import RequestException
+from zeep.exceptions import Fault, TransportError
+
+import AuditLog
+import AXLEnvelope
+import AXLFastList
+
+# Phones fetched per listPhone request. Keeps each response well under the AXL response size limit
+PAGE_SIZE = 1000
+
+EM_LOGGED_IN_SQL = ('select d.name from device d, extensionmobilitydynamic emd '
+                    'where emd.fkdevice = d.pkid and emd.fkdevice_currentloginprofile is not null')
+
+# Transient faults that get past the throttle retries are retried with exponential backoff
+# before the phone is counted as failed
+LOGOUT_RETRIES = 3
+RETRY_BACKOFF = 1.0
+TRANSIENT_FAULTS = ('Maximum AXL Memory Allocation Consumed', 'timed out', 'Timeout')
+
+# Faults that mean there's nothing left to do for the phone (logged out or deleted since discovery)
+SKIP_FAULTS = ('not logged in', 'not found')
+
+LOGOUT_STATUSES = ('logged out', 'skipped', 'failed')
+
+
+def iter_phones(service, searchCriteria, returnedTags, pageSize=PAGE_SIZE):
+    # Page through listPhone with skip/first and yield phones as each page arrives,
+    # so only one page is ever held in memory no matter how big the cluster is
+    skip = 0
+    while True:
+        listPhoneResponse = service.listPhone(searchCriteria=searchCriteria, returnedTags=returnedTags,
+                                              skip=skip, first=pageSize)
+        listPhoneDict = listPhoneResponse['return']
+        phoneList = listPhoneDict.phone if listPhoneDict is not None else []
+        for phone in phoneList:
+            yield phone
+        if len(phoneList) < pageSize:
+            break
+        skip += pageSize
+
+
+def logged_in_phones_sql(service):
+    # Each row is a list of column elements, return is None when nobody is logged in
+    executeSQLQueryResponse = service.executeSQLQuery(sql=EM_LOGGED_IN_SQL)
+    sqlDict = executeSQLQueryResponse['return']
+    if sqlDict is None:
+        return []
+    return [row[0].text for row in sqlDict.row]
+
+
+def logged_in_phones_list(service, progress=None, pageSize=PAGE_SIZE):
+    # Slower fallback for AXL users that can't run SQL. progress is called per phone, e.g. spinner.next
+    # Only the name and the profile's uuid are needed, so the pages skip zeep and are parsed with iterparse
+    loggedInPhoneList = []
+    for page in AXLFastList.iter_pages(service, 'listPhone', 'phone', ('name', 'currentProfileName@uuid'),
+                                       {'name': '%'}, pageSize):
+        for name, profileUuid in page:
+            if progress is not None:
+                progress()
+            # Keep only phones that have an ExMo profile logged in
+            if profileUuid is not None:
+                loggedInPhoneList.append(name)
+    return loggedInPhoneList
+
+
+def log_out_phone(service, phone, retries=LOGOUT_RETRIES, backoff=RETRY_BACKOFF):
+    # Returns ('logged out' | 'skipped' | 'failed', error) instead of raising, so one phone can't stop the run
+    for attempt in range(retries + 1):
+        try:
+            AXLEnvelope.call(service, 'doDeviceLogout', deviceName=phone)
+            return 'logged out', ''
+        except Fault as err:
+            if any(text in str(err) for text in SKIP_FAULTS):
+                return 'skipped', str(err)
+            if not any(text in str(err) for text in TRANSIENT_FAULTS) or attempt == retries:
+                return 'failed', str(err)
+        except (TransportError, RequestException) as err:
+            if attempt == retries:
+                return 'failed', str(err)
+        time.sleep(backoff * 2 ** attempt)
+
+
+def audit_logout(phone, status, error, duration, cluster=None):
+    # One audit log line per phone (AuditLog.py)
+    AuditLog.event(status + ' ' + phone + (': ' + error if error else ''),
+                   level=logging.ERROR if status == 'failed' else logging.INFO, operation='doDeviceLogout',
+                   device=phone, cluster=cluster, duration=duration, status=status)
+
+
+def _log_out_audited(service, phone, cluster=None, **kwargs):
+    start = time.monotonic()
+    status, error = log_out_phone(service, phone, **kwargs)
+    audit_logout(phone, status, error, time.monotonic() - start, cluster)
+    return status, error
+
+
+def log_out_phones(service, phones, workers, progress=None, cluster=None, **kwargs):
+    # {phone: (status, error)} for every phone, on a pool of workers. progress is called after each phone
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_log_out_audited, service, phone, cluster, **kwargs): phone for phone in phones}
+        for future in as_completed(futures):
+            outcomes[futures[future]] = future.result()
+            if progress is not None:
+                progress()
+    return outcomes
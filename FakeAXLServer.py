@@ -0,0 +1,544 @@
+"""Local stand-in for the CUCM AXL API, for trying the scripts and load testing without a publisher
+
+Answers the AXL operations these scripts use from an in-memory store of phones,
+lines and users: getLine, addLine, getUser, updateUser, getPhone, addPhone, updatePhone,
+removePhone, updateLine, listPhone, listUser, doLdapSync, getLdapSyncStatus, doDeviceLogout,
+executeSQLQuery (the Extension Mobility, Preflight.py, ExtensionAllocator.py and
+InventoryMirror.py queries only) and the list* calls of
+ReferenceCache.py. Every request can be slowed down (latency, jitter) and failed on
+purpose (faultRate, throttleRate, or the next n calls of an operation).
+
+    server = FakeAXLServer.start(latency=0.05)
+    FakeAXLServer.seed(server.store, users=100, phones=100, loggedIn=0.5)
+    # point serverUrl at server.url, with sessionCert = False
+
+Usage:
+    python FakeAXLServer.py --port 8080 --latency 0.05 --users 100 --phones 100
+
+The schema files are still needed on the client side. Nothing is validated against
+the schema, the server only answers what the scripts ask for. AXLBenchmark.py uses it.
+"""
+import argparse
+import copy
+import fnmatch
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+import PhoneBuild
+import ReferenceCache
+import Sites
+
+SOAP_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+AXL_NS = 'http://www.cisco.com/AXL/API/11.5'
+
+# Models the reference data is seeded for, see seed_references()
+DEFAULT_MODELS = ('7841', '7942', '8845', '8851', '8865')
+
+LDAP_SYNC_DONE = PhoneBuild.LDAP_SYNC_DONE
+
+# Same wording as CUCM where the scripts look at the message
+LINE_NOT_FOUND = 'Item not valid: The specified Line was not found'
+USER_NOT_FOUND = 'Item not valid: The specified User was not found'
+PHONE_NOT_FOUND = 'Item not valid: The specified Phone was not found'
+DUPLICATE = 'Could not insert new row - duplicate value in a UNIQUE INDEX column (Unique Index:)'
+NOT_LOGGED_IN = 'Device is not logged in'
+INJECTED_FAULT = 'FakeAXLServer injected fault'
+
+
+class AXLFault(Exception):
+    pass
+
+
+def _element(tag, value):
+    # Element for a plain value: dicts become child elements, lists repeat the tag
+    element = etree.Element(tag)
+    if isinstance(value, dict):
+        for child, childValue in value.items():
+            for item in childValue if isinstance(childValue, list) else [childValue]:
+                element.append(_element(child, item))
+    elif value is not None:
+        element.text = str(value).lower() if isinstance(value, bool) else str(value)
+    return element
+
+
+def _copy(element):
+    # A request element without the envelope's namespace declarations
+    element = copy.deepcopy(element)
+    etree.cleanup_namespaces(element)
+    return element
+
+
+def _localname(element):
+    return etree.QName(element).localname
+
+
+class AXLStore:
+    # Phones, lines and users as {field: element}, the elements as they were sent
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phones = {}
+        self.lines = {}
+        self.users = {}
+        # Users in LDAP that only show up in CUCM after doLdapSync: {userid: (firstName, lastName)}
+        self.directory = {}
+        self.loggedIn = set()
+        # Devices that aren't phones {name: tkclass}, and patterns that aren't lines {(pattern, partition):
+        # tkpatternusage}, e.g. route patterns. Only executeSQLQuery sees them, addPhone/addLine can't reuse them
+        self.otherDevices = {}
+        self.otherPatterns = {}
+        # List operation: names, see ReferenceCache.REFERENCE_TYPES
+        self.references = {}
+
+    def add_user(self, userid, firstName, lastName, synced=True):
+        if not synced:
+            self.directory[userid] = (firstName, lastName)
+            return
+        self.users[userid] = {'firstName': _element('firstName', firstName), 'lastName': _element('lastName', lastName)}
+
+    def add_line(self, pattern, routePartitionName):
+        self.lines[(pattern, routePartitionName)] = {}
+
+    def add_phone(self, phone, loggedIn=False):
+        # phone as an addPhone payload
+        self.phones[phone['name']] = {field: _element(field, value) for field, value in phone.items()
+                                      if field != 'name' and value is not None}
+        if loggedIn:
+            self.loggedIn.add(phone['name'])
+
+    def line_devices(self, pattern):
+        return [name for name, fields in self.phones.items()
+                if 'lines' in fields and pattern in fields['lines'].xpath('line/dirn/pattern/text()')]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        request = etree.fromstring(self.rfile.read(int(self.headers['Content-Length'])))
+        body = request.find('{%s}Body' % SOAP_NS)[0]
+        operation = _localname(body)
+        with server.lock:
+            server.calls[operation] += 1
+        time.sleep(server.operationLatency.get(operation, server.latency) + random.uniform(0, server.jitter))
+        if random.random() < server.throttleRate:
+            # Like a busy publisher, AXLScheduler backs off and retries
+            return self._reply(503)
+        try:
+            with server.lock:
+                failNext = server.faults.get(operation, 0)
+                if failNext:
+                    server.faults[operation] = failNext - 1
+            if failNext or random.random() < server.faultRate:
+                raise AXLFault(server.faultMessage)
+            handler = getattr(server, 'op_' + operation, None)
+            if handler is None:
+                raise AXLFault('FakeAXLServer does not implement ' + operation)
+            with server.store.lock:
+                returned = handler(body)
+        except AXLFault as err:
+            with server.lock:
+                server.calls[operation + ' fault'] += 1
+            return self._reply(500, _fault(operation, str(err)))
+        self._reply(200, _response(operation, returned))
+
+
+def _envelope(content):
+    return (f'<?xml version="1.0" encoding="utf-8"?><soapenv:Envelope xmlns:soapenv="{SOAP_NS}">'
+            f'<soapenv:Body>{content}</soapenv:Body></soapenv:Envelope>').encode()
+
+
+def _response(operation, returned):
+    return _envelope(f'<ns:{operation}Response xmlns:ns="{AXL_NS}"><return>{returned}</return></ns:{operation}Response>')
+
+
+def _fault(operation, message):
+    message = message.replace('&', '&amp;').replace('<', '&lt;')
+    return _envelope(f'<soapenv:Fault><faultcode>soapenv:Server</faultcode><faultstring>{message}</faultstring>'
+                     f'<detail><axlError><axlcode>-1</axlcode><axlmessage>{message}</axlmessage>'
+                     f'<request>{operation}</request></axlError></detail></soapenv:Fault>')
+
+
+def _text(body, path):
+    return body.findtext(path)
+
+
+def _sql_values(sql):
+    # The quoted string literals in a piece of SQL, e.g. an IN-list
+    return [value.replace("''", "'") for value in re.findall(r"'((?:[^']|'')*)'", sql)]
+
+
+def _sql_in_list(sql):
+    # The values of the IN-list the statement ends with
+    return _sql_values(sql.rsplit(' in (', 1)[1])
+
+
+def _field_text(fields, field):
+    return fields[field].text if field in fields else None
+
+
+def _sql_row(**columns):
+    # An executeSQLQuery row, NULL columns are left out like CUCM does
+    return '<row>' + ''.join(f'<{column}>{escape(value)}</{column}>' for column, value in columns.items()
+                             if value is not None) + '</row>'
+
+
+def _render(tag, fields, returnedTags, attributes=''):
+    # The object with the fields asked for, in the order of returnedTags (the schema order), or all of them
+    if returnedTags is not None:
+        names = [_localname(tag) for tag in returnedTags]
+        children = [fields[name] for name in names if name in fields]
+    else:
+        children = list(fields.values())
+    return f'<{tag}{attributes}>' + ''.join(etree.tostring(child, encoding='unicode') for child in children) + f'</{tag}>'
+
+
+class FakeAXLServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, store=None, latency=0.0, jitter=0.0, faultRate=0.0, throttleRate=0.0,
+                 faultMessage=INJECTED_FAULT, ldapSyncSeconds=0.0):
+        super().__init__(address, _Handler)
+        self.store = store or AXLStore()
+        self.latency = latency
+        self.jitter = jitter
+        # Seconds for particular operations, e.g. {'listPhone': 0.5}
+        self.operationLatency = {}
+        self.faultRate = faultRate
+        self.throttleRate = throttleRate
+        self.faultMessage = faultMessage
+        # {operation: n} fails the next n calls of the operation
+        self.faults = {}
+        self.ldapSyncSeconds = ldapSyncSeconds
+        self.ldapSyncStarted = None
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}/axl/'
+
+    def fail_next(self, operation, count=1):
+        with self.lock:
+            self.faults[operation] = self.faults.get(operation, 0) + count
+
+    # Operations, called with the store locked. Each returns the content of <return>
+
+    def op_getLine(self, body):
+        key = (_text(body, 'pattern'), _text(body, 'routePartitionName'))
+        if key not in self.store.lines:
+            raise AXLFault(LINE_NOT_FOUND)
+        fields = {'pattern': _element('pattern', key[0])}
+        fields.update(self.store.lines[key])
+        devices = self.store.line_devices(key[0])
+        fields['associatedDevices'] = _element('associatedDevices', {'device': devices} if devices else None)
+        return _render('line', fields, body.find('returnedTags'), f' uuid="{{{uuid.uuid4()}}}"')
+
+    def op_addLine(self, body):
+        line = body.find('line')
+        key = (line.findtext('pattern'), line.findtext('routePartitionName'))
+        if key in self.store.lines or key in self.store.otherPatterns:
+            raise AXLFault(DUPLICATE)
+        self.store.lines[key] = {_localname(child): _copy(child) for child in line
+                                 if _localname(child) not in ('pattern', 'routePartitionName')}
+        return f'{{{uuid.uuid4()}}}'
+
+    def op_updateLine(self, body):
+        key = (_text(body, 'pattern'), _text(body, 'routePartitionName'))
+        if key not in self.store.lines:
+            raise AXLFault(LINE_NOT_FOUND)
+        for child in body:
+            if _localname(child) not in ('pattern', 'routePartitionName'):
+                self.store.lines[key][_localname(child)] = _copy(child)
+        return f'{{{uuid.uuid4()}}}'
+
+    def op_getUser(self, body):
+        userid = _text(body, 'userid')
+        if userid not in self.store.users:
+            raise AXLFault(USER_NOT_FOUND)
+        fields = dict(self.store.users[userid])
+        fields['userid'] = _element('userid', userid)
+        fields.setdefault('associatedDevices', _element('associatedDevices', None))
+        return _render('user', fields, body.find('returnedTags'), f' uuid="{{{uuid.uuid4()}}}"')
+
+    def op_updateUser(self, body):
+        userid = _text(body, 'userid')
+        if userid not in self.store.users:
+            raise AXLFault(USER_NOT_FOUND)
+        for child in body:
+            if _localname(child) != 'userid':
+                self.store.users[userid][_localname(child)] = _copy(child)
+        return f'{{{uuid.uuid4()}}}'
+
+    def op_getPhone(self, body):
+        name = _text(body, 'name')
+        if name not in self.store.phones:
+            raise AXLFault(PHONE_NOT_FOUND)
+        fields = {'name': _element('name', name)}
+        fields.update(self.store.phones[name])
+        return _render('phone', fields, body.find('returnedTags'), f' uuid="{{{uuid.uuid4()}}}"')
+
+    def op_addPhone(self, body):
+        phone = body.find('phone')
+        name = phone.findtext('name')
+        if name in self.store.phones or name in self.store.otherDevices:
+            raise AXLFault(DUPLICATE)
+        for pattern, partition in zip(phone.xpath('lines/line/dirn/pattern/text()'),
+                                      phone.xpath('lines/line/dirn/routePartitionName/text()')):
+            if (pattern, partition) not in self.store.lines:
+                raise AXLFault(LINE_NOT_FOUND)
+        self.store.phones[name] = {_localname(child): _copy(child) for child in phone if _localname(child) != 'name'}
+        return f'{{{uuid.uuid4()}}}'
+
+    def op_updatePhone(self, body):
+        name = _text(body, 'name')
+        if name not in self.store.phones:
+            raise AXLFault(PHONE_NOT_FOUND)
+        for child in body:
+            if _localname(child) != 'name':
+                self.store.phones[name][_localname(child)] = _copy(child)
+        return f'{{{uuid.uuid4()}}}'
+
+    def op_removePhone(self, body):
+        name = _text(body, 'name')
+        if self.store.phones.pop(name, None) is None:
+            raise AXLFault(PHONE_NOT_FOUND)
+        self.store.loggedIn.discard(name)
+        return f'{{{uuid.uuid4()}}}'
+
+    def op_listPhone(self, body):
+        pattern = (_text(body, 'searchCriteria/name') or '%').replace('%', '*')
+        names = sorted(name for name in self.store.phones if fnmatch.fnmatchcase(name, pattern))
+        skip = int(_text(body, 'skip') or 0)
+        first = _text(body, 'first')
+        names = names[skip:skip + int(first)] if first else names[skip:]
+        returnedTags = body.find('returnedTags')
+        phones = []
+        for name in names:
+            fields = {'name': _element('name', name)}
+            fields.update(self.store.phones[name])
+            if 'product' in fields:
+                fields['model'] = _element('model', fields['product'].text)
+            profile = etree.Element('currentProfileName')
+            if name in self.store.loggedIn:
+                profile.set('uuid', '{' + str(uuid.uuid5(uuid.NAMESPACE_DNS, name)) + '}')
+                profile.text = name + '-profile'
+            fields['currentProfileName'] = profile
+            phones.append(_render('phone', fields, returnedTags, f' uuid="{{{uuid.uuid5(uuid.NAMESPACE_DNS, name)}}}"'))
+        return ''.join(phones)
+
+    def op_listUser(self, body):
+        pattern = (_text(body, 'searchCriteria/userid') or '%').replace('%', '*')
+        userids = sorted(userid for userid in self.store.users if fnmatch.fnmatchcase(userid, pattern))
+        skip = int(_text(body, 'skip') or 0)
+        first = _text(body, 'first')
+        userids = userids[skip:skip + int(first)] if first else userids[skip:]
+        users = []
+        for userid in userids:
+            fields = {'userid': _element('userid', userid)}
+            fields.update(self.store.users[userid])
+            users.append(_render('user', fields, body.find('returnedTags'),
+                                 f' uuid="{{{uuid.uuid5(uuid.NAMESPACE_DNS, userid)}}}"'))
+        return ''.join(users)
+
+    def op_doLdapSync(self, body):
+        for userid, (firstName, lastName) in self.store.directory.items():
+            self.store.add_user(userid, firstName, lastName)
+        self.store.directory.clear()
+        self.ldapSyncStarted = time.monotonic()
+        return 'Sync initiated'
+
+    def op_getLdapSyncStatus(self, body):
+        if self.ldapSyncStarted is not None and time.monotonic() - self.ldapSyncStarted < self.ldapSyncSeconds:
+            return 'Sync is currently under process'
+        return LDAP_SYNC_DONE
+
+    def op_doDeviceLogout(self, body):
+        name = _text(body, 'deviceName')
+        if name not in self.store.phones:
+            raise AXLFault(PHONE_NOT_FOUND)
+        if name not in self.store.loggedIn:
+            raise AXLFault(NOT_LOGGED_IN)
+        self.store.loggedIn.discard(name)
+        return f'{{{uuid.uuid4()}}}'
+
+    def op_executeSQLQuery(self, body):
+        sql = _text(body, 'sql')
+        paged = re.match(r'select skip (\d+) first (\d+) (.*)$', sql, re.S)
+        if paged:
+            skip, first = int(paged.group(1)), int(paged.group(2))
+            return ''.join(self._sql_paged(paged.group(3))[skip:skip + first])
+        if 'extensionmobilitydynamic' in sql:
+            return ''.join(f'<row><name>{name}</name></row>' for name in sorted(self.store.loggedIn))
+        if sql.startswith('select d.name, eu.userid from device d'):
+            return self._sql_devices(_sql_in_list(sql))
+        if sql.startswith('select n.dnorpattern, d.name from numplan n'):
+            partition = _sql_values(sql.split('rp.name = ', 1)[1].split(' and ', 1)[0])[0]
+            return self._sql_lines(partition, _sql_in_list(sql))
+        raise AXLFault('FakeAXLServer only answers the Extension Mobility, Preflight.py, ExtensionAllocator.py and '
+                       'InventoryMirror.py queries')
+
+    def _sql_devices(self, names):
+        names = set(names)
+        devices = {name: _field_text(fields, 'ownerUserName') for name, fields in self.store.phones.items()}
+        devices.update(dict.fromkeys(self.store.otherDevices))
+        return ''.join(_sql_row(name=name, userid=owner) for name, owner in sorted(devices.items())
+                       if name.upper() in names)
+
+    def _sql_lines(self, partition, patterns):
+        rows = []
+        for pattern in patterns:
+            if (pattern, partition) in self.store.otherPatterns:
+                rows.append(_sql_row(dnorpattern=pattern))
+            if (pattern, partition) not in self.store.lines:
+                continue
+            devices = self.store.line_devices(pattern) or [None]
+            rows.extend(f'<row><dnorpattern>{pattern}</dnorpattern>' + (f'<name>{name}</name>' if name else '')
+                        + '</row>' for name in devices)
+        return ''.join(rows)
+
+    def _sql_paged(self, query):
+        # Every row of a skip/first query, as <row> strings in the query's order
+        if query.startswith('n.dnorpattern from numplan n inner join'):
+            return self._sql_patterns(query)
+        if query.startswith('d.name, d.tkclass'):
+            devices = {name: _sql_row(name=name, tkclass='1', description=_field_text(fields, 'description'),
+                                      userid=_field_text(fields, 'ownerUserName'),
+                                      profile='EM-' + name if name in self.store.loggedIn else None)
+                       for name, fields in self.store.phones.items()}
+            devices.update((name, _sql_row(name=name, tkclass=str(tkclass)))
+                           for name, tkclass in self.store.otherDevices.items())
+            return [row for name, row in sorted(devices.items())]
+        if query.startswith('n.dnorpattern, rp.name'):
+            patterns = dict.fromkeys(self.store.lines, 2)
+            patterns.update(self.store.otherPatterns)
+            return [_sql_row(dnorpattern=pattern, routepartition=partition, tkpatternusage=str(usage))
+                    for (pattern, partition), usage in sorted(patterns.items())]
+        if query.startswith('d.name, n.dnorpattern'):
+            return [_sql_row(name=name, dnorpattern=line.findtext('dirn/pattern'),
+                             routepartition=line.findtext('dirn/routePartitionName'),
+                             numplanindex=line.findtext('index'))
+                    for name, fields in sorted(self.store.phones.items()) if 'lines' in fields
+                    for line in fields['lines'].findall('line')]
+        if query.startswith('eu.userid, eu.firstname'):
+            return [_sql_row(userid=userid, firstname=_field_text(fields, 'firstName'),
+                             lastname=_field_text(fields, 'lastName'))
+                    for userid, fields in sorted(self.store.users.items())]
+        if query.startswith('eu.userid, d.name'):
+            return [_sql_row(userid=userid, name=name) for userid, fields in sorted(self.store.users.items())
+                    if 'associatedDevices' in fields
+                    for name in sorted(fields['associatedDevices'].xpath('device/text()'))]
+        raise AXLFault('FakeAXLServer only answers the Extension Mobility, Preflight.py, ExtensionAllocator.py and '
+                       'InventoryMirror.py queries')
+
+    def _sql_patterns(self, query):
+        # ExtensionAllocator.py's patterns of a partition, optionally between two patterns
+        values = _sql_values(query.split('rp.name = ', 1)[1])
+        partition, bounds = values[0], values[1:3]
+        patterns = sorted(pattern for pattern, linePartition in list(self.store.lines) + list(self.store.otherPatterns)
+                          if linePartition == partition and (not bounds or bounds[0] <= pattern <= bounds[1]))
+        return [_sql_row(dnorpattern=pattern) for pattern in patterns]
+
+    def _list_references(self, body, operation, item):
+        return ''.join(f'<{item} uuid="{{{uuid.uuid5(uuid.NAMESPACE_DNS, name)}}}"><name>{name}</name></{item}>'
+                       for name in self.store.references.get(operation, []))
+
+
+def _reference_handler(operation, item):
+    return lambda self, body: self._list_references(body, operation, item)
+
+
+for _operation, _item in ReferenceCache.REFERENCE_TYPES.values():
+    setattr(FakeAXLServer, 'op_' + _operation, _reference_handler(_operation, _item))
+
+
+def seed_references(store, models=DEFAULT_MODELS):
+    # Every device pool, CSS, template etc. the Sites.py sites name for these models, so builds validate
+    names = {operation: set() for operation, item in ReferenceCache.REFERENCE_TYPES.values()}
+    for region in Sites.REGIONS:
+        for siteCode in Sites.REGIONS[region]['sites']:
+            site = Sites.get_site(region, siteCode)
+            for model in models:
+                build = PhoneBuild.new_build('seed', '1000', 'both', site, userEnteredPhoneModel=model,
+                                             phoneMac='000000000000')
+                PhoneBuild.set_user_names(build, 'Seed', 'Seed')
+                for phone in (PhoneBuild.desk_phone_payload(build), PhoneBuild.jabber_payload(build)):
+                    for field, objectType in ReferenceCache.PHONE_REFERENCES.items():
+                        if phone.get(field) is not None:
+                            names[ReferenceCache.REFERENCE_TYPES[objectType][0]].add(phone[field])
+                names['listRoutePartition'].add(build['routePartitionName'])
+                forwardCss = (build['callForwardAll'] or {}).get('callingSearchSpaceName')
+                if forwardCss is not None:
+                    names['listCss'].add(forwardCss)
+    store.references = {operation: sorted(values) for operation, values in names.items()}
+
+
+def seed(store, users=0, phones=0, loggedIn=0.0, unsynced=0, region='US', firstExtension=10000):
+    # users synced users (user00001...) with a free extension each, unsynced more only in LDAP until
+    # doLdapSync, and phones Jabber devices of which the loggedIn fraction are logged into Extension Mobility
+    partition = Sites.REGIONS[region]['routePartitionName']
+    for number in range(users + unsynced):
+        userid = f'user{number:05d}'
+        store.add_user(userid, 'First' + str(number), 'Last' + str(number), synced=number < users)
+        store.add_line(str(firstExtension + number), partition)
+    for number in range(phones):
+        store.add_phone({'name': f'SEP{number:012X}', 'description': 'Seeded phone ' + str(number),
+                         'product': 'Cisco 8845', 'devicePoolName': 'LOCATION1_PHONES'},
+                        loggedIn=number < phones * loggedIn)
+    seed_references(store)
+
+
+def start(port=0, **kwargs):
+    # Serves on 127.0.0.1 from a background thread, port 0 picks a free port
+    server = FakeAXLServer(('127.0.0.1', port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake AXL API on 127.0.0.1 for testing without CUCM.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds before each answer (default 0)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many extra random seconds')
+    parser.add_argument('--fault-rate', type=float, default=0.0, help='Fraction of calls that return a Fault')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of calls answered with HTTP 503')
+    parser.add_argument('--users', type=int, default=100, help='Users in CUCM, each with a free extension')
+    parser.add_argument('--unsynced', type=int, default=0, help='More users only found after an LDAP sync')
+    parser.add_argument('--phones', type=int, default=100, help='Phones already in CUCM')
+    parser.add_argument('--logged-in', type=float, default=0.5, help='Fraction of the phones logged into EM')
+    args = parser.parse_args()
+
+    server = FakeAXLServer(('127.0.0.1', args.port), latency=args.latency, jitter=args.jitter,
+                           faultRate=args.fault_rate, throttleRate=args.throttle_rate)
+    seed(server.store, users=args.users, phones=args.phones, loggedIn=args.logged_in, unsynced=args.unsynced)
+    print(f'Fake AXL API on {server.url} with {args.users} users (user00000...) and {args.phones} phones.')
+    print("Set serverUrl to it and sessionCert = False. Ctrl + C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Stream a cluster's phones or users to CSV, JSONL or Parquet
+
+Pages through listPhone/listUser with only the columns asked for as returnedTags.
+Each page is parsed straight into plain rows as it arrives (AXLFastList.py, no zeep
+objects) and written out straight away, so memory stays at a couple of pages however
+big the cluster is. The next page is fetched on a background thread while the
+current one is written.
+
+Usage:
+    python InventoryExport.py phones --region US --output phones.csv
+    python InventoryExport.py users --region Europe --output users.jsonl --match 'a%'
+    python InventoryExport.py phones --region US --output phones.parquet --columns name model devicePoolName
+
+Parquet needs pyarrow (pip install pyarrow), CSV and JSONL need nothing extra. The
+format is taken from the output file's extension unless --format is given.
+Credentials are read from the local credential manager, see StandardPhoneSetup.py.
+"""
+import argparse
+import csv
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+
+from requests.exceptions import RequestException
+from zeep.exceptions import Error
+
+import AuditLog
+import AXLFastList
+import Clusters
+import Sites
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Pages fetched ahead of the writer. Memory is bounded by about this many pages plus the one being written
+PIPELINE_PAGES = 2
+
+# Object type: (list operation, response item, search field, default columns)
+OBJECT_TYPES = {
+    'phones': ('listPhone', 'phone', 'name',
+               ('name', 'model', 'devicePoolName', 'ownerUserName', 'currentProfileName', 'description')),
+    'users': ('listUser', 'user', 'userid',
+              ('userid', 'firstName', 'lastName', 'mailid', 'department', 'telephoneNumber', 'primaryExtension')),
+}
+
+# Columns whose text is below the tag, see AXLFastList.py for the syntax
+COLUMN_FIELDS = {'primaryExtension': 'primaryExtension/pattern'}
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+
+# Log file, JSON lines written by a background thread (AuditLog.py)
+log = "inventory.log"
+
+
+def _field(column):
+    # primaryExtension comes back as a pattern and partition, every other column as its text
+    return COLUMN_FIELDS.get(column, column)
+
+
+def iter_rows(service, objectType, columns=None, match='%', pageSize=AXLFastList.PAGE_SIZE):
+    # Yield each page as a list of {column: text} rows, parsed straight from the response (AXLFastList.py)
+    operation, item, searchField, defaultColumns = OBJECT_TYPES[objectType]
+    columns = columns or defaultColumns
+    fields = [_field(column) for column in columns]
+    for page in AXLFastList.iter_pages(service, operation, item, fields, {searchField: match}, pageSize):
+        yield [{column: value or '' for column, value in zip(columns, entry)} for entry in page]
+
+
+def prefetch(pages, depth=PIPELINE_PAGES):
+    # Runs the pages generator on a background thread, up to depth pages ahead of the consumer.
+    # An error fetching a page is raised to the consumer
+    pipeline = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def _put(page):
+        # Gives up once the consumer has gone, instead of waiting on a full queue forever
+        while not stop.is_set():
+            try:
+                pipeline.put(page, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fetch():
+        try:
+            for page in pages:
+                if not _put(page):
+                    return
+            _put(done)
+        except Exception as err:
+            _put(err)
+
+    threading.Thread(target=_fetch, daemon=True).start()
+    try:
+        while True:
+            page = pipeline.get()
+            if page is done:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield page
+    finally:
+        # Also when the consumer stops early, the fetcher stops after its current page
+        stop.set()
+
+
+class CsvWriter:
+
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=columns)
+        self.writer.writeheader()
+
+    def write_page(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlWriter:
+
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write_page(self, rows):
+        self.file.write(''.join(json.dumps(row) + '\n' for row in rows))
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    # One row group per page, every column a string
+
+    def __init__(self, path, columns):
+        if pyarrow is None:
+            raise ValueError('Parquet output needs pyarrow, pip install pyarrow or use csv/jsonl')
+        self.columns = columns
+        self.schema = pyarrow.schema([(column, pyarrow.string()) for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write_page(self, rows):
+        if rows:
+            self.writer.write_table(pyarrow.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {'csv': CsvWriter, 'jsonl': JsonlWriter, 'parquet': ParquetWriter}
+
+
+def output_format(path, requested=None):
+    # The format asked for, or the output file's extension
+    if requested:
+        return requested
+    extension = path.rsplit('.', 1)[-1].lower()
+    if extension == 'json':
+        return 'jsonl'
+    if extension not in FORMATS:
+        raise ValueError('Unknown output format for ' + path + ', use --format ' + '/'.join(FORMATS))
+    return extension
+
+
+def export(service, objectType, path, fileFormat, columns=None, match='%', pageSize=AXLFastList.PAGE_SIZE,
+           progress=None):
+    # Returns the number of rows written. progress is called with the running total after each page
+    columns = list(columns or OBJECT_TYPES[objectType][3])
+    writer = WRITERS[fileFormat](path, columns)
+    total = 0
+    try:
+        for rows in prefetch(iter_rows(service, objectType, columns, match, pageSize)):
+            writer.write_page(rows)
+            total += len(rows)
+            if progress is not None:
+                progress(total)
+    finally:
+        writer.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export every phone or user of a cluster to CSV, JSONL or Parquet.')
+    parser.add_argument('objectType', choices=sorted(OBJECT_TYPES))
+    parser.add_argument('--region', required=True, choices=sorted(Sites.REGIONS), help='Regional CUCM to export')
+    parser.add_argument('--output', required=True, help='File to write, e.g. phones.csv')
+    parser.add_argument('--format', choices=FORMATS, help='Output format (default from the --output extension)')
+    parser.add_argument('--columns', nargs='+', help='returnedTags to export (default a standard set per type)')
+    parser.add_argument('--match', default='%', help="Name/userid pattern, %% is the wildcard (default '%%')")
+    parser.add_argument('--page-size', type=int, default=AXLFastList.PAGE_SIZE,
+                        help=f'Objects per request (default {AXLFastList.PAGE_SIZE})')
+    args = parser.parse_args()
+
+    try:
+        fileFormat = output_format(args.output, args.format)
+    except ValueError as err:
+        print(err)
+        sys.exit(1)
+    cucmusername, cucmpassword = Clusters.get_credentials()
+    AuditLog.setup(log, operator=cucmusername, cluster=args.region)
+    logging.info('exporting ' + args.objectType + ' to ' + args.output)
+    start = time.monotonic()
+    try:
+        service = Clusters.connect(args.region, cucmusername, cucmpassword)
+        total = export(service, args.objectType, args.output, fileFormat, args.columns, args.match, args.page_size,
+                       progress=lambda total: print(f'\r{total} {args.objectType}...', end='', flush=True))
+    except (Error, RequestException, ValueError) as err:
+        logging.error('export failed: ' + str(err))
+        print(f'\nZeep error: {OBJECT_TYPES[args.objectType][0]}: { err }')
+        sys.exit(1)
+    elapsed = time.monotonic() - start
+    summary = f'{total} {args.objectType} written to {args.output} in {elapsed:.1f}s'
+    logging.info(summary)
+    print('\n' + summary)
+
+
+if __name__ == '__main__':
+    main()
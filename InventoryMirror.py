@@ -0,0 +1,308 @@
+"""Local SQLite mirror of a cluster's devices, patterns, users and their associations
+
+"Which devices are on extension 10001", "who owns SEP001122334455" and "which phones
+have an Extension Mobility profile logged in" each cost live AXL calls, and on a big
+cluster they are slow and use up the AXL rate. sync() copies the inventory with a few
+paged executeSQLQuery calls (ExtensionAllocator.SQL_PAGE rows a page) into an indexed
+SQLite file in cache/, one per cluster, and the lookups are then answered locally in
+milliseconds.
+
+    mirror = InventoryMirror.InventoryMirror(serverUrl)
+    if not mirror.fresh():
+        mirror.sync(service)
+    print(mirror.line_devices('10001', 'ALL_IPPhones'), mirror.describe())
+
+The mirror is only as current as its last sync. Callers check fresh() (synced less
+than MAX_AGE seconds ago, or their own limit) and ask CUCM when it isn't, see
+BulkPhoneSetup.py --mirror and ExMoBulkLogout.py USE_MIRROR. A sync writes a new file
+and swaps it in, so readers never see half a sync and a failed sync keeps the old one.
+
+Usage:
+    python InventoryMirror.py sync --region US
+    python InventoryMirror.py extension 10001 --region US
+    python InventoryMirror.py owner SEP001122334455 --region US
+    python InventoryMirror.py user jsmith --region US
+    python InventoryMirror.py logged-in --region US
+
+Credentials are read from the local credential manager, see StandardPhoneSetup.py.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from urllib.parse import urlparse
+
+from requests.exceptions import RequestException
+from zeep.exceptions import Error
+
+import AuditLog
+import Clusters
+import ExtensionAllocator
+import Preflight
+import Sites
+
+CACHE_DIR = 'cache'
+
+# Seconds a sync is trusted for lookups, callers with a stricter need pass their own
+MAX_AGE = 3600
+
+# Log file, JSON lines written by a background thread (AuditLog.py)
+log = "mirror.log"
+
+# device.tkclass of a phone and numplan.tkpatternusage of a directory number. Every device and pattern
+# is mirrored, as any of them clashes with a new device name or line, the phone/line lookups filter on these
+PHONE_CLASS = 1
+DN_USAGE = 2
+
+# Table: (query after "select skip n first m", columns in the order they are selected). Every query
+# is ordered so the pages don't overlap. tkuserassociation 1 is a user's controlled device
+SYNC_QUERIES = {
+    'devices': ('d.name, d.tkclass, d.description, eu.userid, p.name profile from device d '
+                'left outer join enduser eu on d.fkenduser = eu.pkid '
+                'left outer join extensionmobilitydynamic emd on emd.fkdevice = d.pkid '
+                'left outer join device p on emd.fkdevice_currentloginprofile = p.pkid '
+                'order by d.name',
+                ('name', 'tkclass', 'description', 'userid', 'profile')),
+    'patterns': ('n.dnorpattern, rp.name routepartition, n.tkpatternusage from numplan n '
+                 'left outer join routepartition rp on n.fkroutepartition = rp.pkid '
+                 'order by n.dnorpattern, rp.name',
+                 ('dnorpattern', 'routepartition', 'tkpatternusage')),
+    'device_lines': ('d.name, n.dnorpattern, rp.name routepartition, dmap.numplanindex from devicenumplanmap dmap '
+                     'inner join device d on dmap.fkdevice = d.pkid inner join numplan n on dmap.fknumplan = n.pkid '
+                     'left outer join routepartition rp on n.fkroutepartition = rp.pkid '
+                     'order by d.name, dmap.numplanindex',
+                     ('name', 'dnorpattern', 'routepartition', 'numplanindex')),
+    'users': ('eu.userid, eu.firstname, eu.lastname from enduser eu order by eu.userid',
+              ('userid', 'firstname', 'lastname')),
+    'user_devices': ('eu.userid, d.name from enduserdevicemap eudm inner join enduser eu on eudm.fkenduser = eu.pkid '
+                     'inner join device d on eudm.fkdevice = d.pkid where eudm.tkuserassociation = 1 '
+                     'order by eu.userid, d.name',
+                     ('userid', 'name')),
+}
+
+# Partitions are '' for patterns in no partition, so they can be part of a key
+SCHEMA = '''
+create table devices (name text primary key collate nocase, class integer, description text, owner text,
+                      loginProfile text);
+create index devices_owner on devices (owner);
+create index devices_login on devices (loginProfile) where loginProfile is not null;
+create table patterns (pattern text, routePartitionName text, usage integer, primary key (pattern, routePartitionName));
+create table device_lines (device text collate nocase, pattern text, routePartitionName text, lineIndex integer);
+create index device_lines_line on device_lines (pattern, routePartitionName);
+create index device_lines_device on device_lines (device);
+create table users (userid text primary key, firstName text, lastName text);
+create table user_devices (userid text, device text collate nocase);
+create index user_devices_user on user_devices (userid);
+create index user_devices_device on user_devices (device);
+create table sync (syncedAt real, seconds real, devices integer, patterns integer, users integer);
+'''
+
+
+def mirror_path(serverUrl, cacheDir=CACHE_DIR):
+    return os.path.join(cacheDir, 'inventory-' + urlparse(serverUrl).hostname + '.sqlite')
+
+
+def iter_rows(service, table, pageSize=ExtensionAllocator.SQL_PAGE):
+    # The table's rows from CUCM as tuples, page by page. NULL columns are None
+    query, columns = SYNC_QUERIES[table]
+    skip = 0
+    while True:
+        rows = Preflight.query(service, f'select skip {skip} first {pageSize} {query}')
+        for row in rows:
+            yield tuple(row.get(column) for column in columns)
+        if len(rows) < pageSize:
+            break
+        skip += pageSize
+
+
+class InventoryMirror:
+
+    def __init__(self, serverUrl, path=None):
+        self.path = path or mirror_path(serverUrl)
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path))
+
+    def _select(self, sql, parameters=()):
+        if not os.path.exists(self.path):
+            return []
+        with self._connect() as connection:
+            return connection.execute(sql, parameters).fetchall()
+
+    def sync(self, service, pageSize=ExtensionAllocator.SQL_PAGE, progress=None):
+        # Copies the cluster's inventory into a new file and swaps it in. progress is called with each table's name
+        start = time.monotonic()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        newPath = self.path + '.tmp'
+        if os.path.exists(newPath):
+            os.remove(newPath)
+        try:
+            with closing(sqlite3.connect(newPath)) as connection:
+                connection.executescript(SCHEMA)
+                with connection:
+                    counts = self._copy(connection, service, pageSize, progress)
+                    connection.execute('insert into sync values (?, ?, ?, ?, ?)',
+                                       (time.time(), time.monotonic() - start, counts['devices'], counts['patterns'],
+                                        counts['users']))
+            os.replace(newPath, self.path)
+        finally:
+            if os.path.exists(newPath):
+                os.remove(newPath)
+        AuditLog.event(f"mirrored {counts['devices']} devices, {counts['patterns']} patterns and "
+                       f"{counts['users']} users",
+                       operation='executeSQLQuery', duration=time.monotonic() - start)
+        return counts
+
+    def _copy(self, connection, service, pageSize, progress):
+        counts = {}
+        for table in SYNC_QUERIES:
+            if progress is not None:
+                progress(table)
+            rows = iter_rows(service, table, pageSize)
+            if table == 'devices':
+                rows = ((name, int(tkclass) if tkclass else None, description, owner, profile)
+                        for name, tkclass, description, owner, profile in rows)
+                sql = 'insert or replace into devices values (?, ?, ?, ?, ?)'
+            elif table == 'patterns':
+                rows = ((pattern, partition or '', int(usage) if usage else None) for pattern, partition, usage in rows)
+                sql = 'insert or replace into patterns values (?, ?, ?)'
+            elif table == 'device_lines':
+                rows = ((name, pattern, partition or '', int(index) if index else None)
+                        for name, pattern, partition, index in rows)
+                sql = 'insert into device_lines values (?, ?, ?, ?)'
+            elif table == 'users':
+                sql = 'insert or replace into users values (?, ?, ?)'
+            else:
+                sql = 'insert into user_devices values (?, ?)'
+            connection.executemany(sql, rows)
+            counts[table] = connection.execute(f'select count(*) from {table}').fetchone()[0]
+        return counts
+
+    def synced_at(self):
+        # time.time() of the last sync, None if there is no mirror yet
+        rows = self._select('select max(syncedAt) from sync')
+        return rows[0][0] if rows else None
+
+    def age(self):
+        # Seconds since the last sync, None if there is no mirror yet
+        syncedAt = self.synced_at()
+        return time.time() - syncedAt if syncedAt is not None else None
+
+    def fresh(self, maxAge=MAX_AGE):
+        age = self.age()
+        return age is not None and age < maxAge
+
+    def describe(self):
+        # e.g. 'synced 2026-10-18 14:02 (12 minutes ago)', for printing next to what the mirror answered
+        syncedAt = self.synced_at()
+        if syncedAt is None:
+            return 'not synced yet'
+        return (time.strftime('synced %Y-%m-%d %H:%M', time.localtime(syncedAt))
+                + f' ({int(time.time() - syncedAt) // 60} minutes ago)')
+
+    def line_devices(self, pattern, routePartitionName=''):
+        # Devices on the line by name, None if the line isn't in the mirror
+        if not self._select('select 1 from patterns where pattern = ? and routePartitionName = ? and usage = ?',
+                            (pattern, routePartitionName or '', DN_USAGE)):
+            return None
+        return [device for device, in self._select('select device from device_lines where pattern = ? '
+                                                    'and routePartitionName = ? order by device',
+                                                    (pattern, routePartitionName or ''))]
+
+    def device_lines(self, name):
+        # [(pattern, routePartitionName)] of the device, in line order
+        return self._select('select pattern, routePartitionName from device_lines where device = ? order by lineIndex',
+                            (name,))
+
+    def device_owner(self, name):
+        # The owner userid, None if the device has none or isn't in the mirror
+        rows = self._select('select owner from devices where name = ?', (name,))
+        return rows[0][0] if rows else None
+
+    def user_devices(self, userid):
+        return [device for device, in self._select('select device from user_devices where userid = ? order by device',
+                                                    (userid,))]
+
+    def logged_in_phones(self):
+        # Phones that had an Extension Mobility profile logged in at the sync
+        return [name for name, in self._select('select name from devices where loginProfile is not null and class = ? '
+                                               'order by name', (PHONE_CLASS,))]
+
+    def existing_devices(self, names, chunkSize=Preflight.SQL_CHUNK):
+        # Same as Preflight.existing_devices: {NAME: owner userid or None} for the names that are devices of any class
+        devices = {}
+        for chunk in Preflight.chunks({name.upper() for name in names}, chunkSize):
+            rows = self._select('select name, owner from devices where name in (' + ', '.join('?' * len(chunk)) + ')',
+                                chunk)
+            devices.update((name.upper(), owner) for name, owner in rows)
+        return devices
+
+    def existing_lines(self, partition, extensions, chunkSize=Preflight.SQL_CHUNK):
+        # Same as Preflight.existing_lines: {extension: [device names on it]} for the extensions that are a pattern
+        # of the partition, directory number or not
+        lines = {}
+        for chunk in Preflight.chunks(set(extensions), chunkSize):
+            placeholders = ', '.join('?' * len(chunk))
+            for pattern, in self._select('select pattern from patterns where routePartitionName = ? and pattern in ('
+                                         + placeholders + ')', [partition] + chunk):
+                lines[pattern] = []
+            for pattern, device in self._select('select pattern, device from device_lines where routePartitionName = ? '
+                                                'and pattern in (' + placeholders + ')', [partition] + chunk):
+                lines.setdefault(pattern, []).append(device)
+        return lines
+
+
+def _print_lookup(mirror, values):
+    if not values:
+        print('(none)')
+    for value in values:
+        print(value)
+    print(f'From {mirror.path}, {mirror.describe()}' + ('' if mirror.fresh() else ', stale: run sync'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mirror a cluster's devices, patterns and users to SQLite and "
+                                                 "query it.")
+    parser.add_argument('command', choices=('sync', 'extension', 'owner', 'user', 'logged-in'))
+    parser.add_argument('value', nargs='?', help='Extension, device name or userid to look up')
+    parser.add_argument('--region', required=True, choices=sorted(Sites.REGIONS), help='Regional CUCM to mirror')
+    parser.add_argument('--partition', help="Extension's route partition (default the region's)")
+    parser.add_argument('--page-size', type=int, default=ExtensionAllocator.SQL_PAGE,
+                        help=f'Rows per SQL query (default {ExtensionAllocator.SQL_PAGE})')
+    args = parser.parse_args()
+    if args.command not in ('sync', 'logged-in') and not args.value:
+        parser.error(args.command + ' needs a value to look up')
+    mirror = InventoryMirror(Sites.REGIONS[args.region]['serverUrl'])
+
+    if args.command == 'extension':
+        partition = args.partition if args.partition is not None else Sites.REGIONS[args.region]['routePartitionName']
+        devices = mirror.line_devices(args.value, partition)
+        _print_lookup(mirror, devices if devices is not None else [args.value + ' not found in ' + partition])
+    elif args.command == 'owner':
+        owner = mirror.device_owner(args.value)
+        _print_lookup(mirror, [owner] if owner else [])
+    elif args.command == 'user':
+        _print_lookup(mirror, mirror.user_devices(args.value))
+    elif args.command == 'logged-in':
+        _print_lookup(mirror, mirror.logged_in_phones())
+    else:
+        cucmusername, cucmpassword = Clusters.get_credentials()
+        AuditLog.setup(log, operator=cucmusername, cluster=args.region)
+        start = time.monotonic()
+        try:
+            service = Clusters.connect(args.region, cucmusername, cucmpassword)
+            counts = mirror.sync(service, args.page_size, progress=lambda table: print(f'Copying {table}...'))
+        except (Error, RequestException) as err:
+            logging.error('sync failed: ' + str(err))
+            print(f'Zeep error: executeSQLQuery: { err }')
+            sys.exit(1)
+        summary = ', '.join(f'{count} {table}' for table, count in counts.items())
+        logging.info('synced ' + summary)
+        print(f'{summary} mirrored to {mirror.path} in {time.monotonic() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""Phone build steps shared by StandardPhoneSetup.py and BulkPhoneSetup.py
+
+Everything a build needs (user, extension, site settings, device names) is kept
+in a plain dict instead of module globals, so the same steps can be run for one
+user from the menus or for many users at once from a manifest.
+"""
+import re
+import time
+
+from zeep.exceptions import Fault
+
+# Build types as used in manifests, matching the phone build menu
+BUILD_TYPES = ('desk', 'jabber', 'both')
+
+MAC_PATTERN = "[0-9a-f]{2}([-:]?)[0-9a-f]{2}(\\1[0-9a-f]{2}){4}$"
+
+# LDAP sync status polling starts at LDAP_POLL_START seconds and backs off to LDAP_POLL_MAX,
+# giving up after LDAP_SYNC_TIMEOUT seconds
+LDAP_POLL_START = 1.0
+LDAP_POLL_MAX = 10.0
+LDAP_SYNC_TIMEOUT = 300
+LDAP_SYNC_DONE = 'Sync is performed successfully'
+
+# getUser fields a build needs: the names, and the devices to keep when associating the new ones
+USER_TAGS = {'firstName': '', 'lastName': '', 'associatedDevices': ''}
+
+# Site settings every build needs, see Sites.py
+SITE_KEYS = ('devicePoolName', 'locationName', 'callingSearchSpaceName', 'callForwardAll', 'commonDeviceConfigName',
+             'softkeyTemplateName', 'userLocale', 'routePartitionName', 'externalMask')
+
+# Manifest extension for "the next free one in the site's extensionRange", see ExtensionAllocator.py
+AUTO_EXTENSION = 'auto'
+
+
+def normalize_mac(phoneMac):
+    # Strip - and : and upper case the MAC, None if it isn't a valid MAC
+    if phoneMac and re.match(MAC_PATTERN, phoneMac.lower()):
+        return re.sub(r'[:-]', '', phoneMac).upper()
+    return None
+
+
+def new_build(phoneUsername, phoneExt, buildType, site, userEnteredPhoneModel='', phoneMac=None):
+    # Raises ValueError for anything that would only be caught by CUCM later
+    if buildType not in BUILD_TYPES:
+        raise ValueError('Unknown build type ' + str(buildType))
+    if not phoneUsername or not phoneExt:
+        raise ValueError('Username and extension are required')
+    build = {key: site.get(key) for key in SITE_KEYS}
+    build.update({
+        'phoneUsername': phoneUsername,
+        'phoneExt': phoneExt,
+        # True when the build adds its line (addLine) instead of using an existing one
+        'newLine': False,
+        'buildType': buildType,
+        'userEnteredPhoneModel': userEnteredPhoneModel,
+        'phoneModel': 'Cisco ' + userEnteredPhoneModel,
+        'jabberDeviceName': 'csf' + phoneUsername,
+        'deskPhoneDeviceName': None,
+    })
+    if buildType != 'jabber':
+        if not userEnteredPhoneModel:
+            raise ValueError('A desk phone model is required for a ' + buildType + ' build')
+        mac = normalize_mac(phoneMac)
+        if mac is None:
+            raise ValueError('Invalid MAC address ' + str(phoneMac))
+        build['deskPhoneDeviceName'] = 'SEP' + mac
+    if phoneExt.lower() == AUTO_EXTENSION:
+        # Stands in for the extension until a free one is allocated
+        if not site.get('extensionRange'):
+            raise ValueError('No extensionRange in the site catalog to allocate an extension from')
+        build.update({'phoneExt': AUTO_EXTENSION, 'newLine': True, 'extensionRange': site['extensionRange']})
+    return build
+
+
+def set_user_names(build, phoneFname, phoneLname):
+    # Description and display name are built from the LDAP synced user
+    build['phoneFname'] = phoneFname
+    build['phoneLname'] = phoneLname
+    build['phoneDescription'] = phoneFname + ' ' + phoneLname + ' - ' + build['phoneExt']
+    build['phoneDisplay'] = phoneLname + ', ' + phoneFname[0]
+
+
+def set_user(build, userDetails):
+    # Names plus the devices the user already has (find_user with USER_TAGS), so the build doesn't read the user again
+    set_user_names(build, *user_names(userDetails))
+    build['currentAssociatedDevices'] = userDetails.associatedDevices
+
+
+def build_devices(build):
+    # Device names in the order they are created
+    devices = []
+    if build['buildType'] != 'jabber':
+        devices.append(build['deskPhoneDeviceName'])
+    if build['buildType'] != 'desk':
+        devices.append(build['jabberDeviceName'])
+    return devices
+
+
+def _line(build):
+    return {
+        'line': [
+            {
+                'index': 1,
+                'label': build['phoneDescription'],  # Line text label
+                'dirn': {
+                    'pattern': build['phoneExt'],
+                    'routePartitionName': build['routePartitionName'],
+                },
+                'display': build['phoneDisplay'],
+                'displayAscii': build['phoneDisplay'],
+                'e164Mask': build['externalMask'],  # Used in specific locations
+                'associatedEndusers': {
+                    'enduser': [
+                        {
+                            'userId': build['phoneUsername']
+                        }
+                    ]
+                }
+            }
+        ]
+    }
+
+
+def jabber_payload(build):
+    # Create the data for adding Jabber, associating the Line
+    return {
+        'name': build['jabberDeviceName'],
+        'description': build['phoneDescription'],
+        'product': 'Cisco Unified Client Services Framework',
+        'model': 'Cisco Unified Client Services Framework',
+        'class': 'Phone',
+        'protocol': 'SIP',
+        'protocolSide': 'User',
+        'devicePoolName': build['devicePoolName'],
+        'commonDeviceConfigName': build['commonDeviceConfigName'],
+        'phoneTemplateName': 'Standard Client Services Framework',
+        'commonPhoneConfigName': 'Standard Common Phone Profile',
+        'locationName': build['locationName'],
+        'useTrustedRelayPoint': 'Default',
+        'builtInBridgeStatus': 'Default',
+        'deviceMobilityMode': 'Default',
+        'callingSearchSpaceName': build['callingSearchSpaceName'],
+        'retryVideoCallAsAudio': 'true',
+        'allowCtiControlFlag': 'true',
+        'hlogStatus': 'On',
+        'packetCaptureMode': 'None',
+        'certificateOperation': 'No Pending Operation',
+        'enableExtensionMobility': 'true',
+        # Add line
+        'lines': _line(build),
+        'securityProfileName': 'Cisco Unified Client Services Framework - Standard SIP Non-Secure Profile'
+    }
+
+
+def desk_phone_payload(build):
+    phoneModel = build['phoneModel']
+    userEnteredPhoneModel = build['userEnteredPhoneModel']
+    # may need to add more models to diferentiate SIP/SCCP
+    if phoneModel.startswith('Cisco 78') or phoneModel.startswith('Cisco 88'):
+        protocol = 'SIP'
+        securityProfileName = phoneModel + ' - Standard SIP Non-Secure Profile'
+    else:
+        protocol = 'SCCP'
+        securityProfileName = None
+    if userEnteredPhoneModel == '7942' or userEnteredPhoneModel == '7962':
+        phoneTemplateName = 'Standard ' + userEnteredPhoneModel + 'G ' + protocol
+    else:
+        phoneTemplateName = 'Standard ' + userEnteredPhoneModel + ' ' + protocol
+    return {
+        'name': build['deskPhoneDeviceName'],
+        'description': build['phoneDescription'],
+        'product': phoneModel,
+        'model': phoneModel,
+        'class': 'Phone',
+        'protocol': protocol,
+        'protocolSide': 'User',
+        'devicePoolName': build['devicePoolName'],
+        'commonDeviceConfigName': build['commonDeviceConfigName'],
+        'phoneTemplateName': phoneTemplateName,
+        'softkeyTemplateName': build['softkeyTemplateName'],
+        'commonPhoneConfigName': 'Standard Common Phone Profile',
+        'locationName': build['locationName'],
+        'useTrustedRelayPoint': 'Default',
+        'builtInBridgeStatus': 'Default',
+        'deviceMobilityMode': 'Default',
+        'callingSearchSpaceName': build['callingSearchSpaceName'],
+        'retryVideoCallAsAudio': 'true',
+        'allowCtiControlFlag': 'true',
+        'hlogStatus': 'On',
+        'packetCaptureMode': 'None',
+        'certificateOperation': 'No Pending Operation',
+        'enableExtensionMobility': 'true',
+        'securityProfileName': securityProfileName,
+        # Add line
+        'lines': _line(build)
+    }
+
+
+def line_add(build):
+    # Keyword arguments for addLine, an empty line the build's updateLine then fills in
+    return {
+        'line': {
+            'pattern': build['phoneExt'],
+            'routePartitionName': build['routePartitionName'],
+            'usage': 'Device'
+        }
+    }
+
+
+def line_update(build):
+    # Keyword arguments for updateLine
+    return {
+        'pattern': build['phoneExt'],
+        'routePartitionName': build['routePartitionName'],
+        'alertingName': build['phoneDisplay'],
+        'asciiAlertingName': build['phoneDisplay'],
+        'description': build['phoneDescription'],
+        'callForwardAll': build['callForwardAll']
+    }
+
+
+def updated_associated_devices(build, currentAssociatedDeviceList):
+    # Append the new devices to the existing ones or it will wipe out existing associations
+    newDevices = build_devices(build)
+    if currentAssociatedDeviceList is None:
+        if len(newDevices) == 1:
+            return {'device': newDevices[0]}
+        # Jabber first to match the order the menus have always sent
+        return {'device': list(reversed(newDevices))}
+    unpackedAssociatedDevices = list(currentAssociatedDeviceList.device)
+    # A resumed build (BuildJournal.py) can find its devices already there
+    unpackedAssociatedDevices.extend(device for device in newDevices if device not in unpackedAssociatedDevices)
+    return {'device': unpackedAssociatedDevices}
+
+
+def user_update_first_pass(build, updatedAssociatedDevices):
+    # Keyword arguments for the first updateUser
+    userUpdate = {
+        'userid': build['phoneUsername'],
+        'userLocale': build['userLocale'],
+        'homeCluster': True,
+        'associatedDevices': updatedAssociatedDevices,
+        'enableCti': True,
+        'associatedGroups': {
+            'userGroup': [
+                {'name': 'Standard CCM End Users'},
+                {'name': 'Standard CTI Enabled'}
+            ]
+        }
+    }
+    if build['buildType'] != 'desk':
+        userUpdate['imAndPresenceEnable'] = True
+    return userUpdate
+
+
+def user_update_second_pass(build):
+    # Need to update after phone/Jabber is associated
+    return {
+        'userid': build['phoneUsername'],
+        'primaryExtension': {
+            'pattern': build['phoneExt'],
+            'routePartitionName': build['routePartitionName']
+        }
+    }
+
+
+def ldap_sync(service, spinner=None, timeout=LDAP_SYNC_TIMEOUT):
+    # Force LDAP Sync to pull names, then poll the status with backoff.
+    # Raises TimeoutError if the sync hasn't finished after timeout seconds
+    service.doLdapSync(name='LDAP', sync='true')
+    deadline = time.monotonic() + timeout
+    delay = LDAP_POLL_START
+    ldapSyncStatus = ''
+    while True:
+        # Wait before the first status check or it gets caught before complete
+        time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        try:
+            resp = service.getLdapSyncStatus(name='LDAP')
+            ldapSyncStatus = resp['return']
+        except Fault as err:
+            ldapSyncStatus = str(err)
+        if ldapSyncStatus == LDAP_SYNC_DONE:
+            return
+        if spinner is not None:
+            spinner.next()
+        if time.monotonic() >= deadline:
+            raise TimeoutError('LDAP sync did not finish in ' + str(timeout) + 's, last status: ' + str(ldapSyncStatus))
+        delay = min(delay * 2, LDAP_POLL_MAX)
+
+
+def get_line_devices(service, build):
+    # Raises Fault if the extension doesn't exist
+    lineResp = service.getLine(pattern=build['phoneExt'], routePartitionName=build['routePartitionName'])
+    return lineResp['return'].line.associatedDevices
+
+
+def find_user(service, phoneUsername, returnedTags=USER_TAGS):
+    # The getUser user, or None if the user isn't in CUCM (yet)
+    try:
+        getUserResponse = service.getUser(userid=phoneUsername, returnedTags=returnedTags)
+    except Fault as err:
+        if 'not found' in str(err):
+            return None
+        raise
+    return getUserResponse['return'].user
+
+
+def user_names(userDetails):
+    # (firstName, lastName), or None if the user hasn't come over from LDAP with a name yet
+    if userDetails is None or not userDetails.firstName or not userDetails.lastName:
+        return None
+    return userDetails.firstName, userDetails.lastName
+
+
+def find_user_names(service, phoneUsername):
+    return user_names(find_user(service, phoneUsername, {'firstName': '', 'lastName': ''}))
@@ -0,0 +1,141 @@
+"""Batched pre-flight checks of a whole manifest, before any write
+
+A build needs its extension to exist in the site's partition, and its SEP<MAC> and
+csf<user> devices not to exist yet. Checking that with getLine/getPhone costs a call
+or two per row, and a duplicate device is otherwise only found when addPhone fails
+with a UNIQUE INDEX error halfway through the build. check() collects every
+extension and device name of the batch and asks CUCM with a few executeSQLQuery
+calls, SQL_CHUNK names per IN-list, then reports per build:
+
+    conflicts, warnings = Preflight.check(service, {row: build for row, build in ...})
+    for row, problems in conflicts.items():
+        print(row, '; '.join(problems))
+
+Conflicts would fail the build:
+- the extension isn't in the partition, or it is and the build was going to add it
+  (an allocated extension taken since, see ExtensionAllocator.py)
+- a device the build adds already exists, or two builds of the batch have the same device
+- two builds of the batch use the same extension
+Warnings don't stop the build: the extension is already on other devices, which are
+kept like StandardPhoneSetup.py's "keep the existing devices" option.
+
+Pass newDevices and newLines when some devices or lines aren't added, e.g. a resumed
+build whose addPhone is journaled. Device names are compared case insensitively, like
+CUCM does. Pass a fresh InventoryMirror.py mirror to look them up there instead of in
+CUCM.
+"""
+from collections import defaultdict
+
+import PhoneBuild
+
+# Names per IN-list. Keeps each query well under the AXL SQL statement size limit
+SQL_CHUNK = 500
+
+DEVICE_SQL = ('select d.name, eu.userid from device d left outer join enduser eu on d.fkenduser = eu.pkid '
+              'where upper(d.name) in ({names})')
+
+LINE_SQL = ('select n.dnorpattern, d.name from numplan n '
+            'inner join routepartition rp on n.fkroutepartition = rp.pkid '
+            'left outer join devicenumplanmap dmap on dmap.fknumplan = n.pkid '
+            'left outer join device d on dmap.fkdevice = d.pkid '
+            "where rp.name = {partition} and n.dnorpattern in ({extensions})")
+
+
+def chunks(values, size=SQL_CHUNK):
+    values = sorted(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def sql_string(value):
+    # A quoted SQL string literal
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def sql_list(values):
+    return ', '.join(sql_string(value) for value in values)
+
+
+def query(service, sql):
+    # [{column: text}], a column missing from a row is NULL
+    executeSQLQueryResponse = service.executeSQLQuery(sql=sql)
+    sqlDict = executeSQLQueryResponse['return']
+    if sqlDict is None:
+        return []
+    return [{column.tag: column.text for column in row} for row in sqlDict.row]
+
+
+def existing_devices(service, names, chunkSize=SQL_CHUNK):
+    # {NAME: owner userid or None} for the names that are already devices in CUCM
+    devices = {}
+    for chunk in chunks({name.upper() for name in names}, chunkSize):
+        for row in query(service, DEVICE_SQL.format(names=sql_list(chunk))):
+            devices[row['name'].upper()] = row.get('userid')
+    return devices
+
+
+def existing_lines(service, partition, extensions, chunkSize=SQL_CHUNK):
+    # {extension: [device names on it]} for the extensions that exist in the partition
+    lines = {}
+    for chunk in chunks(set(extensions), chunkSize):
+        sql = LINE_SQL.format(partition=sql_string(partition), extensions=sql_list(chunk))
+        for row in query(service, sql):
+            devices = lines.setdefault(row['dnorpattern'], [])
+            if row.get('name'):
+                devices.append(row['name'])
+    return lines
+
+
+def check(service, builds, newDevices=None, newLines=None, chunkSize=SQL_CHUNK, mirror=None):
+    # builds: {manifest row number: build}. newDevices: {key: [device names the build adds]}, by
+    # default every device of the build. newLines: keys of the builds that add their line, by default those
+    # with newLine. Returns ({key: [conflicts]}, {key: [warnings]}) for the keys with any
+    conflicts = defaultdict(list)
+    warnings = defaultdict(list)
+    deviceBuilds = defaultdict(list)
+    extensionBuilds = defaultdict(list)
+    for key, build in builds.items():
+        for deviceName in PhoneBuild.build_devices(build):
+            deviceBuilds[deviceName.upper()].append(key)
+        extensionBuilds[(build['routePartitionName'], build['phoneExt'])].append(key)
+    if newDevices is None:
+        newDevices = {key: PhoneBuild.build_devices(build) for key, build in builds.items()}
+    if newLines is None:
+        newLines = {key for key, build in builds.items() if build['newLine']}
+
+    for deviceName, keys in deviceBuilds.items():
+        for key in keys[1:]:
+            conflicts[key].append(deviceName + ' is also built by row ' + str(keys[0]))
+    names = {deviceName for deviceNames in newDevices.values() for deviceName in deviceNames}
+    devices = (mirror.existing_devices(names, chunkSize) if mirror is not None
+               else existing_devices(service, names, chunkSize))
+    for key, names in newDevices.items():
+        for deviceName in names:
+            if deviceName.upper() in devices:
+                owner = devices[deviceName.upper()]
+                conflicts[key].append(deviceName + ' already exists' + (', owned by ' + owner if owner else ''))
+
+    partitions = defaultdict(set)
+    for partition, extension in extensionBuilds:
+        partitions[partition].add(extension)
+    for partition, extensions in partitions.items():
+        lines = (mirror.existing_lines(partition, extensions, chunkSize) if mirror is not None
+                 else existing_lines(service, partition, extensions, chunkSize))
+        for extension in sorted(extensions):
+            keys = extensionBuilds[(partition, extension)]
+            for key in keys[1:]:
+                conflicts[key].append('extension ' + extension + ' is also used by row ' + str(keys[0]))
+            if extension not in lines:
+                for key in keys:
+                    if key not in newLines:
+                        conflicts[key].append('extension ' + extension + ' not found in ' + partition)
+                continue
+            for key in keys:
+                if key in newLines:
+                    conflicts[key].append('extension ' + extension + ' already exists in ' + partition)
+                    continue
+                own = {deviceName.upper() for deviceName in PhoneBuild.build_devices(builds[key])}
+                others = [deviceName for deviceName in lines[extension] if deviceName.upper() not in own]
+                if others:
+                    warnings[key].append('extension ' + extension + ' is already on ' + ', '.join(sorted(others)))
+    return dict(conflicts), dict(warnings)
@@ -0,0 +1,235 @@
+"""Reconcile mode: only send what differs from the build
+
+The normal plan (BuildPlan.py) sends every field of every object, even when the
+phone, line or user already matches. reconcile_plan() instead compares each object
+the plan writes with what CUCM has now, and rewrites the plan to send only the fields
+that differ. Objects that already match are left out altogether, so re-applying the
+site standards to devices that are already set up is mostly reads.
+
+    current = Reconcile.fetch_current(service, build, steps)
+    steps, inSync = Reconcile.reconcile_plan(build, steps, current)
+    BuildPlan.run_plan(service, build, steps)
+
+The reads ask for the compared fields only (returned_tags), one get per object.
+Phones that don't exist yet are still added in full.
+"""
+import logging
+
+from zeep.exceptions import Fault
+
+import BuildPlan
+import PhoneBuild
+
+# Fields that name the object or can't be changed once it exists, never compared
+IDENTITY_FIELDS = {
+    'phone': ('name', 'product', 'model', 'class', 'protocol', 'protocolSide'),
+    'line': ('pattern', 'routePartitionName'),
+    'user': ('userid',),
+}
+
+# Requests rather than settings, CUCM doesn't return what was asked for
+ACTION_FIELDS = ('certificateOperation',)
+
+# Lists of members that are added to rather than replaced: field: (item tag, name tag or None)
+MEMBER_FIELDS = {
+    'associatedDevices': ('device', None),
+    'associatedGroups': ('userGroup', 'name'),
+}
+
+# AXL booleans come back as 't'/'f' or 'true'/'false'
+_BOOLEANS = {'t': 'true', 'true': 'true', 'f': 'false', 'false': 'false'}
+
+
+def _text(value):
+    # Compare values as text: foreign keys as their name, booleans as true/false
+    if value is None:
+        return ''
+    value = getattr(value, '_value_1', value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    value = '' if value is None else str(value)
+    return _BOOLEANS.get(value.lower(), value)
+
+
+def _child(current, field):
+    if current is None:
+        return None
+    try:
+        return current[field]
+    except (KeyError, IndexError, TypeError):
+        return getattr(current, field, None)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, list) else [value]
+
+
+def _matches(desired, current):
+    if isinstance(desired, dict):
+        return all(_matches(value, _child(current, field)) for field, value in desired.items())
+    if isinstance(desired, list):
+        currentItems = _as_list(current)
+        if desired and all(isinstance(item, dict) and 'index' in item for item in desired):
+            # Phone lines: compare by index, other lines on the phone aren't the build's business
+            byIndex = {_text(_child(item, 'index')): item for item in currentItems}
+            return all(_matches(item, byIndex.get(_text(item['index']))) for item in desired)
+        return len(desired) == len(currentItems) and all(map(_matches, desired, currentItems))
+    return _text(desired) == _text(current)
+
+
+def _members(value, field):
+    item, nameTag = MEMBER_FIELDS[field]
+    return [_text(member if nameTag is None else _child(member, nameTag))
+            for member in _as_list(_child(value, item))]
+
+
+def _compared(desired, kind):
+    return {field: value for field, value in desired.items()
+            if value is not None and field not in IDENTITY_FIELDS[kind] and field not in ACTION_FIELDS}
+
+
+def _tags(value):
+    # Minimal returnedTags for a value: its own shape, with '' for every leaf
+    if isinstance(value, dict):
+        return {field: _tags(child) for field, child in value.items()}
+    if isinstance(value, list):
+        return _tags(value[0]) if value else ''
+    return ''
+
+
+def returned_tags(desired, kind):
+    tags = {}
+    for field, value in _compared(desired, kind).items():
+        if field in MEMBER_FIELDS:
+            item, nameTag = MEMBER_FIELDS[field]
+            tags[field] = {item: '' if nameTag is None else {nameTag: ''}}
+        else:
+            tags[field] = _tags(value)
+    return tags
+
+
+def diff(desired, current, kind):
+    # {field: value to send} for the fields of desired that current doesn't match.
+    # Member lists send the current members plus the missing ones, so nothing is dropped
+    changed = {}
+    for field, value in _compared(desired, kind).items():
+        currentValue = _child(current, field)
+        if field in MEMBER_FIELDS:
+            have = _members(currentValue, field)
+            missing = [name for name in _members(value, field) if name not in have]
+            if missing:
+                item, nameTag = MEMBER_FIELDS[field]
+                changed[field] = {item: [name if nameTag is None else {nameTag: name} for name in have + missing]}
+        elif not _matches(value, currentValue):
+            if field == 'lines' and len(_as_list(_child(currentValue, 'line'))) > len(value['line']):
+                # updatePhone replaces every line, which would drop the phone's other lines
+                logging.warning('Not reconciling the lines of ' + desired['name'] + ', it has lines the build does not')
+                continue
+            changed[field] = value
+    return changed
+
+
+def _desired_phone(build, step):
+    # The addPhone payload with the folded owner, or the fields of an updatePhone
+    args, kwargs = BuildPlan.step_args(build, step)
+    return args[0] if args else kwargs
+
+
+def _desired_users(build):
+    # Both updateUser passes. The first adds the build's devices to whatever the user has
+    return (PhoneBuild.user_update_first_pass(build, {'device': PhoneBuild.build_devices(build)}),
+            PhoneBuild.user_update_second_pass(build))
+
+
+def current_reads(build, steps):
+    # [(object key, operation, kwargs)] reading every object the plan writes, once each
+    reads = {}
+    for step in steps:
+        kind = step['key'][0]
+        objectKey = step['key'][:2] if kind == 'user' else step['key']
+        if step['operation'] == 'getUser' or objectKey in reads:
+            continue
+        if step['operation'] in ('addPhone', 'updatePhone'):
+            desired = _desired_phone(build, step)
+            reads[objectKey] = ('getPhone', {'name': desired['name'], 'returnedTags': returned_tags(desired, 'phone')})
+        elif step['operation'] == 'updateLine':
+            desired = PhoneBuild.line_update(build)
+            reads[objectKey] = ('getLine', {'pattern': desired['pattern'], 'routePartitionName': desired['routePartitionName'],
+                                            'returnedTags': returned_tags(desired, 'line')})
+        elif step['operation'] == 'updateUser':
+            tags = {}
+            for desired in _desired_users(build):
+                tags.update(returned_tags(desired, 'user'))
+            reads[objectKey] = ('getUser', {'userid': build['phoneUsername'], 'returnedTags': tags})
+    return [(objectKey, operation, kwargs) for objectKey, (operation, kwargs) in reads.items()]
+
+
+def current_object(resp):
+    # The phone/line/user in a get response
+    returned = resp['return']
+    for kind in ('phone', 'line', 'user'):
+        if _child(returned, kind) is not None:
+            return returned[kind]
+    return None
+
+
+def fetch_current(service, build, steps):
+    # {object key: current phone/line/user, or None if it doesn't exist}. Other Faults are raised
+    current = {}
+    for objectKey, operation, kwargs in current_reads(build, steps):
+        try:
+            current[objectKey] = current_object(getattr(service, operation)(**kwargs))
+        except Fault as err:
+            if 'not found' not in str(err):
+                raise
+            current[objectKey] = None
+    return current
+
+
+def _update_step(step, operation, identity, changed):
+    label = 'updated ' + identity['name'] if step['operation'] == 'addPhone' else step['label']
+    label += ' (' + ', '.join(changed) + ')'
+    return dict(step, operation=operation, label=label, kwargs=lambda build: dict(identity, **changed), extra=[])
+
+
+def reconcile_plan(build, steps, current):
+    # (steps sending only what differs, labels of the objects already in sync).
+    # The names must already be in the build, user reads are replaced by the current user
+    if 'phoneFname' not in build:
+        raise ValueError('Reconcile needs the names of ' + build['phoneUsername'] + ' first')
+    reconciled = []
+    inSync = []
+    for step in steps:
+        kind = step['key'][0]
+        objectKey = step['key'][:2] if kind == 'user' else step['key']
+        if step['operation'] == 'getUser' and current.get(objectKey) is not None:
+            build['currentAssociatedDevices'] = current[objectKey].associatedDevices
+            continue
+        existing = current.get(objectKey)
+        if existing is None and kind == 'line':
+            raise ValueError('Line ' + build['phoneExt'] + ' in ' + build['routePartitionName'] + ' was not found')
+        if existing is None:
+            # Not there yet (or not read), send it in full
+            reconciled.append(step)
+            continue
+        if kind == 'phone':
+            desired = _desired_phone(build, step)
+            changed = diff(desired, existing, 'phone')
+            replacement = _update_step(step, 'updatePhone', {'name': desired['name']}, changed)
+        elif kind == 'line':
+            desired = PhoneBuild.line_update(build)
+            changed = diff(desired, existing, 'line')
+            replacement = _update_step(step, 'updateLine', {'pattern': desired['pattern'],
+                                                            'routePartitionName': desired['routePartitionName']},
+                                       changed)
+        else:
+            desired = _desired_users(build)[step['key'][2] - 1]
+            changed = diff(desired, existing, 'user')
+            replacement = _update_step(step, 'updateUser', {'userid': build['phoneUsername']}, changed)
+        if changed:
+            reconciled.append(replacement)
+        elif ' '.join(str(part) for part in objectKey) not in inSync:
+            inSync.append(' '.join(str(part) for part in objectKey))
+    return reconciled, inSync
@@ -0,0 +1,129 @@
+"""Cached index of CUCM reference objects used to validate builds before any write
+
+addPhone/updateLine payloads name device pools, CSSs, partitions, templates and
+security profiles that must already exist in CUCM. Rather than finding a typo when
+CUCM rejects the add, the names are loaded with one list* call per object type,
+kept for REFERENCE_TTL seconds (in memory and in cache/), and payloads are checked
+against them locally.
+
+    references = ReferenceCache.ReferenceCache(service, serverUrl)
+    problems = references.validate_build(build)
+"""
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import PhoneBuild
+
+# Seconds the loaded names are trusted before they're listed again
+REFERENCE_TTL = 3600
+
+CACHE_DIR = 'cache'
+
+# Object type: (list operation, response item name)
+REFERENCE_TYPES = {
+    'devicePool': ('listDevicePool', 'devicePool'),
+    'css': ('listCss', 'css'),
+    'routePartition': ('listRoutePartition', 'routePartition'),
+    'phoneTemplate': ('listPhoneButtonTemplate', 'phoneButtonTemplate'),
+    'securityProfile': ('listPhoneSecurityProfile', 'phoneSecurityProfile'),
+    'commonDeviceConfig': ('listCommonDeviceConfig', 'commonDeviceConfig'),
+    'commonPhoneConfig': ('listCommonPhoneConfig', 'commonPhoneConfig'),
+    'location': ('listLocation', 'location'),
+    'softkeyTemplate': ('listSoftKeyTemplate', 'softKeyTemplate'),
+}
+
+# addPhone field: object type it names
+PHONE_REFERENCES = {
+    'devicePoolName': 'devicePool',
+    'callingSearchSpaceName': 'css',
+    'phoneTemplateName': 'phoneTemplate',
+    'securityProfileName': 'securityProfile',
+    'commonDeviceConfigName': 'commonDeviceConfig',
+    'commonPhoneConfigName': 'commonPhoneConfig',
+    'locationName': 'location',
+    'softkeyTemplateName': 'softkeyTemplate',
+}
+
+
+class ReferenceCache:
+
+    def __init__(self, service, serverUrl, ttl=REFERENCE_TTL, path=None):
+        self.service = service
+        self.ttl = ttl
+        self.path = path or os.path.join(CACHE_DIR, 'reference-' + urlparse(serverUrl).hostname + '.json')
+        self.names = {}
+        self.loadedAt = 0.0
+        self.lock = threading.Lock()
+        self._read_file()
+
+    def _read_file(self):
+        # A cache file from an earlier run is used as long as it hasn't expired
+        try:
+            with open(self.path) as cacheFile:
+                cached = json.load(cacheFile)
+        except (OSError, ValueError):
+            return
+        if set(cached.get('names', {})) == set(REFERENCE_TYPES):
+            self.names = {objectType: set(names) for objectType, names in cached['names'].items()}
+            self.loadedAt = cached.get('loadedAt', 0.0)
+
+    def _write_file(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w') as cacheFile:
+            json.dump({'loadedAt': self.loadedAt,
+                       'names': {objectType: sorted(names) for objectType, names in self.names.items()}}, cacheFile)
+        os.replace(self.path + '.tmp', self.path)
+
+    def expired(self):
+        return time.time() - self.loadedAt > self.ttl
+
+    def refresh(self):
+        # One list call per object type, names only
+        names = {}
+        for objectType, (operation, item) in REFERENCE_TYPES.items():
+            resp = getattr(self.service, operation)(searchCriteria={'name': '%'}, returnedTags={'name': ''})
+            listDict = resp['return']
+            names[objectType] = {entry.name for entry in (listDict[item] if listDict is not None else [])}
+        self.names = names
+        self.loadedAt = time.time()
+        self._write_file()
+
+    def get(self, objectType):
+        # Names of one object type, listing them again if the cache has expired
+        with self.lock:
+            if self.expired():
+                self.refresh()
+            return self.names[objectType]
+
+    def validate_phone(self, phone):
+        # List of problems with an addPhone payload, empty if every referenced object exists
+        problems = []
+        for field, objectType in PHONE_REFERENCES.items():
+            value = phone.get(field)
+            if value is not None and value not in self.get(objectType):
+                problems.append(f"{field} '{value}' does not exist")
+        for line in phone['lines']['line']:
+            partition = line['dirn']['routePartitionName']
+            if partition is not None and partition not in self.get('routePartition'):
+                problems.append(f"routePartitionName '{partition}' does not exist")
+        return problems
+
+    def validate_build(self, build):
+        # Checks every payload the build will send, without touching CUCM (unless the cache expired)
+        if 'phoneDescription' not in build:
+            # Names only go into descriptions, so a build can be checked before the user is looked up
+            build = dict(build)
+            PhoneBuild.set_user_names(build, '-', '-')
+        problems = []
+        if build['buildType'] != 'jabber':
+            problems.extend(self.validate_phone(PhoneBuild.desk_phone_payload(build)))
+        if build['buildType'] != 'desk':
+            problems.extend(self.validate_phone(PhoneBuild.jabber_payload(build)))
+        forwardCss = (build['callForwardAll'] or {}).get('callingSearchSpaceName')
+        if forwardCss is not None and forwardCss not in self.get('css'):
+            problems.append(f"callForwardAll callingSearchSpaceName '{forwardCss}' does not exist")
+        # Both payloads name the same line, only report it once
+        return list(dict.fromkeys(problems))
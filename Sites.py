@@ -0,0 +1,105 @@
+"""Cluster and site settings, loaded once from the site catalog (sites.json)
+
+The catalog has one entry per region, and each region one entry per site, keyed by
+its location code. Data was scrubbed, so search for "insert" and "LOCATION" to
+customize for your needs. A site's settings override its region's, and name/notice
+are what StandardPhoneSetup.py's location menu shows. Each region is one CUCM
+cluster; axlRate is the AXL calls per second it starts at and never climbs past (see
+AXLScheduler.py and Clusters.py).
+
+    site = Sites.get_site('US', 'LOCATION1')    # region defaults overlaid with the site
+
+Every site is resolved when the catalog is loaded and kept in an index by (region,
+location code), so a lookup is a single dict get however many sites there are. The
+resolved catalog is also written to cache/ in a compiled (pickle) form, keyed by the
+hash of the catalog file, and later starts load that instead. Set SITE_CATALOG to use
+another catalog file. Run python Sites.py after editing the catalog to check it.
+"""
+import hashlib
+import json
+import os
+import pickle
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+CATALOG_FILE = os.environ.get('SITE_CATALOG', os.path.join(_here, 'sites.json'))
+CACHE_DIR = os.path.join(_here, 'cache')
+
+# Part of the compiled file's key, change it when the compiled form changes
+CACHE_VERSION = b'1'
+
+# Settings a region or site must have
+REGION_KEYS = ('sessionCert', 'serverUrl', 'routePartitionName', 'sites')
+SITE_KEYS = ('devicePoolName', 'locationName', 'callingSearchSpaceName')
+
+
+def compile_catalog(catalog):
+    # (regions, {(region, siteCode): resolved site}). Raises ValueError for a region or site missing a setting
+    regions = catalog['regions']
+    index = {}
+    for region, regionSettings in regions.items():
+        missing = [key for key in REGION_KEYS if key not in regionSettings]
+        if missing:
+            raise ValueError('Region ' + region + ' has no ' + ', '.join(missing))
+        defaults = {key: value for key, value in regionSettings.items() if key != 'sites'}
+        defaults['externalMask'] = None
+        for siteCode, siteSettings in regionSettings['sites'].items():
+            missing = [key for key in SITE_KEYS if key not in siteSettings]
+            if missing:
+                raise ValueError('Site ' + siteCode + ' in ' + region + ' has no ' + ', '.join(missing))
+            index[(region, siteCode)] = dict(defaults, **siteSettings)
+    return regions, index
+
+
+def _cache_path(catalogBytes, cacheDir):
+    digest = hashlib.sha256(CACHE_VERSION + catalogBytes).hexdigest()[:16]
+    return os.path.join(cacheDir, 'sites-' + digest + '.pickle')
+
+
+def load_catalog(path=CATALOG_FILE, cacheDir=CACHE_DIR):
+    # The compiled catalog, from cache/ when the catalog hasn't changed since it was written
+    with open(path, 'rb') as catalogFile:
+        catalogBytes = catalogFile.read()
+    cachePath = _cache_path(catalogBytes, cacheDir)
+    try:
+        with open(cachePath, 'rb') as cacheFile:
+            return pickle.load(cacheFile)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+    compiled = compile_catalog(json.loads(catalogBytes))
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        with open(cachePath + '.tmp', 'wb') as cacheFile:
+            pickle.dump(compiled, cacheFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cachePath + '.tmp', cachePath)
+    except OSError:
+        # A read only install just compiles the catalog every start
+        pass
+    return compiled
+
+
+REGIONS, _index = load_catalog()
+
+
+def get_site(region, siteCode):
+    # Region defaults overlaid with the site's own settings. Raises ValueError for an unknown region/site
+    site = _index.get((region, siteCode))
+    if site is None:
+        if region not in REGIONS:
+            raise ValueError('Unknown region ' + str(region))
+        raise ValueError('Unknown site ' + str(siteCode) + ' in ' + region)
+    return dict(site)
+
+
+def site_codes(region):
+    # Location codes of the region, in catalog order
+    return list(REGIONS[region]['sites'])
+
+
+def site_name(region, siteCode):
+    # What the location menu shows, the location code if the catalog has no name
+    return REGIONS[region]['sites'][siteCode].get('name', siteCode)
+
+
+if __name__ == '__main__':
+    print(CATALOG_FILE + ': ' + ', '.join(region + ' ' + str(len(site_codes(region))) + ' sites' for region in REGIONS))
@@ -22,22 +22,30 @@ SOFTWARE.
 # AXLEnums.xsd
 # AXLSoap.xsd
 
-from lxml import etree
-from requests import Session
-from requests.auth import HTTPBasicAuth
 from getpass import getpass
 
 import keyring
 
-from zeep import Client, Settings, Plugin, xsd
-from zeep.transports import Transport
-from zeep.exceptions import Fault
+from requests.exceptions import RequestException
+from zeep import Settings
+from zeep.exceptions import Error, Fault
 import sys
-import time
 import logging
 from progress.spinner import Spinner
 import re
 
+import AuditLog
+import AXLConnection
+import AXLTransport
+import BuildJournal
+import BuildPlan
+import ExtensionAllocator
+import PhoneBuild
+import Reconcile
+import ReferenceCache
+import Sites
+import WireLog
+
 # Use keyring to store username/passwords in Windows credential manager
 resetCredentials = False
 cucmusername = ''
@@ -86,151 +94,46 @@ def _setup_cucm_pw():
 
 _setup_cucm_pw()
 
-# Set up logging
+# Set up logging, JSON lines written by a background thread (AuditLog.py)
 log = "standard.log"
-logging.basicConfig(filename='standard.log', level=logging.INFO, format='%(asctime)s %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
-logging.info(cucmusername + ' started running the script')
-
-# CUCM Menu
-sessionCert = ''
-serverUrl = ''
-userEnteredRegion = ''
-locationMenu = {}
-locationMenu["\n1"] = 'US'
-locationMenu["2"] = 'Europe'
-locationMenu["3"] = 'APAC'
+AuditLog.setup('standard.log', operator=cucmusername)
+logging.info('started running the script')
+
+# CUCM Menu, one entry per region of the site catalog (sites.json, see Sites.py)
+regionMenu = {str(number): region for number, region in enumerate(Sites.REGIONS, 1)}
 while True:
-    options = locationMenu.keys()
-    for entry in options:
-        print(entry, locationMenu[entry])
+    print()
+    for entry, region in regionMenu.items():
+        print(entry, region)
 
     selection = input("Please select regional CUCM you'd like to work with: ")
-    if selection == "1":
-        userEnteredRegion = 'US'
-        sessionCert = 'us-cert-chain.pem'
-        serverUrl = 'https://insertUSCUCMURL:8443/axl/'
-        break
-    elif selection == "2":
-        userEnteredRegion = 'Europe'
-        sessionCert = 'europe-cert-chain.pem'
-        serverUrl = 'https://insertEuropeCUCMURL:8443/axl/'
-        break
-    elif selection == "3":
-        userEnteredRegion = 'APAC'
-        sessionCert = 'apac-cert-chain.pem'
-        serverUrl = 'https://insertAPACCUCMURL.net:8443/axl/'
+    if selection in regionMenu:
+        userEnteredRegion = regionMenu[selection]
         break
+sessionCert = Sites.REGIONS[userEnteredRegion]['sessionCert']
+serverUrl = Sites.REGIONS[userEnteredRegion]['serverUrl']
 
-# Location Menu
-devicePoolName = None
-locationName = None
-callingSearchSpaceName = None
-callForwardAll = None
-externalMask = None
-if userEnteredRegion == 'US':
-    # US Location Menu
-    # Set cluster specific variables
-    commonDeviceConfigName = 'US-PHONES'
-    softkeyTemplateName = 'Standard User'
-    userLocale = 'English United States'
-    routePartitionName = 'ALL_IPPhones'
-    locationMenu = {}
-    locationMenu["\n1"] = 'Location 1'
-    locationMenu["2"] = 'Location 2'
-    # you get the idea
-
-    while True:
-        options = locationMenu.keys()
-        for entry in options:
-            print(entry, locationMenu[entry])
-
-        selection = input("Please select the location for this phone setup: ")
-        if selection == "1":
-            devicePoolName = 'LOCATION1_PHONES'
-            locationName = 'LOCATION1'
-            callingSearchSpaceName = 'LOCATION1_INTERNATIONAL'
-            callForwardAll = {'callingSearchSpaceName': 'LOCATION1_CFA_CSS'}
-            break
-        elif selection == "2":
-            devicePoolName = 'LOCATION2_PHONES'
-            locationName = 'LOCATION2'
-            callingSearchSpaceName = 'LOCATION2_LONG_DISTANCE'
-            callForwardAll = {'callingSearchSpaceName': 'LOCATION2_CFA_CSS'}
-            break
-        # you get the idea
-
-elif userEnteredRegion == 'Europe':
-    # Europe location menu
-    userLocale = None
-    softkeyTemplateName = 'Standard User'
-    routePartitionName = 'CLUSTER-DN'
-    locationMenu = {}
-    locationMenu["\n1"] = 'Denmark'
-    locationMenu["2"] = 'Germany'
-    # you get the idea
+AuditLog.set_context(cluster=userEnteredRegion)
 
-    while True:
-        options = locationMenu.keys()
-        for entry in options:
-            print(entry, locationMenu[entry])
-
-        selection = input("Please select the location for this phone setup: ")
-        if selection == "1":
-            devicePoolName = 'DENMARK-PHONES'
-            commonDeviceConfigName = 'DENMARK-PHONES'
-            locationName = 'DENMARK'
-            callingSearchSpaceName = 'DEVICE-DENMARK-UNRESTRICTED'
-            userLocale = 'Danish Denmark'
-            callForwardAll = {'callingSearchSpaceName': 'CW-INTERNAL'}
-            print('\nDenmark set to allow internal forwarding only (Forward All CSS = CW-INTERNAL)')
-            # networkLocale = 'Denmark' # shouldn't need this as it's set on device pool
-            break
-        elif selection == "2":
-            devicePoolName = 'GERMANY-PHONES'
-            commonDeviceConfigName = 'GERMANY-PHONES'
-            locationName = 'GERMANY'
-            callingSearchSpaceName = 'DEVICE-GERMANY-UNRESTRICTED'
-            userLocale = 'German Germany'
-            callForwardAll = {'callingSearchSpaceName': 'CW-INTERNAL'}
-            print('\nDiamant set to allow internal forwarding only (Forward All CSS = CW-INTERNAL)')
-            break
-        # you get the idea
-
-elif userEnteredRegion == 'APAC':
-    # APAC menu for agent location
-    userLocale = None
-    softkeyTemplateName = 'CUSTOM User'
-    routePartitionName = 'SYSTEM-CLUSTER-DN'
-    locationMenu = {}
-    locationMenu["\n1"] = 'Australia'
-    locationMenu["2"] = 'Japan'
-    # you get the idea
-
-    while True:
-        options = locationMenu.keys()
-        for entry in options:
-            print(entry, locationMenu[entry])
+# Location Menu, the region's sites in catalog order. The location code works too, handy
+# once a region has more sites than fit on the screen
+locationMenu = {str(number): siteCode for number, siteCode in enumerate(Sites.site_codes(userEnteredRegion), 1)}
+while True:
+    print()
+    for entry, siteCode in locationMenu.items():
+        print(entry, Sites.site_name(userEnteredRegion, siteCode))
 
-        selection = input("Please select the location for this phone setup: ")
-        if selection == "1":
-            devicePoolName = 'AUSTRALIA-PHONES'
-            commonDeviceConfigName = 'AUSTRALIA-PHONES'
-            locationName = 'AUSTRALIA'
-            callingSearchSpaceName = 'AUSTRALIA-UNRESTRICTED'
-            userLocale = 'English United States'
-            softkeyTemplateName = 'CUSTOM AUSTRALIA User'
-            callForwardAll = {'callingSearchSpaceName': 'SYSTEM-CW-INTERNAL'}
-            print('\nAustralia set to allow internal forwarding only (Forward All CSS = SYSTEM-CW-INTERNAL)')
-            break
-        elif selection == "2":
-            devicePoolName = 'JAPAN-PHONES'
-            commonDeviceConfigName = 'JAPAN-PHONES'
-            locationName = 'JAPAN'
-            callingSearchSpaceName = 'JAPAN-UNRESTRICTED'
-            userLocale = 'Japanese Japan'
-            callForwardAll = {'callingSearchSpaceName': 'SYSTEM-CW-INTERNAL'}
-            print('\nJapan set to allow internal forwarding only (Forward All CSS = SYSTEM-CW-INTERNAL)')
-            break
+    selection = input("Please select the location for this phone setup: ")
+    siteCode = locationMenu.get(selection, selection.upper())
+    try:
+        site = Sites.get_site(userEnteredRegion, siteCode)
+        break
+    except ValueError:
+        pass
+if site.get('notice'):
+    print('\n' + site['notice'])
+routePartitionName = site['routePartitionName']
+locationName = site['locationName']
 
 
 def _get_Phone_Mac_Address():
@@ -248,7 +151,7 @@ def _get_Phone_Mac_Address():
 
 # Get Prereqs / input data
 phoneUsername = input("\nPlease enter the username of the person for the phone setup: ")
-phoneExt = input("\nPlease enter the extension for the phone setup: ")
+phoneExt = input("\nPlease enter the extension for the phone setup (Enter for the next free one at the location): ")
 # Menu for type of phone build Jabber/Deskphone/CIPC etc.
 userEnteredPhoneModel = ''
 jabberOnly = False
@@ -275,66 +178,37 @@ while True:
         break
     elif selection == "3":
         userEnteredPhoneModel = input("\nPlease enter the model of the desk phone (e.g. 7942): ")
-        phoneMac = input("\nPlease enter the MAC address of the desk phone (Quit if there's no desk phone): ")
-        deskPhoneDeviceName = 'SEP' + phoneMac
+        _get_Phone_Mac_Address()
         break
 
 
 def _setup_connection():
     # Setup SOAP/AXL/HTTPS Connection
     global service
-    # Change to true to enable output of request/response headers and XML
+    # Change to true to log AXL requests/responses to standard.wire.log (see WireLog.py). Every call is
+    # logged, each message cut at WireLog.MAX_MESSAGE_BYTES, by a background thread to a rotating file
     DEBUG = False
 
     # The WSDL is a local file in the working directory, see README
     WSDL_FILE = 'schema/AXLAPI.wsdl'
 
-    # This class lets you view the incoming and outgoing http headers and XML
-
-    class MyLoggingPlugin(Plugin):
-
-        def egress(self, envelope, http_headers, operation, binding_options):
-
-            # Format the request body as pretty printed XML
-            xml = etree.tostring(envelope, pretty_print=True, encoding='unicode')
-
-            print(f'\nRequest\n-------\nHeaders:\n{http_headers}\n\nBody:\n{xml}')
-
-        def ingress(self, envelope, http_headers, operation):
-
-            # Format the response body as pretty printed XML
-            xml = etree.tostring(envelope, pretty_print=True, encoding='unicode')
-
-            print(f'\nResponse\n-------\nHeaders:\n{http_headers}\n\nBody:\n{xml}')
-
-
-    # The first step is to create a SOAP client session
-    session = Session()
-
-    # We avoid certificate verification by default
-    # session.verify = False
-
-    # To enabled SSL cert checking (recommended for production)
-    # place the CUCM Tomcat cert .pem file in the root of the project
-    # and uncomment the line below
-
-    session.verify = sessionCert
-
-    # Add Basic Auth credentials
-    session.auth = HTTPBasicAuth(cucmusername, cucmpassword)
+    # SSL cert checking uses the CUCM Tomcat cert .pem file in the root of the project.
+    # Pass False instead of sessionCert to avoid certificate verification
 
-    # Create a Zeep transport and set a reasonable timeout value
-    transport = Transport(session=session, timeout=10)
+    # Create a throttle-aware Zeep transport on the cluster's pooled session, with Basic Auth
+    # credentials and per operation timeouts
+    transport = AXLTransport.get_transport(serverUrl, sessionCert, cucmusername, cucmpassword)
 
     # strict=False is not always necessary, but it allows zeep to parse imperfect XML
     settings = Settings(strict=False, xml_huge_tree=True)
 
-    # If debug output is requested, add the MyLoggingPlugin callback
-    plugin = [MyLoggingPlugin()] if DEBUG else [ ]
+    # If debug output is requested, start the wire log
+    if DEBUG:
+        WireLog.configure('standard.wire.log')
 
-    # Create the Zeep client with the specified settings
-    client = Client(WSDL_FILE, settings=settings, transport=transport,
-            plugins=plugin)
+    # Create the Zeep client with the specified settings, from the cached schema when possible
+    client = AXLConnection.load_client(WSDL_FILE, settings=settings, transport=transport)
+    logging.info(AXLConnection.startup_report())
 
     # FUTURE create CUCM chooser menu
 
@@ -344,10 +218,14 @@ def _setup_connection():
 
 _setup_connection()
 
+# Set when this build creates its extension, an addLine is then the first write
+newLine = False
+
 
 def _check_for_existing_setup():
     global resetCredentials
     global associatedDevices
+    global newLine
     # Find out if there's an existing phone/extension and if it's associated with the line
     try:
         lineResp = service.getLine(pattern=phoneExt, routePartitionName=routePartitionName)
@@ -357,18 +235,18 @@ def _check_for_existing_setup():
         if str(err) == 'Item not valid: The specified Line was not found':
             # Extension doesn't exist either error out or ask to create
             # print(f'Zeep error: getLine: { err }')
-            logging.warning(cucmusername + ' Extension does not exist')
+            AuditLog.event('extension ' + phoneExt + ' does not exist', level=logging.WARNING, operation='getLine')
             userResp = input('\nThis extension does not exist, would you like to create? (y/n) ')
             if userResp == 'y' or userResp == 'Y':
-                # FUTURE create ext.
-                input('\nCode to create new extension has not been implemented, exiting.')
-                sys.exit(1)
+                # Created by the build, before the phones that use it
+                newLine = True
+                associatedDevices = None
             else:
                 input('\nPress Enter to quit.')
                 sys.exit(1)
         elif str(err) == 'Unknown fault occured':
             # Wrong credentials?
-            logging.error(cucmusername + ' ' + str(err))
+            AuditLog.event(str(err), level=logging.ERROR, operation='getLine')
             print(f'Zeep error: getLine: { err }')
             resetCredentailMenu = {}
             resetCredentailMenu["\n1"] = 'Try username & password again'
@@ -382,23 +260,50 @@ def _check_for_existing_setup():
                     resetCredentials = True
                     _setup_cucm_username()
                     _setup_cucm_pw()
-                    _setup_connection()
+                    # Same client and pooled connections, only the credentials change
+                    AXLTransport.set_credentials(serverUrl, cucmusername, cucmpassword)
+                    AuditLog.set_context(operator=cucmusername)
                     _check_for_existing_setup()
                     break
                 elif selection == "2":
                     sys.exit(1)
                     break
         else:
-            logging.error(cucmusername + ' ' + str(err))
+            AuditLog.event(str(err), level=logging.ERROR, operation='getLine')
             print(f'Zeep error: getLine: { err }')
             input('\nCheck the error above and consult admin if needed, exiting.')
             sys.exit(1)
 
 
-_check_for_existing_setup()
+def _allocate_extension():
+    global phoneExt
+    global associatedDevices
+    global newLine
+    # Next free extension of the location's range, from one load of the partition's dial plan (ExtensionAllocator.py)
+    if not site.get('extensionRange'):
+        input('\nNo extension entered and ' + locationName + ' has no extensionRange in the site catalog, exiting.')
+        sys.exit(1)
+    try:
+        phoneExt = ExtensionAllocator.ExtensionAllocator(service, routePartitionName).allocate(site['extensionRange'])[0]
+    except (Fault, ValueError) as err:
+        AuditLog.event(str(err), level=logging.ERROR, operation='executeSQLQuery')
+        print(f'Zeep error: executeSQLQuery: { err }')
+        input('\nCheck the error above and consult admin if needed, exiting.')
+        sys.exit(1)
+    AuditLog.event('allocated extension ' + phoneExt + ' in ' + site['extensionRange'], operation='executeSQLQuery')
+    print('\nNext free extension in ' + site['extensionRange'] + ' is ' + phoneExt + ', it will be created.')
+    newLine = True
+    associatedDevices = None
+
+
+if phoneExt:
+    _check_for_existing_setup()
+else:
+    _allocate_extension()
 
 # Assume extension exists and continuing to create phone/device profile
 # Ask if you want to blow it away or quit
+reconcileMode = False
 if associatedDevices is None or associatedDevices == "":
     print('\nNo devices associated with this line, continuing setup...')
 else:
@@ -408,6 +313,7 @@ else:
     existingDeviceMenu["\n1"] = 'CONTINUE: I am adding a device to an existing user that already has a phone.'
     existingDeviceMenu["2"] = 'DELETE: Remove or re-use this phone (This will delete all phones above. WARNING: All previous configuration will be lost.)'
     existingDeviceMenu["3"] = 'QUIT (check the device name/mac address or clean things up manually in CUCM.)'
+    existingDeviceMenu["4"] = 'RE-APPLY: Bring the phones, line and user of this build up to the site standards (only changed settings are sent.)'
     while True:
         options = existingDeviceMenu.keys()
         for entry in options:
@@ -424,416 +330,119 @@ else:
         elif selection == "3":
             sys.exit(1)
             break
+        elif selection == "4":
+            reconcileMode = True
+            break
 
-# Force LDAP Sync to pull name instead of prompting for them
-try:
-    resp = service.doLdapSync(name='LDAP', sync='true')
-except Fault as err:
-    logging.error(cucmusername + ' ' + str(err))
-    print(f'Zeep error: doLdapSync: { err }')
-    input('\n Press Enter to quit.')
-    sys.exit(1)
-# Loop and get status of LDAP sync before proceeding. Wait 1 second or it gets caught before complete
-spinner = Spinner('LDAP Syncing. This may take 1-2 minutes... ')
-time.sleep(1)
-ldapSyncStatus = ''
-while ldapSyncStatus != 'Sync is performed successfully':
-    try:
-        resp = service.getLdapSyncStatus(name='LDAP')
-        ldapSyncStatus = resp['return']
-    except Fault as err:
-        logging.error(cucmusername + ' ' + str(err))
-        print(f'Zeep error: doLdapSync: { err }')
-    spinner.next()
-    time.sleep(1)
-print(' LDAP Sync Successful...\n')
-
-# Execute the getUser request
+# Only force an LDAP Sync when the user hasn't come over from LDAP with a name yet.
+# The same getUser returns the user's devices, so the build doesn't need to read the user again
 try:
-    getUserResponse = service.getUser(userid=phoneUsername)
-    userDetails = getUserResponse['return'].user
-    phoneLname = userDetails.lastName
-    phoneFname = userDetails.firstName
+    userDetails = PhoneBuild.find_user(service, phoneUsername)
 except Fault as err:
-    logging.error(cucmusername + ' ' + str(err))
+    AuditLog.event(str(err), level=logging.ERROR, operation='getUser', user=phoneUsername)
     print(f'Zeep error: getUser: { err }')
     input('\n Press Enter to quit.')
     sys.exit(1)
-
-# Normalize some data
-jabberDeviceName = 'csf' + phoneUsername
-phoneDescription = phoneFname + ' ' + phoneLname + ' - ' + phoneExt
-phoneDisplay = phoneLname + ', ' + phoneFname[0]
-phoneModel = 'Cisco ' + userEnteredPhoneModel
-
-logging.info(cucmusername + ' setting up ' + phoneUsername + ' ' + phoneDescription + ' in ' + locationName)
-input('Continue phone build for ' + phoneDescription + ' in ' + locationName + ' ? (Press Ctrl + C to quit. Press Enter to continue...)')
-
-
-def _setup_Jabber():
-    # Create the data for adding Jabber, associating the Line
-    phone = {
-        'name': jabberDeviceName,
-        'description': phoneDescription,
-        'product': 'Cisco Unified Client Services Framework',
-        'model': 'Cisco Unified Client Services Framework',
-        'class': 'Phone',
-        'protocol': 'SIP',
-        'protocolSide': 'User',
-        'devicePoolName': devicePoolName,
-        'commonDeviceConfigName': commonDeviceConfigName,
-        'phoneTemplateName': 'Standard Client Services Framework',
-        'commonPhoneConfigName': 'Standard Common Phone Profile',
-        'locationName': locationName,
-        'useTrustedRelayPoint': 'Default',
-        'builtInBridgeStatus': 'Default',
-        'deviceMobilityMode': 'Default',
-        'callingSearchSpaceName': callingSearchSpaceName,
-        'retryVideoCallAsAudio': 'true',
-        'allowCtiControlFlag': 'true',
-        'hlogStatus': 'On',
-        'packetCaptureMode': 'None',
-        'certificateOperation': 'No Pending Operation',
-        'enableExtensionMobility': 'true',
-        # Add line
-        'lines': {
-            'line': [
-                {
-                    'index': 1,
-                    'label': phoneDescription,  # Line text label
-                    'dirn': {
-                        'pattern': phoneExt,
-                        'routePartitionName': routePartitionName,
-                    },
-                    'display': phoneDisplay,
-                    'displayAscii': phoneDisplay,
-                    'e164Mask': externalMask,  # Used in specific locations
-                    'associatedEndusers': {
-                        'enduser': [
-                            {
-                                'userId': phoneUsername
-                            }
-                        ]
-                    }
-                }
-            ]
-        },
-        'securityProfileName': 'Cisco Unified Client Services Framework - Standard SIP Non-Secure Profile'
-    }
-    # Execute the addPhone request
-    try:
-        resp = service.addPhone(phone)
-        logging.info(cucmusername + ' created Jabber device ' + jabberDeviceName)
-
-    except Fault as err:
-        logging.error(cucmusername + ' ' + str(err))
-        print(f'Zeep error: addPhone: { err }')
-        input('\n Press Enter to quit.')
-        sys.exit(1)
-    # print('\naddPhone response:\n')
-    # print(resp, '\n')
-    input('Jabber creation complete. Press Enter to continue...')
-
-    # Execute the updateLine request
-    try:
-        resp = service.updateLine(
-            pattern=phoneExt,
-            routePartitionName=routePartitionName,
-            alertingName=phoneDisplay,
-            asciiAlertingName=phoneDisplay,
-            description=phoneDescription,
-            callForwardAll=callForwardAll
-        )
-
-    except Fault as err:
-        logging.error(cucmusername + ' ' + str(err))
-        print(f'Zeep error: updateLine: { err }')
-        input('\n Press Enter to quit.')
-        sys.exit(1)
-    # print('\nupdateLine response:\n')
-    # print(resp, '\n')
-    input('Line Updated. Press Enter to continue...')
-
-
-def _setup_desk_phone():
-    # may need to add more models to diferentiate SIP/SCCP
-    if phoneModel.startswith('Cisco 78') or phoneModel.startswith('Cisco 88'):
-        protocol = 'SIP'
-        securityProfileName = phoneModel + ' - Standard SIP Non-Secure Profile'
-    else:
-        protocol = 'SCCP'
-        securityProfileName = None
-    if userEnteredPhoneModel == '7942' or userEnteredPhoneModel == '7962':
-        phoneTemplateName = 'Standard ' + userEnteredPhoneModel + 'G ' + protocol
-    else:
-        phoneTemplateName = 'Standard ' + userEnteredPhoneModel + ' ' + protocol
-    phone = {
-        'name': deskPhoneDeviceName,
-        'description': phoneDescription,
-        'product': phoneModel,
-        'model': phoneModel,
-        'class': 'Phone',
-        'protocol': protocol,
-        'protocolSide': 'User',
-        'devicePoolName': devicePoolName,
-        'commonDeviceConfigName': commonDeviceConfigName,
-        'phoneTemplateName': phoneTemplateName,
-        'softkeyTemplateName': softkeyTemplateName,
-        'commonPhoneConfigName': 'Standard Common Phone Profile',
-        'locationName': locationName,
-        'useTrustedRelayPoint': 'Default',
-        'builtInBridgeStatus': 'Default',
-        'deviceMobilityMode': 'Default',
-        'callingSearchSpaceName': callingSearchSpaceName,
-        'retryVideoCallAsAudio': 'true',
-        'allowCtiControlFlag': 'true',
-        'hlogStatus': 'On',
-        'packetCaptureMode': 'None',
-        'certificateOperation': 'No Pending Operation',
-        'enableExtensionMobility': 'true',
-        'securityProfileName': securityProfileName,
-        # Add line
-        'lines': {
-            'line': [
-                {
-                    'index': 1,
-                    'label': phoneDescription,  # Line text label
-                    'dirn': {
-                        'pattern': phoneExt,
-                        'routePartitionName': routePartitionName,
-                    },
-                    'display': phoneDisplay,
-                    'displayAscii': phoneDisplay,
-                    'e164Mask': externalMask,  # Used in specific locations
-                    'associatedEndusers': {
-                        'enduser': [
-                            {
-                                'userId': phoneUsername
-                            }
-                        ]
-                    }
-                }
-            ]
-        }
-    }
-
-    # Execute the addPhone request
-    try:
-        resp = service.addPhone(phone)
-        logging.info(cucmusername + ' created desk phone ' + deskPhoneDeviceName + ' ' + userEnteredPhoneModel)
-        # TODO Future add handling for a device that already exists
-        # Could not insert new row - duplicate value in a UNIQUE INDEX column (Unique Index:)
-    except Fault as err:
-        logging.error(cucmusername + ' ' + str(err))
-        print(f'Zeep error: addPhone: { err }')
-        input('\n Press Enter to quit.')
-        sys.exit(1)
-    # print('\naddPhone response:\n')
-    # print(resp, '\n')
-    input('Desk phone creation complete. Press Enter to continue...')
-
-    # Execute the updateLine request
+if PhoneBuild.user_names(userDetails) is not None:
+    print('\nUser found, skipping LDAP Sync...\n')
+else:
+    spinner = Spinner('LDAP Syncing. This may take 1-2 minutes... ')
     try:
-        resp = service.updateLine(
-            pattern=phoneExt,
-            routePartitionName=routePartitionName,
-            alertingName=phoneDisplay,
-            asciiAlertingName=phoneDisplay,
-            description=phoneDescription,
-            callForwardAll=callForwardAll
-        )
-
-    except Fault as err:
-        logging.error(cucmusername + ' ' + str(err))
-        print(f'Zeep error: updateLine: { err }')
+        PhoneBuild.ldap_sync(service, spinner)
+        userDetails = PhoneBuild.find_user(service, phoneUsername)
+    except (Fault, TimeoutError) as err:
+        AuditLog.event(str(err), level=logging.ERROR, operation='doLdapSync', user=phoneUsername)
+        print(f'\nZeep error: doLdapSync: { err }')
         input('\n Press Enter to quit.')
         sys.exit(1)
-    # print('\nupdateLine response:\n')
-    # print(resp, '\n')
-    input('Line Updated. Press Enter to continue...')
-
-
-def _update_End_User():
-    # LDAP sync should have occured above
-    # Set data for UpdateUser Request (only variables with multiple values)
-
-    primaryExtension = {
-        'pattern': phoneExt,
-        'routePartitionName': routePartitionName
-    }
-    associatedGroups = {
-        'userGroup': [
-            {'name': 'Standard CCM End Users'},
-            {'name': 'Standard CTI Enabled'}
-        ]
-    }
-    if deskPhoneOnly:
-        # Get existing data and append or it will wipe out existing associations
-        try:
-            resp = service.getUser(userid=phoneUsername)
-            userDetails = resp['return'].user
-            currentAssociatedDeviceList = userDetails.associatedDevices
-        except Fault as err:
-            print(f'Zeep error: getUser: { err }')
-            input('\n Press Enter to quit.')
-            sys.exit(1)
-        # Append desk phone to list
-        if currentAssociatedDeviceList is None:
-            updatedAssociatedDevices = {
-                'device': deskPhoneDeviceName
-            }
-        else:
-            unpackedAssociatedDevices = currentAssociatedDeviceList.device
-            unpackedAssociatedDevices.append(deskPhoneDeviceName)
-            updatedAssociatedDevices = {
-                'device': unpackedAssociatedDevices
-            }
-    elif jabberOnly:
-        # Get existing data and append or it will wipe out existing associations
-        try:
-            resp = service.getUser(userid=phoneUsername)
-            userDetails = resp['return'].user
-            currentAssociatedDeviceList = userDetails.associatedDevices
-        except Fault as err:
-            print(f'Zeep error: getUser: { err }')
-            input('\n Press Enter to quit.')
-            sys.exit(1)
-        # Append jabber to list
-        if currentAssociatedDeviceList is None:
-            updatedAssociatedDevices = {
-                'device': jabberDeviceName
-            }
-        else:
-            unpackedAssociatedDevices = currentAssociatedDeviceList.device
-            unpackedAssociatedDevices.append(jabberDeviceName)
-            updatedAssociatedDevices = {
-                'device': unpackedAssociatedDevices
-            }
-    else:
-        # Get existing data and append or it will wipe out existing associations
-        try:
-            resp = service.getUser(userid=phoneUsername)
-            userDetails = resp['return'].user
-            currentAssociatedDeviceList = userDetails.associatedDevices
-        except Fault as err:
-            print(f'Zeep error: getUser: { err }')
-            input('\n Press Enter to quit.')
-            sys.exit(1)
-        # Append jabber to list
-        if currentAssociatedDeviceList is None:
-            updatedAssociatedDevices = {
-                'device': [
-                    jabberDeviceName,
-                    deskPhoneDeviceName
-                ]
-            }
-        else:
-            unpackedAssociatedDevices = currentAssociatedDeviceList.device
-            unpackedAssociatedDevices.append(deskPhoneDeviceName)
-            unpackedAssociatedDevices.append(jabberDeviceName)
-            updatedAssociatedDevices = {
-                'device': unpackedAssociatedDevices
-            }
-    # Execute update end user (1st time)
-    if deskPhoneOnly:
-        try:
-            resp = service.updateUser(
-                    userid=phoneUsername,
-                    userLocale=userLocale,
-                    homeCluster=True,
-                    associatedDevices=updatedAssociatedDevices,
-                    enableCti=True,
-                    associatedGroups=associatedGroups
-                    )
-            logging.info(cucmusername + ' first pass updated end user ' + phoneUsername)
-        except Fault as err:
-            logging.error(cucmusername + ' ' + str(err))
-            print(f'Zeep error: updateUser: { err }')
-            input('\n Press Enter to quit.')
-            sys.exit(1)
-    else:
-        try:
-            resp = service.updateUser(
-                userid=phoneUsername,
-                userLocale=userLocale,
-                homeCluster=True,
-                imAndPresenceEnable=True,
-                associatedDevices=updatedAssociatedDevices,
-                enableCti=True,
-                associatedGroups=associatedGroups
-                )
-            logging.info(cucmusername + ' first pass updated end user ' + phoneUsername)
-        except Fault as err:
-            logging.error(cucmusername + ' ' + str(err))
-            print(f'Zeep error: updateUser: { err }')
-            input('\n Press Enter to quit.')
-            sys.exit(1)
-        # print('\nupdateUser response:\n')
-        # print(resp, '\n')
-
-    # Execute update end user (2nd time)
-    try:
-        resp = service.updateUser(
-            userid=phoneUsername,
-            # Need to update after phone/Jabber is associated
-            primaryExtension=primaryExtension,
-            )
-        logging.info(cucmusername + ' second pass updated end user ' + phoneUsername)
-    except Fault as err:
-        logging.error(cucmusername + ' ' + str(err))
-        print(f'Zeep error: updateUser: { err }')
-        input('\n Press Enter to quit.')
+    print(' LDAP Sync Successful...\n')
+    if PhoneBuild.user_names(userDetails) is None:
+        AuditLog.event('not found after LDAP sync', level=logging.ERROR, user=phoneUsername)
+        input(phoneUsername + ' was not found with a first and last name after LDAP sync. Press Enter to quit.')
         sys.exit(1)
-    print('End User Updated...\n')
 
+# Normalize some data
+if deskPhoneOnly:
+    buildType = 'desk'
+elif jabberOnly:
+    buildType = 'jabber'
+else:
+    buildType = 'both'
+build = PhoneBuild.new_build(phoneUsername, phoneExt, buildType, site,
+                             userEnteredPhoneModel=userEnteredPhoneModel, phoneMac=phoneMac)
+build['newLine'] = newLine
+PhoneBuild.set_user(build, userDetails)
+jabberDeviceName = build['jabberDeviceName']
+phoneDescription = build['phoneDescription']
+
+# Check the build against the cluster's device pools, CSSs, templates etc. before any write
+try:
+    problems = ReferenceCache.ReferenceCache(service, serverUrl).validate_build(build)
+except (Error, RequestException) as err:
+    problems = []
+    logging.warning('reference data not available, build not validated ' + str(err))
+if problems:
+    AuditLog.event('build rejected: ' + '; '.join(problems), level=logging.ERROR, user=phoneUsername)
+    print('\nThis build would fail in CUCM:')
+    for problem in problems:
+        print(problem)
+    input('\nCheck the site settings above and consult admin if needed, exiting.')
+    sys.exit(1)
 
-def _update_Desk_Phone_Owner():
+# Duplicate reads and writes are compiled out of the plan before anything is sent.
+# Steps an earlier run of the same build did before it failed are skipped (standard.journal)
+plan = BuildPlan.plan_build(build)
+compiledSteps = BuildPlan.compile_plan(plan, build)
+buildId = BuildPlan.build_id(build)
+if reconcileMode:
+    # Compared with what's in CUCM instead of the journal, only the differences are sent
+    journal = None
     try:
-        resp = service.updatePhone(
-            name=deskPhoneDeviceName,
-            ownerUserName=phoneUsername
-            )
-        logging.info(cucmusername + ' updated desk phone ' + deskPhoneDeviceName + ' owner to ' + phoneUsername)
-    except Fault as err:
-        logging.error(cucmusername + ' ' + str(err))
-        print(f'Zeep error: updatePhone: { err }')
+        current = Reconcile.fetch_current(service, build, compiledSteps)
+        steps, inSync = Reconcile.reconcile_plan(build, compiledSteps, current)
+    except (Fault, ValueError) as err:
+        logging.error(str(err))
+        print(f'Zeep error: reconcile: { err }')
         input('\n Press Enter to quit.')
         sys.exit(1)
-    print('Desk Phone owner updated...\n')
+    for objectName in inSync:
+        print(objectName + ' already matches the site standards, skipping...')
+    AuditLog.event('reconciling ' + buildId + ', in sync: ' + ', '.join(inSync), user=phoneUsername)
+else:
+    journal = BuildJournal.BuildJournal('standard.journal', cucmusername)
+    if journal.completed(buildId):
+        # The same build finished before, e.g. the devices were deleted since. Run it from the start
+        journal.restart(buildId)
+    steps = BuildPlan.pending_steps(compiledSteps, build, journal)
+    if len(steps) < len(compiledSteps):
+        print('\nResuming a build that stopped part way, ' + str(len(compiledSteps) - len(steps)) + ' steps already done.')
+        AuditLog.event('resuming ' + buildId + ' from the journal', user=phoneUsername)
+print('\nThe build will make ' + BuildPlan.describe(steps, plan) + '\n')
+
+AuditLog.event('setting up ' + phoneDescription + ' in ' + locationName, user=phoneUsername)
+input('Continue phone build for ' + phoneDescription + ' in ' + locationName + ' ? (Press Ctrl + C to quit. Press Enter to continue...)')
 
 
-def _update_Jabber_Owner():
+# EXECUTE! One AXL call per step of the plan
+for step in steps:
     try:
-        resp = service.updatePhone(
-            name=jabberDeviceName,
-            ownerUserName=phoneUsername
-            )
-        logging.info(cucmusername + ' updated jabber ' + jabberDeviceName + ' owner to ' + phoneUsername)
+        BuildPlan.run_step(service, build, step, journal)
+        # TODO Future add handling for a device that already exists outside of this script
+        # Could not insert new row - duplicate value in a UNIQUE INDEX column (Unique Index:)
     except Fault as err:
-        logging.error(cucmusername + ' ' + str(err))
-        print(f'Zeep error: updatePhone: { err }')
+        print(f"Zeep error: {step['operation']}: { err }")
         input('\n Press Enter to quit.')
         sys.exit(1)
-    print('Jabber owner updated...\n')
-
-
-# EXECUTE!
-if deskPhoneOnly:
-    _setup_desk_phone()
-    _update_End_User()
-    _update_Desk_Phone_Owner()
-elif jabberOnly:
-    _setup_Jabber()
-    _update_End_User()
-    _update_Jabber_Owner()
-else:
-    _setup_desk_phone()
-    _setup_Jabber()
-    _update_End_User()
-    _update_Desk_Phone_Owner()
-    _update_Jabber_Owner()
+    message = step['label'][0].upper() + step['label'][1:]
+    if step['operation'] in ('addPhone', 'updateLine'):
+        input(message + '. Press Enter to continue...')
+    else:
+        print(message + '...\n')
+if journal is not None:
+    journal.finish(buildId)
+    journal.close()
 
-logging.info(cucmusername + ' succesfully reached end of script')
+logging.info('succesfully reached end of script')
 input(
     'Complete. Do the following manual tasks where applicable:'
     '\n1:Setup voicemail (import from LDAP using UCXN GUI)'
@@ -0,0 +1,116 @@
+"""Sampled, size capped AXL wire logging that is cheap enough to leave on
+
+Replaces the old DEBUG MyLoggingPlugin, which pretty printed every envelope to the
+terminal and roughly doubled the run time on big listPhone responses. The transports
+(AXLScheduler.py, AXLAsync.py) hand each request/response over as the raw bytes they
+already have, so nothing is serialized again. A call is only logged if its operation
+is in operations (all by default) and it is picked by sampleRate. Each message is cut
+at maxBytes, and the lines are written to a rotating file by a background thread.
+
+    WireLog.configure('ExMoBulkLogout.wire.log', sampleRate=0.1, operations=('doDeviceLogout',))
+
+Nothing is logged until configure() is called. If the writer falls behind, messages
+are dropped rather than holding up AXL calls, see dropped().
+"""
+import atexit
+import logging
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import AXLMetrics
+
+# Bytes of each request/response body kept, the rest is cut off
+MAX_MESSAGE_BYTES = 16384
+
+# The log rotates at MAX_FILE_BYTES, keeping BACKUP_COUNT old files
+MAX_FILE_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+# Messages waiting for the writer. When it's full new ones are dropped
+QUEUE_SIZE = 10000
+
+# Set by configure(), None while wire logging is off
+_settings = None
+_listener = None
+_dropped = 0
+_droppedLock = threading.Lock()
+
+
+class _DroppingQueueHandler(QueueHandler):
+    # Never waits for the writer, a full queue costs a log line instead of AXL throughput
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _droppedLock:
+                _dropped += 1
+
+
+def configure(path, sampleRate=1.0, maxBytes=MAX_MESSAGE_BYTES, operations=None, maxFileBytes=MAX_FILE_BYTES,
+              backupCount=BACKUP_COUNT):
+    # operations: operation names to log, None for all. Can be called again to change the settings
+    global _settings, _listener
+    stop()
+    fileHandler = RotatingFileHandler(path, maxBytes=maxFileBytes, backupCount=backupCount, encoding='utf-8')
+    fileHandler.setFormatter(logging.Formatter('%(asctime)s %(message)s', datefmt='%d/%m/%Y %H:%M:%S'))
+    records = queue.Queue(QUEUE_SIZE)
+    logger = logging.getLogger('axl.wire')
+    logger.handlers = [_DroppingQueueHandler(records)]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    _listener = QueueListener(records, fileHandler)
+    _listener.start()
+    _settings = {'sampleRate': sampleRate, 'maxBytes': maxBytes,
+                 'operations': set(operations) if operations is not None else None}
+
+
+def stop():
+    # Writes out what's queued and closes the file, also run at exit
+    global _settings, _listener
+    _settings = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop)
+
+
+def dropped():
+    # Messages dropped because the writer couldn't keep up
+    return _dropped
+
+
+def _body(content, maxBytes):
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    shown = content[:maxBytes].decode('utf-8', 'replace')
+    if len(content) > maxBytes:
+        shown += f'... [{len(content) - maxBytes} more bytes]'
+    return shown
+
+
+def record(address, headers, message, response):
+    # Called by the transports for every call. response is None if the call didn't get one
+    settings = _settings
+    if settings is None:
+        return
+    operation = AXLMetrics.operation_name(headers)
+    if settings['operations'] is not None and operation not in settings['operations']:
+        return
+    if settings['sampleRate'] < 1.0 and random.random() >= settings['sampleRate']:
+        return
+    logger = logging.getLogger('axl.wire')
+    logger.info(f'{operation} request to {address} ({len(message)} bytes)\n'
+                f"{_body(message, settings['maxBytes'])}")
+    if response is None:
+        logger.info(f'{operation} no response')
+    else:
+        logger.info(f'{operation} response HTTP {response.status_code} ({len(response.content)} bytes)\n'
+                    f"{_body(response.content, settings['maxBytes'])}")
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The scripts are top level modules in the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def axl(monkeypatch):
+    # (FakeAXLServer, zeep service on it). zeep loads schema/AXLAPI.wsdl from the working directory, see README
+    if not os.path.exists(os.path.join(ROOT, 'schema', 'AXLAPI.wsdl')):
+        pytest.skip('needs the AXL schema files in schema/')
+    monkeypatch.chdir(ROOT)
+    import AXLBenchmark
+    import FakeAXLServer
+    server = FakeAXLServer.start()
+    yield server, AXLBenchmark._service(server.url, 1)
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,111 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import AXLScheduler
+
+OK = b'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"><soapenv:Body/></soapenv:Envelope>'
+MEMORY_FAULT = (b'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"><soapenv:Body>'
+                b'<soapenv:Fault><faultcode>soapenv:Server</faultcode>'
+                b'<faultstring>Maximum AXL Memory Allocation Consumed</faultstring></soapenv:Fault>'
+                b'</soapenv:Body></soapenv:Envelope>')
+HEADERS = {'Content-Type': 'text/xml', 'SOAPAction': '"CUCM:DB ver=11.5 getPhone"'}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            self.server.requests += 1
+            status, headers, body = self.server.replies.pop(0) if self.server.replies else (200, {}, OK)
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub():
+    # Answers each POST with the next of server.replies, (status, headers, body), then 200 once they run out
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.replies = []
+    server.url = f'http://127.0.0.1:{server.server_port}/axl/'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    # Short backoffs, and the rate after every throttle event
+    monkeypatch.setattr(AXLScheduler, 'THROTTLE_BACKOFF', 0.01)
+    bucket = AXLScheduler.TokenBucket(rate=160, maxRate=200)
+    bucket.rates = []
+    throttled = bucket.throttled
+
+    def record(pause):
+        bucket.rates.append(throttled(pause))
+        return bucket.rates[-1]
+    monkeypatch.setattr(bucket, 'throttled', record)
+    return bucket
+
+
+def test_retries_through_throttling(stub, bucket):
+    stub.replies = [(503, {'Retry-After': '0'}, b''), (503, {}, b''), (429, {}, b''), (500, {}, MEMORY_FAULT)]
+    transport = AXLScheduler.ThrottledTransport(stub.url, bucket=bucket)
+    response = transport.post(stub.url, b'<getPhone/>', HEADERS)
+    assert response.status_code == 200
+    assert stub.requests == 5
+    # Halved once per throttle event, then back up by RATE_INCREASE on success
+    assert bucket.rates == [80, 40, 20, 10]
+    assert bucket.rate == pytest.approx(10 + AXLScheduler.RATE_INCREASE)
+    transport.post(stub.url, b'<getPhone/>', HEADERS)
+    assert bucket.rate == pytest.approx(10 + 2 * AXLScheduler.RATE_INCREASE)
+
+
+def test_other_faults_are_not_retried(stub, bucket):
+    stub.replies = [(500, {}, MEMORY_FAULT.replace(b'Maximum AXL Memory Allocation Consumed', b'Item not valid'))]
+    response = AXLScheduler.ThrottledTransport(stub.url, bucket=bucket).post(stub.url, b'<getPhone/>', HEADERS)
+    assert response.status_code == 500
+    assert stub.requests == 1
+    assert bucket.rates == []
+
+
+def test_gives_up_after_retries(stub, bucket):
+    stub.replies = [(503, {}, b'')] * 10
+    response = AXLScheduler.ThrottledTransport(stub.url, bucket=bucket).post(stub.url, b'<getPhone/>', HEADERS)
+    # The 503 goes back to zeep, which raises its TransportError
+    assert response.status_code == 503
+    assert stub.requests == AXLScheduler.THROTTLE_RETRIES + 1
+    assert bucket.rates == [80, 40, 20, 10, 5, 2.5]
+
+
+def test_throttled_in_flight_calls_halve_once():
+    bucket = AXLScheduler.TokenBucket(rate=16)
+    assert bucket.throttled(5) == 8
+    # Other workers throttled during the same pause are the same event
+    assert bucket.throttled(5) == 8
+    assert bucket.reserve() > 4
+
+
+def test_backoff_honours_retry_after(monkeypatch):
+    class Response:
+        def __init__(self, retryAfter):
+            self.headers = {'Retry-After': retryAfter} if retryAfter is not None else {}
+
+    assert AXLScheduler._backoff(Response('7'), 0) == 7
+    assert AXLScheduler._backoff(Response('3600'), 0) == AXLScheduler.THROTTLE_BACKOFF_MAX
+    monkeypatch.setattr(AXLScheduler.random, 'uniform', lambda low, high: 1.0)
+    assert AXLScheduler._backoff(Response(None), 2) == AXLScheduler.THROTTLE_BACKOFF * 4
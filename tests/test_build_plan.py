@@ -0,0 +1,65 @@
+import copy
+
+from lxml import etree
+
+import BuildPlan
+import FakeAXLServer
+import PhoneBuild
+import Sites
+
+
+def _build():
+    return PhoneBuild.new_build('user00001', '10001', 'both', Sites.get_site('US', 'LOCATION1'),
+                                userEnteredPhoneModel='8845', phoneMac='001122334455')
+
+
+def _state(store):
+    # Everything the builds write, comparable whatever order the fields were set in
+    def fields(objects):
+        return {key: {field: etree.tostring(element, method='c14n') for field, element in objectFields.items()}
+                for key, objectFields in objects.items()}
+    return fields(store.phones), fields(store.users), fields(store.lines)
+
+
+def test_plan_compiles_to_fewer_calls():
+    build = _build()
+    steps = BuildPlan.plan_build(build)
+    assert [step['operation'] for step in steps] == [
+        'getUser', 'addPhone', 'updateLine', 'addPhone', 'updateLine', 'getUser', 'updateUser', 'updateUser',
+        'updatePhone', 'updatePhone']
+    compiled = BuildPlan.compile_plan(steps, build)
+    assert [step['operation'] for step in compiled] == [
+        'getUser', 'addPhone', 'updateLine', 'addPhone', 'updateUser', 'updateUser']
+    # One getUser for both reads, and each owner update rides on its addPhone
+    assert compiled[0]['fields'] == ('firstName', 'lastName', 'associatedDevices')
+    assert [len(step['extra']) for step in compiled if step['operation'] == 'addPhone'] == [1, 1]
+    # The plan passed in isn't changed
+    assert len(steps) == 10 and all(not step['extra'] for step in steps)
+
+
+def test_compile_drops_reads_the_build_answers():
+    build = _build()
+    PhoneBuild.set_user_names(build, 'First1', 'Last1')
+    build['currentAssociatedDevices'] = None
+    compiled = BuildPlan.compile_plan(BuildPlan.plan_build(build), build)
+    assert BuildPlan.describe(compiled) == '5 AXL calls: addPhone, updateLine, addPhone, updateUser, updateUser'
+
+
+def test_compiled_plan_builds_the_same(axl):
+    server, service = axl
+    FakeAXLServer.seed(server.store, users=3)
+    seeded = copy.deepcopy((server.store.phones, server.store.users, server.store.lines))
+
+    build = _build()
+    BuildPlan.run_plan(service, build, BuildPlan.plan_build(build))
+    uncompiled = _state(server.store)
+    assert server.calls['updatePhone'] == 2
+
+    server.store.phones, server.store.users, server.store.lines = seeded
+    server.calls.clear()
+    build = _build()
+    BuildPlan.run_plan(service, build, BuildPlan.compile_plan(BuildPlan.plan_build(build), build))
+    assert sum(server.calls.values()) == 6
+    assert _state(server.store) == uncompiled
+    phone = server.store.phones[build['deskPhoneDeviceName']]
+    assert phone['ownerUserName'].text == 'user00001'
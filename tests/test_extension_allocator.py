@@ -0,0 +1,87 @@
+import sys
+import threading
+
+import pytest
+
+import ExtensionAllocator
+import Preflight
+
+
+class PatternQueries:
+    # Answers the allocator's executeSQLQuery pages from a set of patterns
+
+    def __init__(self, patterns):
+        self.patterns = sorted(patterns)
+        self.queries = []
+
+    def __call__(self, service, sql):
+        self.queries.append(sql)
+        patterns = self.patterns
+        if ' between ' in sql:
+            low, high = sql.split(' between ')[1].split(' order by')[0].replace("'", '').split(' and ')
+            patterns = [pattern for pattern in patterns if low <= pattern <= high and len(pattern) == len(low)]
+        skip, first = (int(word) for word in sql.split()[2:5:2])
+        return [{'dnorpattern': pattern} for pattern in patterns[skip:skip + first]]
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    queries = PatternQueries(['10000', '10001', '10003', '010002', '+14155550100'] +
+                             [str(number) for number in range(10008, 10016)])
+    monkeypatch.setattr(Preflight, 'query', queries)
+    return queries
+
+
+def test_bitmap_free_skips_used_numbers():
+    used = ExtensionAllocator.Bitmap()
+    for pattern in ('10000', '10001', '10003'):
+        used.add(pattern)
+    assert used.free('10000', '10009', 3) == ['10002', '10004', '10005']
+    used.clear_range('10000', '10002')
+    assert '10001' not in used and '10003' in used
+    assert len(used) == 1
+
+
+def test_parse_range_rejects_mixed_lengths():
+    assert ExtensionAllocator.parse_range(' 10000 - 19999 ') == ('10000', '19999')
+    for extensionRange in ('10000', '1000-19999', '19999-10000', 'abc-def'):
+        with pytest.raises(ValueError):
+            ExtensionAllocator.parse_range(extensionRange)
+
+
+def test_allocate_reserves_until_released(queries):
+    allocator = ExtensionAllocator.ExtensionAllocator(None, 'ALL_IPPhones', pageSize=4)
+    assert allocator.allocate('10000-10019', 3) == ['10002', '10004', '10005']
+    # Non numeric and other length patterns don't block anything
+    assert allocator.allocate('10000-10019', 3) == ['10006', '10007', '10016']
+    allocator.release(['10004'])
+    assert allocator.free('10000-10019', 2) == ['10004', '10017']
+    with pytest.raises(ValueError):
+        allocator.allocate('10000-10019', 5)
+
+
+def test_concurrent_allocations_are_disjoint(queries):
+    queries.patterns = []
+    allocator = ExtensionAllocator.ExtensionAllocator(None, 'ALL_IPPhones')
+    allocator.load()
+    results = []
+    start = threading.Barrier(8)
+    # Switch threads as often as possible, so a gap between picking and reserving shows up
+    switchInterval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    def allocate():
+        start.wait()
+        for _ in range(25):
+            results.extend(allocator.allocate('10000-19999', 4))
+
+    threads = [threading.Thread(target=allocate) for _ in range(8)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switchInterval)
+    assert len(results) == 8 * 25 * 4
+    assert len(set(results)) == len(results)
@@ -0,0 +1,52 @@
+import FakeAXLServer
+import InventoryMirror
+import Preflight
+
+PARTITION = 'ALL_IPPhones'
+
+
+def _line(index, pattern):
+    return {'index': index, 'dirn': {'pattern': pattern, 'routePartitionName': PARTITION}}
+
+
+def test_sync_and_lookups(axl, tmp_path):
+    server, service = axl
+    FakeAXLServer.seed(server.store, users=4, phones=3, loggedIn=0.5)
+    server.store.add_phone({'name': 'SEPBBBB00000002', 'ownerUserName': 'user00001', 'description': "O'Brien <desk>",
+                            'lines': {'line': [_line(1, '10001'), _line(2, '10002')]}})
+    server.store.add_phone({'name': 'SEPBBBB00000001', 'ownerUserName': 'user00002',
+                            'lines': {'line': [_line(1, '10002')]}})
+    server.store.users['user00001']['associatedDevices'] = FakeAXLServer._element(
+        'associatedDevices', {'device': ['SEPBBBB00000002', 'SEP000000000001']})
+    # A gateway and a route pattern still clash with a new phone or line of the same name
+    server.store.otherDevices['SEPCCCC00000001'] = 2
+    server.store.otherPatterns[('10009', PARTITION)] = 5
+    mirror = InventoryMirror.InventoryMirror(server.url, path=str(tmp_path / 'inventory.sqlite'))
+    assert not mirror.fresh()
+    assert mirror.line_devices('10002', PARTITION) is None
+
+    server.calls.clear()
+    mirror.sync(service, pageSize=2)
+    # Every table paged 2 rows at a time, nothing but executeSQLQuery
+    assert set(server.calls) == {'executeSQLQuery'}
+    assert mirror.fresh() and not mirror.fresh(0)
+
+    assert mirror.line_devices('10002', PARTITION) == ['SEPBBBB00000001', 'SEPBBBB00000002']
+    assert mirror.line_devices('10003', PARTITION) == []
+    assert mirror.line_devices('99999', PARTITION) is None
+    assert mirror.device_lines('sepbbbb00000002') == [('10001', PARTITION), ('10002', PARTITION)]
+    assert mirror.device_owner('SEPBBBB00000002') == 'user00001'
+    assert mirror.user_devices('user00001') == ['SEP000000000001', 'SEPBBBB00000002']
+    assert mirror.logged_in_phones() == ['SEP000000000000', 'SEP000000000001']
+    # Not a directory number
+    assert mirror.line_devices('10009', PARTITION) is None
+    assert mirror.device_owner('SEPCCCC00000001') is None
+
+    # The same answers as Preflight.py's SQL against the cluster
+    names = ['SEPBBBB00000002', 'sepbbbb00000001', 'SEP000000000002', 'SEPCCCC00000001', 'SEPNOTFOUND']
+    assert mirror.existing_devices(names) == Preflight.existing_devices(service, names)
+    assert 'SEPCCCC00000001' in mirror.existing_devices(names)
+    extensions = ['10001', '10002', '10003', '10009', '99999']
+    lines = Preflight.existing_lines(service, PARTITION, extensions)
+    assert mirror.existing_lines(PARTITION, extensions) == {pattern: sorted(devices) for pattern, devices in lines.items()}
+    assert lines['10009'] == []
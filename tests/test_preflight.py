@@ -0,0 +1,99 @@
+import re
+
+import pytest
+
+import PhoneBuild
+import Preflight
+import Sites
+
+
+class ClusterQueries:
+    # Answers Preflight's DEVICE_SQL and LINE_SQL from {NAME: owner} and {(partition, pattern): [devices]}
+
+    def __init__(self, devices=None, lines=None):
+        self.devices = devices or {}
+        self.lines = lines or {}
+        self.queries = []
+
+    def __call__(self, service, sql):
+        self.queries.append(sql)
+        values = re.findall(r"'((?:[^']|'')*)'", sql.rsplit(' in (', 1)[1])
+        if sql.startswith('select d.name, eu.userid'):
+            return [{'name': name, 'userid': owner} if owner else {'name': name}
+                    for name, owner in sorted(self.devices.items()) if name in values]
+        partition = re.search(r"rp.name = '([^']*)'", sql).group(1)
+        return [{'dnorpattern': pattern, 'name': device} if device else {'dnorpattern': pattern}
+                for (linePartition, pattern), devices in sorted(self.lines.items())
+                if linePartition == partition and pattern in values for device in devices or [None]]
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    partition = Sites.get_site('US', 'LOCATION1')['routePartitionName']
+    cluster = ClusterQueries(lines={(partition, str(extension)): [] for extension in range(10001, 10006)})
+    monkeypatch.setattr(Preflight, 'query', cluster)
+    return cluster
+
+
+def _build(user, extension, buildType='desk', mac='001122334455', newLine=False):
+    build = PhoneBuild.new_build(user, extension, buildType, Sites.get_site('US', 'LOCATION1'),
+                                 userEnteredPhoneModel='8845' if buildType != 'jabber' else '', phoneMac=mac)
+    build['newLine'] = newLine
+    return build
+
+
+def test_clean_batch(cluster):
+    builds = {1: _build('user00001', '10001'), 2: _build('user00002', '10002', 'both', mac='001122334466')}
+    assert Preflight.check(None, builds) == ({}, {})
+
+
+def test_duplicates_within_the_batch(cluster):
+    builds = {1: _build('user00001', '10001'), 2: _build('user00002', '10001'),
+              3: _build('user00003', '10003', mac='0011223344AA')}
+    conflicts, warnings = Preflight.check(None, builds)
+    assert conflicts == {2: ['SEP001122334455 is also built by row 1', 'extension 10001 is also used by row 1']}
+    assert warnings == {}
+
+
+def test_devices_that_already_exist(cluster):
+    cluster.devices = {'SEP001122334455': 'someone', 'CSFUSER00002': None}
+    builds = {1: _build('user00001', '10001'), 2: _build('user00002', '10002', 'jabber')}
+    conflicts, warnings = Preflight.check(None, builds)
+    assert conflicts == {1: ['SEP001122334455 already exists, owned by someone'],
+                         2: ['csfuser00002 already exists']}
+    # A resumed build whose addPhone is journaled doesn't add that device again
+    conflicts, warnings = Preflight.check(None, builds, newDevices={1: [], 2: []})
+    assert conflicts == {}
+
+
+def test_extension_missing_or_shared(cluster):
+    partition = Sites.get_site('US', 'LOCATION1')['routePartitionName']
+    cluster.lines[(partition, '10002')] = ['SEPAAAAAAAAAAAA', 'SEP0011223344BB']
+    builds = {1: _build('user00001', '99999'), 2: _build('user00002', '10002', mac='0011223344BB')}
+    conflicts, warnings = Preflight.check(None, builds)
+    assert conflicts == {1: ['extension 99999 not found in ' + partition]}
+    # The build's own device on its line is no surprise, other devices are kept with a warning
+    assert warnings == {2: ['extension 10002 is already on SEPAAAAAAAAAAAA']}
+
+
+def test_new_lines_must_not_exist_yet(cluster):
+    partition = Sites.get_site('US', 'LOCATION1')['routePartitionName']
+    builds = {1: _build('user00001', '99999', newLine=True), 2: _build('user00002', '10002', mac='0011223344BB',
+                                                                        newLine=True)}
+    conflicts, warnings = Preflight.check(None, builds)
+    assert conflicts == {2: ['extension 10002 already exists in ' + partition]}
+    # newLines overrides the builds' newLine, e.g. once the addLine step is journaled
+    conflicts, warnings = Preflight.check(None, builds, newLines={1})
+    assert conflicts == {}
+
+
+def test_names_are_chunked(cluster):
+    builds = {row: _build(f'user{row:05d}', '10001', 'jabber') for row in range(1, 6)}
+    Preflight.check(None, builds, chunkSize=2)
+    assert len([sql for sql in cluster.queries if sql.startswith('select d.name')]) == 3
+    assert len([sql for sql in cluster.queries if sql.startswith('select n.dnorpattern')]) == 1
+
+
+def test_sql_strings_are_quoted():
+    assert Preflight.sql_string("O'Brien") == "'O''Brien'"
+    assert Preflight.sql_list(['a', "b'c"]) == "'a', 'b''c'"
@@ -0,0 +1,131 @@
+import copy
+import logging
+
+import BuildPlan
+import PhoneBuild
+import Reconcile
+import Sites
+
+
+class Returned(dict):
+    # A zeep object stand-in: fields by key and by attribute, None when missing
+    __getattr__ = dict.get
+
+
+class ForeignKey:
+    # zeep's XFkType: the name in _value_1 next to the uuid
+    def __init__(self, name):
+        self._value_1 = name
+        self.uuid = '{00000000-0000-0000-0000-000000000000}'
+
+
+def _build():
+    build = PhoneBuild.new_build('user00001', '10001', 'desk', Sites.get_site('US', 'LOCATION1'),
+                                 userEnteredPhoneModel='8845', phoneMac='001122334455')
+    PhoneBuild.set_user_names(build, 'First1', 'Last1')
+    return build
+
+
+def _in_sync(build, steps):
+    # What CUCM returns once the build has been applied
+    phone = next(step for step in steps if step['operation'] == 'addPhone')
+    desired = Reconcile._desired_phone(build, phone)
+    first, second = Reconcile._desired_users(build)
+    return {
+        phone['key']: Returned(copy.deepcopy(desired)),
+        ('line', build['phoneExt'], build['routePartitionName']): Returned(PhoneBuild.line_update(build)),
+        ('user', build['phoneUsername']): Returned(first, primaryExtension=second['primaryExtension']),
+    }
+
+
+def test_booleans_and_foreign_keys_compare_as_text():
+    assert Reconcile._matches('true', 't')
+    assert Reconcile._matches(True, 'true')
+    assert Reconcile._matches('false', 'f')
+    assert not Reconcile._matches('true', 'f')
+    assert Reconcile._matches('LOCATION1_PHONES', ForeignKey('LOCATION1_PHONES'))
+    assert not Reconcile._matches('LOCATION1_PHONES', ForeignKey('LOCATION2_PHONES'))
+    assert Reconcile._matches('', None)
+    desired = {'name': 'SEP001122334455', 'devicePoolName': 'LOCATION1_PHONES', 'allowCtiControlFlag': 'true',
+               'description': 'First1 Last1'}
+    current = {'devicePoolName': ForeignKey('LOCATION1_PHONES'), 'allowCtiControlFlag': 't',
+               'description': 'First1 Last1 (old)'}
+    assert Reconcile.diff(desired, current, 'phone') == {'description': 'First1 Last1'}
+
+
+def test_identity_and_action_fields_are_not_compared():
+    desired = {'name': 'SEP001122334455', 'product': 'Cisco 8845', 'certificateOperation': 'No Pending Operation',
+               'securityProfileName': None}
+    assert Reconcile.diff(desired, {'product': 'Cisco 7841'}, 'phone') == {}
+    assert Reconcile.returned_tags(desired, 'phone') == {}
+
+
+def test_member_lists_keep_existing_members():
+    desired = {'userid': 'user00001', 'associatedDevices': {'device': ['SEP001122334455']},
+               'associatedGroups': {'userGroup': [{'name': 'Standard CCM End Users'},
+                                                  {'name': 'Standard CTI Enabled'}]}}
+    current = {'associatedDevices': {'device': ['CSFUSER00001']},
+               'associatedGroups': {'userGroup': [{'name': 'Standard CCM End Users'}, {'name': 'Help Desk'}]}}
+    assert Reconcile.diff(desired, current, 'user') == {
+        'associatedDevices': {'device': ['CSFUSER00001', 'SEP001122334455']},
+        'associatedGroups': {'userGroup': [{'name': 'Standard CCM End Users'}, {'name': 'Help Desk'},
+                                           {'name': 'Standard CTI Enabled'}]},
+    }
+    # Everything there already, whatever else the user has
+    current['associatedDevices']['device'].append('SEP001122334455')
+    current['associatedGroups']['userGroup'].append({'name': 'Standard CTI Enabled'})
+    assert Reconcile.diff(desired, current, 'user') == {}
+
+
+def test_phone_lines_match_by_index():
+    desired = {'line': [{'index': 1, 'label': 'First1 Last1 - 10001', 'dirn': {'pattern': '10001'}}]}
+    current = {'line': [{'index': '2', 'label': 'Shared', 'dirn': {'pattern': '10500'}},
+                        {'index': '1', 'label': 'First1 Last1 - 10001', 'dirn': {'pattern': '10001'}}]}
+    assert Reconcile._matches(desired, current)
+    current['line'][1]['label'] = 'Old label'
+    assert not Reconcile._matches(desired, current)
+    assert Reconcile.diff({'name': 'SEP001122334455', 'lines': desired}, {'lines': {'line': [current['line'][1]]}},
+                          'phone') == {'lines': desired}
+
+
+def test_phone_with_extra_lines_is_not_rewritten(caplog):
+    desired = {'name': 'SEP001122334455', 'description': 'First1 Last1',
+               'lines': {'line': [{'index': 1, 'label': 'First1 Last1 - 10001'}]}}
+    current = {'description': 'Old', 'lines': {'line': [{'index': '1', 'label': 'Old label'},
+                                                        {'index': '2', 'label': 'Shared'}]}}
+    with caplog.at_level(logging.WARNING):
+        assert Reconcile.diff(desired, current, 'phone') == {'description': 'First1 Last1'}
+    assert 'has lines the build does not' in caplog.text
+
+
+def test_objects_in_sync_are_left_out():
+    build = _build()
+    steps = BuildPlan.compile_plan(BuildPlan.plan_build(build), build)
+    reconciled, inSync = Reconcile.reconcile_plan(build, steps, _in_sync(build, steps))
+    assert reconciled == []
+    assert inSync == ['phone SEP001122334455', 'line 10001 ' + build['routePartitionName'], 'user user00001']
+
+
+def test_only_differences_are_sent():
+    build = _build()
+    steps = BuildPlan.compile_plan(BuildPlan.plan_build(build), build)
+    current = _in_sync(build, steps)
+    current[('phone', 'SEP001122334455')]['callingSearchSpaceName'] = ForeignKey('OLD_CSS')
+    current[('line', build['phoneExt'], build['routePartitionName'])]['description'] = 'Old description'
+    reconciled, inSync = Reconcile.reconcile_plan(build, steps, current)
+    assert [(step['operation'], step['kwargs'](build)) for step in reconciled] == [
+        ('updatePhone', {'name': 'SEP001122334455', 'callingSearchSpaceName': build['callingSearchSpaceName']}),
+        ('updateLine', {'pattern': '10001', 'routePartitionName': build['routePartitionName'],
+                        'description': build['phoneDescription']}),
+    ]
+    assert inSync == ['user user00001']
+
+
+def test_missing_phone_is_added_in_full():
+    build = _build()
+    steps = BuildPlan.compile_plan(BuildPlan.plan_build(build), build)
+    current = _in_sync(build, steps)
+    current[('phone', 'SEP001122334455')] = None
+    reconciled, inSync = Reconcile.reconcile_plan(build, steps, current)
+    assert [step['operation'] for step in reconciled] == ['addPhone']
+    assert reconciled[0]['extra'], 'the owner is still folded into the addPhone'